@@ -0,0 +1,125 @@
+import asyncio
+from datetime import datetime, date
+import logging
+import config
+from database import booking_horizon
+
+logger = logging.getLogger(__name__)
+
+WORK_WEEKDAYS = (0, 2, 4)  # пн, ср, пт
+
+
+class AvailabilityIndex:
+    """Индекс занятости рабочих дней на горизонте бронирования.
+
+    Основной источник - таблица bookings в SQLite, индекс обновляется событиями
+    бронирования. Даты, отмеченные вручную в Google Sheets, подмешиваются
+    фоновой задачей, поэтому пользователь никогда не ждет ответа Google.
+    """
+
+    def __init__(self, db, sheets_cache=None, months=config.BOOKING_HORIZON_MONTHS):
+        self.db = db
+        self.sheets_cache = sheets_cache
+        self.months = months
+        self.version = 0
+
+        self._days = {}  # порядковый номер дня (date.toordinal()) -> True если день занят
+        self._db_booked = set()
+        self._sheet_booked = set()
+        self._built_for = None
+        self._booked_strings = frozenset()
+
+    async def rebuild(self, **_):
+        """Перестраивает индекс по базе данных одним запросом"""
+        start, end = booking_horizon(self.months)
+        self._db_booked = set(await self.db.get_booked_ordinals(start, end))
+        self._built_for = date.today()
+        self._refresh()
+        logger.info(f"Индекс доступности построен: {start} - {end}, занято дней: {len(self._db_booked)}")
+
+    def _refresh(self):
+        """Пересчитывает занятость дней горизонта и версию"""
+        start, end = booking_horizon(self.months)
+        booked = self._db_booked | self._sheet_booked
+
+        # date.weekday() == (ordinal - 1) % 7
+        days = {day: day in booked for day in range(start.toordinal(), end.toordinal() + 1)
+                if (day - 1) % 7 in WORK_WEEKDAYS}
+
+        if days != self._days:
+            self._days = days
+            self._booked_strings = frozenset(date.fromordinal(day).strftime("%d.%m.%Y")
+                                             for day, busy in days.items() if busy)
+            self.version += 1
+
+    def _ensure_current(self):
+        # Горизонт сдвигается вместе с текущей датой; база перечитывается
+        # фоновой сверкой, здесь достаточно пересчитать дни в памяти
+        if self._built_for != date.today():
+            self._built_for = date.today()
+            self._refresh()
+
+    @staticmethod
+    def _to_ordinal(booking_date):
+        if isinstance(booking_date, datetime):
+            return booking_date.date().toordinal()
+        if isinstance(booking_date, date):
+            return booking_date.toordinal()
+        return date.fromisoformat(booking_date).toordinal()
+
+    def is_available(self, booking_date):
+        """Проверяет, свободна ли дата (без обращений к Google)"""
+        self._ensure_current()
+        day = self._to_ordinal(booking_date)
+        if day in self._days:
+            return not self._days[day]
+        return day not in self._db_booked and day not in self._sheet_booked
+
+    def booked_dates(self):
+        """Занятые даты горизонта в формате DD.MM.YYYY для клавиатур"""
+        self._ensure_current()
+        return self._booked_strings
+
+    def on_booking_paid(self, booking_date, **_):
+        """Предоплата получена - день занят"""
+        self._db_booked.add(self._to_ordinal(booking_date))
+        self._refresh()
+
+    async def on_booking_changed(self, booking_date, **_):
+        """Отмена или завершение - перепроверяем день по базе"""
+        day = self._to_ordinal(booking_date)
+        booking_date = date.fromordinal(day)
+        if await self.db.get_booked_ordinals(booking_date, booking_date):
+            self._db_booked.add(day)
+        else:
+            self._db_booked.discard(day)
+        self._refresh()
+
+    def merge_sheet_dates(self, sheet_dates):
+        """Подмешивает даты, занятые вручную в Google Sheets.
+
+        None (таблицу прочитать не удалось) оставляет прежний набор.
+        """
+        if sheet_dates is None:
+            return
+        merged = set()
+        for date_str in sheet_dates:
+            try:
+                merged.add(datetime.strptime(date_str.strip(), "%d.%m.%Y").toordinal())
+            except ValueError:
+                logger.warning(f"Некорректная дата в Google Sheets: {date_str}")
+        self._sheet_booked = merged
+        self._refresh()
+
+    async def start_reconciler(self, interval=config.AVAILABILITY_SYNC_INTERVAL):
+        """Периодически сверяет индекс с Google Sheets"""
+        while True:
+            try:
+                if self._built_for != date.today():
+                    await self.rebuild()
+                if self.sheets_cache:
+                    self.merge_sheet_dates(await self.sheets_cache.get())
+            except Exception as e:
+                logger.error(f"Ошибка сверки доступности с Google Sheets: {e}")
+
+            await asyncio.sleep(interval)
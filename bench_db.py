@@ -0,0 +1,72 @@
+"""Бенчмарк записи в SQLite: журнал отката, WAL и групповой коммит.
+
+Запускает N одновременных подтверждений оплаты (save_payment_info +
+update_payment_status) через AsyncDatabase во временной базе и печатает
+записей в секунду для каждого режима.
+
+    python bench_db.py --payments 500 --concurrency 50
+"""
+import argparse
+import asyncio
+import logging
+import os
+import tempfile
+import time
+import config
+from database import AsyncDatabase
+
+MODES = [
+    ("DELETE + FULL (как раньше)", dict(journal_mode='DELETE', synchronous='FULL', group_commit=False)),
+    ("WAL + NORMAL", dict(journal_mode='WAL', synchronous='NORMAL', group_commit=False)),
+    ("WAL + NORMAL + групповой коммит", dict(journal_mode='WAL', synchronous='NORMAL', group_commit=True)),
+    ("WAL + FULL", dict(journal_mode='WAL', synchronous='FULL', group_commit=False)),
+    ("WAL + FULL + групповой коммит", dict(journal_mode='WAL', synchronous='FULL', group_commit=True)),
+]
+
+
+async def confirm_payments(db, payments, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def confirm(i):
+        async with semaphore:
+            user_id, booking_date = 700000 + i, f"2030-{i % 12 + 1:02d}-{i % 28 + 1:02d}"
+            await db.add_booking(user_id, f"bench{i}", f"Бенчмарк {i}", booking_date)
+            await db.save_payment_info(user_id, f"bench-{i}", 4000, booking_date, "deposit")
+            await db.update_payment_status(f"bench-{i}", "succeeded")
+
+    await asyncio.gather(*(confirm(i) for i in range(payments)))
+
+
+def run(payments, concurrency, window):
+    results = []
+    for name, options in MODES:
+        with tempfile.TemporaryDirectory() as tmp:
+            db = AsyncDatabase(os.path.join(tmp, "bench.db"), group_window=window, **options)
+            started = time.perf_counter()
+            asyncio.run(confirm_payments(db, payments, concurrency))
+            elapsed = time.perf_counter() - started
+            db.close()
+        writes = payments * 3
+        results.append((name, writes, elapsed, writes / elapsed))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--payments", type=int, default=300, help="сколько оплат подтвердить")
+    parser.add_argument("--concurrency", type=int, default=50, help="одновременных обработчиков")
+    parser.add_argument("--window", type=float, default=config.DB_GROUP_COMMIT_WINDOW,
+                        help="окно группового коммита, секунд")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    results = run(args.payments, args.concurrency, args.window)
+
+    baseline = results[0][3]
+    print(f"{'режим':<36}{'записей':>10}{'секунд':>10}{'записей/с':>12}{'ускорение':>11}")
+    for name, writes, elapsed, rate in results:
+        print(f"{name:<36}{writes:>10}{elapsed:>10.2f}{rate:>12.0f}{rate / baseline:>10.1f}x")
+
+
+if __name__ == "__main__":
+    main()
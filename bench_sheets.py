@@ -0,0 +1,98 @@
+"""Бенчмарк количества запросов GoogleSheets на листе в памяти.
+
+Прогоняет N бронирований через add_booking -> update_booking_status ->
+mark_brief_completed и печатает запросы к API, трафик и время на операцию.
+
+    python bench_sheets.py --bookings 200 --history 5000 --latency 0.01
+    python bench_sheets.py --max-calls-per-op 2  # ненулевой код выхода при регрессии
+"""
+import argparse
+import logging
+import sys
+import time
+from datetime import date, timedelta
+from fake_sheets import InMemoryWorksheet
+from google_sheets import GoogleSheets, HEADERS
+
+
+def make_history(size):
+    """Старые завершенные брони, которые есть в любой рабочей таблице"""
+    rows = [HEADERS]
+    start = date(2020, 1, 6)
+    for i in range(size):
+        day = start + timedelta(days=i)
+        rows.append([day.strftime("%d.%m.%Y 10:00"), 500000 + i, f"user{i}", f"Клиент {i}",
+                     day.strftime("%d.%m.%Y"), "Проект завершен", "Проект завершен", f"pay-{i}",
+                     4000, 11000, "Да", "", ""])
+    return rows
+
+
+def measure(worksheet, name, count, operation):
+    worksheet.reset_stats()
+    started = time.perf_counter()
+    for i in range(count):
+        operation(i)
+    elapsed = time.perf_counter() - started
+    return {
+        'operation': name,
+        'count': count,
+        'calls': worksheet.api_calls,
+        'errors': worksheet.errors,
+        'calls_per_op': worksheet.api_calls / count,
+        'bytes_per_op': (worksheet.bytes_sent + worksheet.bytes_received) / count,
+        'ms_per_op': elapsed * 1000 / count,
+    }
+
+
+def run(bookings, history, latency, error_rate, seed=1):
+    worksheet = InMemoryWorksheet(make_history(history), latency=latency, error_rate=error_rate, seed=seed)
+    sheets = GoogleSheets(worksheet=worksheet)
+    # Окно накопления не нужно: пакеты отправляем явно
+    sheets.writes.delay = 3600
+
+    first_day = date(2030, 1, 7)
+    users = [{'user_id': 900000 + i, 'username': f'bench{i}', 'full_name': f'Бенчмарк {i}'}
+             for i in range(bookings)]
+    days = [first_day + timedelta(days=i) for i in range(bookings)]
+
+    results = [
+        measure(worksheet, "add_booking", bookings,
+                lambda i: sheets.add_booking(users[i], days[i], f"bench-{i}")),
+        measure(worksheet, "update_booking_status", bookings,
+                lambda i: sheets.update_booking_status(users[i]['user_id'], days[i].isoformat())),
+        measure(worksheet, "mark_brief_completed", bookings,
+                lambda i: sheets.mark_brief_completed(users[i]['user_id'])),
+        measure(worksheet, "flush_writes", 1, lambda i: sheets.flush_writes()),
+    ]
+    return results, sheets.writes.stats()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--bookings", type=int, default=100, help="сколько бронирований прогнать")
+    parser.add_argument("--history", type=int, default=1000, help="строк в таблице до начала прогона")
+    parser.add_argument("--latency", type=float, default=0.0, help="задержка одного запроса, секунд")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="доля ответов 429")
+    parser.add_argument("--max-calls-per-op", type=float, default=None,
+                        help="порог запросов на операцию; при превышении код выхода 1")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    results, write_stats = run(args.bookings, args.history, args.latency, args.error_rate)
+
+    print(f"{'операция':<24}{'кол-во':>8}{'запросов':>10}{'429':>6}{'запр/оп':>10}{'байт/оп':>12}{'мс/оп':>10}")
+    for r in results:
+        print(f"{r['operation']:<24}{r['count']:>8}{r['calls']:>10}{r['errors']:>6}"
+              f"{r['calls_per_op']:>10.2f}{r['bytes_per_op']:>12.0f}{r['ms_per_op']:>10.3f}")
+    print(f"Буфер записи: {write_stats}")
+
+    if args.max_calls_per_op is not None:
+        worst = max((r for r in results if r['count'] > 1), key=lambda r: r['calls_per_op'])
+        if worst['calls_per_op'] > args.max_calls_per_op:
+            print(f"Регрессия: {worst['operation']} делает {worst['calls_per_op']:.2f} запросов "
+                  f"на операцию (порог {args.max_calls_per_op})")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
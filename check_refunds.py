@@ -0,0 +1,116 @@
+"""Проверка учета возвратов: частичный, затем полный возврат.
+
+Во временной базе с FakeYooKassa оплачивает предоплату 4000 ₽ и делает
+возврат 1000 ₽, затем остатка - двумя путями: как команда /refund
+(PaymentManager.process_refund) и через уведомление refund.succeeded на
+вебхук. После каждого шага сверяет статус платежа и monthly_revenue.
+Код выхода 1, если что-то не сошлось.
+
+    python check_refunds.py
+"""
+import asyncio
+import logging
+import os
+import socket
+import sys
+import tempfile
+import uuid
+import config
+from database import AsyncDatabase
+from fake_yookassa import FakeYooKassa
+from webhooks import YooKassaWebhook
+from yookassa_client import YooKassaClient
+import payments
+
+AMOUNT, PARTIAL = 4000.0, 1000.0
+BOOKING_DATE = "2030-01-15"
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def _expect(db, payment_id, status, revenue, step, failures):
+    payment = await db.get_payment_info(payment_id)
+    collected = sum(row[3] + row[4] for row in await db.get_monthly_revenue())
+    ok = payment.status == status and abs(collected - revenue) < 0.01
+    print(f"{'OK  ' if ok else 'FAIL'} {step}: статус {payment.status}, выручка {collected:.2f} ₽ "
+          f"(ожидалось {status}, {revenue:.2f} ₽)")
+    if not ok:
+        failures.append(step)
+
+
+async def _paid_deposit(db, fake, manager, user_id):
+    payment = await manager.create_payment(AMOUNT, "Предоплата", user_id, BOOKING_DATE)
+    fake.set_status(payment["id"], "succeeded")
+    await db.update_payment_status(payment["id"], "succeeded")
+    return payment["id"]
+
+
+async def check_command(db, fake, failures):
+    """Возвраты командой /refund"""
+    manager = payments.PaymentManager()
+    payment_id = await _paid_deposit(db, fake, manager, 1)
+    await _expect(db, payment_id, "succeeded", AMOUNT, "/refund: оплата", failures)
+
+    await payments.PaymentManager.process_refund(payment_id, PARTIAL)
+    await _expect(db, payment_id, "succeeded", AMOUNT - PARTIAL, "/refund: частичный возврат", failures)
+
+    await payments.PaymentManager.process_refund(payment_id)
+    await _expect(db, payment_id, "refunded", 0, "/refund: возврат остатка", failures)
+
+
+async def check_webhook(db, fake, client, failures):
+    """Возвраты, о которых сообщает уведомление ЮKassa"""
+    async def on_confirmed(payment):
+        pass
+
+    webhook = YooKassaWebhook(db, client, on_confirmed, trusted_networks=["127.0.0.1/32"])
+    port = _free_port()
+    await webhook.start("127.0.0.1", port)
+    fake.webhook_url = f"http://127.0.0.1:{port}{config.WEBHOOK_PATH}"
+    try:
+        payment_id = await _paid_deposit(db, fake, payments.PaymentManager(), 2)
+        for amount, status, revenue, step in ((PARTIAL, "succeeded", AMOUNT - PARTIAL, "частичный возврат"),
+                                              (AMOUNT - PARTIAL, "refunded", 0, "возврат остатка")):
+            refund = await client.create_refund({"payment_id": payment_id,
+                                                 "amount": {"value": f"{amount:.2f}", "currency": "RUB"}},
+                                                str(uuid.uuid4()))
+            code = await fake.notify("refund.succeeded", refund)
+            if code != 200:
+                failures.append(f"вебхук: {step} (HTTP {code})")
+            await _expect(db, payment_id, status, revenue, f"вебхук: {step}", failures)
+    finally:
+        await webhook.stop()
+
+
+async def run(path):
+    db = AsyncDatabase(path)
+    fake = await FakeYooKassa().start()
+    client = YooKassaClient("shop", "secret", base_url=fake.base_url)
+    payments.db, payments.yookassa = db, client
+    failures = []
+    try:
+        await check_command(db, fake, failures)
+        # Первый платеж к этому моменту возвращен целиком и в выручку не входит
+        await check_webhook(db, fake, client, failures)
+    finally:
+        await client.close()
+        await fake.stop()
+        db.close()
+    return failures
+
+
+def main():
+    logging.basicConfig(level=logging.WARNING)
+    with tempfile.TemporaryDirectory() as tmp:
+        failures = asyncio.run(run(os.path.join(tmp, "refunds.db")))
+    if failures:
+        print(f"Не сошлось: {', '.join(failures)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -50,4 +50,106 @@ EXAMPLES = {
 }
 
 # Настройки напоминаний
-REMINDER_HOUR = 12  # время отправки напоминаний (9 утра)
\ No newline at end of file
+REMINDER_HOUR = 12  # время отправки напоминаний (9 утра)
+
+# Настройки работы с Google Sheets
+SHEETS_MAX_WORKERS = 4  # потоков для запросов к Google Sheets
+SHEETS_CALL_TIMEOUT = 15  # таймаут одного вызова, секунд
+SHEETS_CONNECT_TIMEOUT = 60  # таймаут авторизации и открытия таблицы при старте, секунд
+SHEETS_RECONNECT_INTERVAL = 60  # пауза между попытками подключения, секунд
+SHEETS_WRITE_FLUSH_DELAY = 2.0  # окно накопления изменений ячеек перед batch_update, секунд
+BOOKED_DATES_TTL = 300  # время жизни кэша занятых дат, секунд
+
+# Настройки календаря
+BOOKING_HORIZON_MONTHS = 6  # на сколько месяцев вперед можно бронировать
+AVAILABILITY_SYNC_INTERVAL = 300  # как часто подмешивать ручные правки из Google Sheets, секунд
+SHEETS_SYNC_INTERVAL = 600  # как часто синхронизировать bookings с Google Sheets, секунд
+
+# Архивация завершенных проектов в Google Sheets
+ARCHIVE_AFTER_DAYS = 30  # переносить проекты, завершенные раньше чем столько дней назад
+ARCHIVE_PER_YEAR = True  # отдельный архивный лист на каждый год
+ARCHIVE_SHEET_TITLE = "Архив"
+ARCHIVE_INTERVAL = 24 * 60 * 60  # как часто запускать архивацию, секунд
+ARCHIVE_TIMEOUT = 120  # таймаут одного прогона архивации, секунд
+
+# База данных
+DB_PATH = 'bookings.db'
+DB_READERS = 3  # соединений для чтения
+DB_JOURNAL_MODE = 'WAL'  # читатели не ждут писателя
+DB_SYNCHRONOUS = 'NORMAL'  # в WAL fsync только на checkpoint, коммит не теряет целостность
+DB_CACHE_SIZE_KB = 16 * 1024  # кэш страниц на соединение
+DB_MMAP_SIZE = 64 * 1024 * 1024  # чтение файла базы через mmap, байт
+DB_BUSY_TIMEOUT = 5000  # ожидание блокировки, миллисекунд
+DB_GROUP_COMMIT = False  # объединять записи в одну транзакцию (см. AsyncDatabase)
+DB_GROUP_COMMIT_WINDOW = 0.001  # окно накопления записей, секунд (пока идет коммит, записи копятся и так)
+DB_GROUP_COMMIT_MAX = 200  # максимум записей в одной транзакции
+
+# Состояния диалогов (FSM)
+FSM_CACHE_SIZE = 1000  # ключей в LRU-кэше (0 - без кэша, если процессов бота несколько)
+FSM_STATE_TTL = 7 * 24 * 60 * 60  # через сколько удалять неизменявшееся состояние, секунд
+FSM_SWEEP_INTERVAL = 60 * 60  # как часто удалять брошенные состояния, секунд
+
+# Админка
+ADMIN_BOOKINGS_PAGE_SIZE = 10  # броней на странице /bookings
+STATS_WEEKS_AHEAD = 4  # на сколько недель вперед показывать загрузку в /stats
+
+# Обслуживание базы
+MAINTENANCE_INTERVAL = 24 * 60 * 60  # как часто запускать резервную копию и очистку, секунд
+BACKUP_DIR = 'backups'
+BACKUP_KEEP = 7  # сколько последних копий хранить
+BACKUP_PAGES = 64  # страниц за один шаг копирования
+BACKUP_STEP_PAUSE = 0.005  # пауза между шагами копирования, секунд
+RETENTION_DAYS = 30  # через сколько дней удалять неоплаченные брони и зависшие платежи
+RETENTION_BATCH = 200  # строк за одну транзакцию удаления
+VACUUM_PAGES = 256  # страниц за один шаг incremental_vacuum
+BOOKING_PAYMENT_TTL = 24 * 60 * 60  # сколько ждать предоплату до истечения брони, секунд
+EXPIRY_SWEEP_INTERVAL = 5 * 60  # как часто истекать неоплаченные брони, секунд
+
+# API ЮKassa
+YKASSA_API_URL = "https://api.yookassa.ru/v3"
+YKASSA_TIMEOUT = 15  # таймаут одного запроса, секунд
+YKASSA_POOL_SIZE = 10  # соединений в пуле
+YKASSA_RETRIES = 2  # повторов при сетевых ошибках и ответах 5xx
+
+# Уведомления ЮKassa (вебхук). Без него оплату подтверждает фоновая проверка
+# платежей; включать после настройки URL уведомлений в личном кабинете ЮKassa
+WEBHOOK_ENABLED = False
+WEBHOOK_HOST = "0.0.0.0"
+WEBHOOK_PORT = 8080
+WEBHOOK_PATH = "/yookassa/webhook"
+WEBHOOK_CONCURRENCY = 10  # одновременных запросов к API при обработке уведомлений
+# Адреса, с которых ЮKassa отправляет уведомления
+WEBHOOK_TRUSTED_NETWORKS = [
+    "185.71.76.0/27",
+    "185.71.77.0/27",
+    "77.75.153.0/25",
+    "77.75.156.11/32",
+    "77.75.156.35/32",
+    "77.75.154.128/25",
+    "2a02:5180::/32",
+]
+# Адреса своего обратного прокси (nginx и т.п.). Если вебхук стоит за прокси,
+# без этого списка все уведомления придут с адреса прокси и будут отклонены;
+# с ним адрес ЮKassa берется из X-Forwarded-For
+WEBHOOK_TRUSTED_PROXIES = []
+
+# Фоновая проверка ожидающих платежей
+PAYMENT_POLL_TICK = 5  # как часто искать платежи, которые пора проверить, секунд
+PAYMENT_POLL_BATCH = 20  # платежей за один цикл (потолок запросов к API)
+PAYMENT_POLL_CONCURRENCY = 5  # одновременных запросов к API
+# Интервал проверки по возрасту платежа: (возраст до, интервал), секунд
+PAYMENT_POLL_INTERVALS = [
+    (10 * 60, 5),
+    (60 * 60, 30),
+    (6 * 60 * 60, 5 * 60),
+]
+PAYMENT_POLL_MAX_INTERVAL = 30 * 60  # для платежей старше последней границы
+
+# Повторная выдача неоплаченного платежа (двойное нажатие «Оплатить»)
+PAYMENT_REUSE_TTL = 30 * 60  # сколько отдавать ту же ссылку на оплату, секунд (меньше срока жизни платежа в ЮKassa)
+
+# Ночная сверка платежей с ЮKassa
+RECONCILE_HOUR = 4  # во сколько запускать сверку
+RECONCILE_WINDOW_DAYS = 3  # за сколько последних дней сверять платежи (с перекрытием)
+RECONCILE_PAGE_SIZE = 100  # объектов на страницу списка ЮKassa (максимум 100)
+RECONCILE_REPORT_LIMIT = 20  # сколько расхождений перечислять в отчете админу
@@ -1,125 +1,327 @@
+import asyncio
 import sqlite3
-from datetime import datetime
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import calendar
+from datetime import date, datetime, timedelta
 import logging
+import config
+from records import Booking, PaymentRecord
 
 logger = logging.getLogger(__name__)
 
+# Даты из записей (Booking.booking_date) передаются в запросы как YYYY-MM-DD
+sqlite3.register_adapter(date, date.isoformat)
+
+# Из каких статусов платеж может перейти в данный (см. update_payment_status).
+# Возвращенный платеж ЮKassa по-прежнему отдает как succeeded, поэтому из
+# 'refunded' выхода нет; 'canceled' -> 'succeeded' исправляет сверка.
+PAYMENT_TRANSITIONS = {
+    'succeeded': ('pending', 'canceled'),
+    'canceled': ('pending',),
+    'refunded': ('pending', 'succeeded'),
+}
+
 
 class Database:
-    def __init__(self):
-        self.conn = sqlite3.connect('bookings.db', check_same_thread=False)
-        self.create_tables()
-
-    def create_tables(self):
-        """Создает таблицы в базе данных"""
-        cursor = self.conn.cursor()
-
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS bookings (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER,
-                username TEXT,
-                full_name TEXT,
-                booking_date TEXT,
-                status TEXT DEFAULT 'active',
-                deposit_paid BOOLEAN DEFAULT FALSE,
-                final_paid BOOLEAN DEFAULT FALSE,
-                brief_completed BOOLEAN DEFAULT FALSE,
-                payment_id TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
+    def __init__(self, path=config.DB_PATH, create=True, journal_mode=config.DB_JOURNAL_MODE,
+                 synchronous=config.DB_SYNCHRONOUS):
+        # Каждое соединение используется только своим потоком (см. AsyncDatabase)
+        self.conn = sqlite3.connect(path, timeout=config.DB_BUSY_TIMEOUT / 1000)
+        # Пока True, методы записи сами завершают транзакцию; при групповом
+        # коммите AsyncDatabase выключает его и коммитит пачку целиком
+        self.autocommit = True
+        self._configure(journal_mode, synchronous)
+        if create:
+            self.migrate()
 
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS payments (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER,
-                payment_id TEXT UNIQUE,
-                amount REAL,
-                payment_type TEXT,
-                status TEXT DEFAULT 'pending',
-                booking_date TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
+    def _configure(self, journal_mode, synchronous):
+        """Настраивает соединение: WAL, fsync, кэш страниц и ожидание блокировок"""
+        cursor = self.conn.cursor()
+        # Действует для новой базы; существующую переводит python maintenance.py convert
+        cursor.execute('PRAGMA auto_vacuum = INCREMENTAL')
+        mode = cursor.execute(f'PRAGMA journal_mode = {journal_mode}').fetchone()[0]
+        if mode.lower() != journal_mode.lower() and mode != 'memory':
+            logger.warning(f"SQLite не включил journal_mode={journal_mode}, используется {mode}")
+        cursor.execute(f'PRAGMA synchronous = {synchronous}')
+        cursor.execute(f'PRAGMA cache_size = -{config.DB_CACHE_SIZE_KB}')
+        cursor.execute(f'PRAGMA mmap_size = {config.DB_MMAP_SIZE}')
+        cursor.execute(f'PRAGMA busy_timeout = {config.DB_BUSY_TIMEOUT}')
+        cursor.execute('PRAGMA temp_store = MEMORY')
 
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS support_chats (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER,
-                username TEXT,
-                full_name TEXT,
-                active BOOLEAN DEFAULT TRUE,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
+    def _cursor(self, record=None):
+        """Курсор, который возвращает строки как record (Booking, PaymentRecord)"""
+        cursor = self.conn.cursor()
+        if record is not None:
+            cursor.row_factory = record.row_factory
+        return cursor
 
-        self.conn.commit()
+    def _commit(self):
+        if self.autocommit:
+            self.conn.commit()
+
+    def migrate(self):
+        """Доводит схему базы до последней версии (PRAGMA user_version)"""
+        cursor = self.conn.cursor()
+        version = cursor.execute('PRAGMA user_version').fetchone()[0]
+
+        for number, (description, migration) in enumerate(MIGRATIONS, start=1):
+            if number <= version:
+                continue
+            # Каждая миграция - отдельная транзакция вместе с номером версии
+            cursor.execute('BEGIN')
+            try:
+                migration(cursor)
+                cursor.execute(f'PRAGMA user_version = {number}')
+                self.conn.commit()
+            except Exception:
+                self.conn.rollback()
+                logger.error(f"Ошибка миграции базы {number}: {description}")
+                raise
+            logger.info(f"Применена миграция базы {number}: {description}")
+
+    def check_query_plans(self):
+        """Проверяет через EXPLAIN QUERY PLAN, что частые запросы идут по индексам.
+
+        Вызывает методы из HOT_QUERIES, перехватывает их SQL и возвращает
+        список (метод, запрос, план, есть ли полный просмотр таблицы).
+        """
+        statements = []
+        self.conn.set_trace_callback(statements.append)
+        try:
+            calls = []
+            for name, args in HOT_QUERIES:
+                start = len(statements)
+                getattr(self, name)(*args)
+                calls.append((name, statements[start:]))
+        finally:
+            self.conn.set_trace_callback(None)
+
+        cursor = self.conn.cursor()
+        report = []
+        for name, sqls in calls:
+            for sql in sqls:
+                plan = [row[3] for row in cursor.execute(f'EXPLAIN QUERY PLAN {sql}')]
+                full_scan = any(step.startswith('SCAN') for step in plan)
+                report.append((name, ' '.join(sql.split()), plan, full_scan))
+        return report
 
     def add_booking(self, user_id, username, full_name, booking_date):
         """Добавляет бронирование в базу"""
         cursor = self.conn.cursor()
+        # Неоплаченная бронь истекает через BOOKING_PAYMENT_TTL (см. expire_bookings)
         cursor.execute('''
-            INSERT INTO bookings (user_id, username, full_name, booking_date, status)
-            VALUES (?, ?, ?, ?, ?)
-        ''', (user_id, username, full_name, booking_date, "active"))
-        self.conn.commit()
+            INSERT INTO bookings (user_id, username, full_name, booking_date, status, expires_at)
+            VALUES (?, ?, ?, ?, ?, datetime('now', ?))
+        ''', (user_id, username, full_name, booking_date, "active", f"+{config.BOOKING_PAYMENT_TTL} seconds"))
+        self._commit()
         return cursor.lastrowid
 
-    def save_payment_info(self, user_id, payment_id, amount, booking_date, payment_type):
-        """Сохраняет информацию о платеже"""
+    def add_booking_once(self, user_id, username, full_name, booking_date):
+        """Добавляет бронь, если активной брони пользователя на эту дату еще нет.
+
+        Возвращает True, если бронь добавлена.
+        """
         cursor = self.conn.cursor()
         cursor.execute('''
-            INSERT INTO payments (user_id, payment_id, amount, payment_type, booking_date)
-            VALUES (?, ?, ?, ?, ?)
-        ''', (user_id, payment_id, amount, payment_type, booking_date))
-        self.conn.commit()
+            SELECT 1 FROM bookings WHERE user_id = ? AND booking_date = ? AND status = 'active' LIMIT 1
+        ''', (user_id, booking_date))
+        if cursor.fetchone():
+            return False
+        self.add_booking(user_id, username, full_name, booking_date)
+        return True
+
+    def save_payment_info(self, user_id, payment_id, amount, booking_date, payment_type, confirmation_url=None,
+                          attempt=None):
+        """Сохраняет информацию о платеже.
+
+        Платеж со ссылкой на оплату переиспользуется PAYMENT_REUSE_TTL секунд
+        (см. get_reusable_payment). Повторное сохранение того же платежа
+        ничего не меняет. attempt - номер попытки, под которым платеж создан:
+        следующий платеж брони получит номер больше (см. get_payment_attempt).
+        """
+        cursor = self.conn.cursor()
+        if attempt is not None:
+            self._advance_payment_attempt(cursor, user_id, booking_date, payment_type, attempt + 1)
+        # Первая фоновая проверка статуса (см. PaymentPoller)
+        cursor.execute('''
+            INSERT OR IGNORE INTO payments (user_id, payment_id, amount, payment_type, booking_date,
+                                            next_check_at, confirmation_url, expires_at)
+            VALUES (?, ?, ?, ?, ?, datetime('now', ?), ?, datetime('now', ?))
+        ''', (user_id, payment_id, amount, payment_type, booking_date,
+              f"+{config.PAYMENT_POLL_INTERVALS[0][1]} seconds", confirmation_url,
+              f"+{config.PAYMENT_REUSE_TTL} seconds"))
+        self._commit()
+
+    @staticmethod
+    def _advance_payment_attempt(cursor, user_id, booking_date, payment_type, attempt):
+        # Счетчик только растет: удаление старых платежей его не уменьшает
+        cursor.execute('''
+            INSERT INTO payment_attempts (user_id, booking_date, payment_type, attempt) VALUES (?, ?, ?, ?)
+            ON CONFLICT (user_id, booking_date, payment_type) DO UPDATE SET attempt = MAX(attempt, excluded.attempt)
+        ''', (user_id, str(booking_date or ''), payment_type, attempt))
+
+    def skip_payment_attempt(self, user_id, booking_date, payment_type, attempt):
+        """Отмечает номер попытки использованным (ключ уже занят чужим платежом)"""
+        self._advance_payment_attempt(self.conn.cursor(), user_id, booking_date, payment_type, attempt + 1)
+        self._commit()
 
     def update_payment_status(self, payment_id, status):
-        """Обновляет статус платежа"""
+        """Обновляет статус платежа.
+
+        Меняет статус только по разрешенному переходу (PAYMENT_TRANSITIONS):
+        повторный вызов с тем же статусом и запоздалое succeeded после
+        возврата ничего не меняют. Возвращает PaymentRecord, если статус
+        действительно сменился, иначе None.
+        """
         cursor = self.conn.cursor()
+        allowed = PAYMENT_TRANSITIONS.get(status, ())
+        if not allowed:
+            raise ValueError(f"Неизвестный статус платежа: {status}")
 
         # Сначала обновляем статус в таблице payments
-        cursor.execute('''
-            UPDATE payments SET status = ? WHERE payment_id = ?
-        ''', (status, payment_id))
+        cursor.execute(f'''
+            UPDATE payments SET status = ?
+            WHERE payment_id = ? AND status IN ({', '.join('?' * len(allowed))})
+        ''', (status, payment_id, *allowed))
+        if cursor.rowcount == 0:
+            self._commit()
+            return None
 
-        if status == 'succeeded':
+        payment_info = self.get_payment_info(payment_id)
+        if status == 'succeeded' and payment_info:
             # Ищем соответствующее бронирование
-            payment_info = self.get_payment_info(payment_id)
-            if payment_info:
-                user_id, payment_type, booking_date = payment_info[0], payment_info[3], payment_info[4]
-                logger.info(f"Обновление бронирования: user_id={user_id}, type={payment_type}, date={booking_date}")
-
-                if payment_type == 'deposit':
-                    # Обновляем статус предоплаты
-                    cursor.execute('''
-                        UPDATE bookings SET deposit_paid = TRUE 
-                        WHERE user_id = ? AND booking_date = ?
-                    ''', (user_id, booking_date))
-                    logger.info(f"Предоплата подтверждена для user_id={user_id}, date={booking_date}")
-                elif payment_type == 'final':
-                    # Обновляем статус финальной оплаты
-                    cursor.execute('''
-                        UPDATE bookings SET final_paid = TRUE 
-                        WHERE user_id = ? AND booking_date = ?
-                    ''', (user_id, booking_date))
-                    logger.info(f"Финальная оплата подтверждена для user_id={user_id}, date={booking_date}")
+            user_id, payment_type, booking_date = payment_info.user_id, payment_info.payment_type, payment_info.booking_date
+            logger.info(f"Обновление бронирования: user_id={user_id}, type={payment_type}, date={booking_date}")
 
-        self.conn.commit()
+            if payment_type == 'deposit':
+                # Обновляем статус предоплаты (бронь могла успеть истечь, пока клиент платил)
+                cursor.execute('''
+                    UPDATE bookings SET deposit_paid = TRUE,
+                        status = CASE WHEN status = 'expired' THEN 'active' ELSE status END
+                    WHERE user_id = ? AND booking_date = ?
+                ''', (user_id, booking_date))
+                logger.info(f"Предоплата подтверждена для user_id={user_id}, date={booking_date}")
+            elif payment_type == 'final':
+                # Обновляем статус финальной оплаты
+                cursor.execute('''
+                    UPDATE bookings SET final_paid = TRUE 
+                    WHERE user_id = ? AND booking_date = ?
+                ''', (user_id, booking_date))
+                logger.info(f"Финальная оплата подтверждена для user_id={user_id}, date={booking_date}")
+
+        self._commit()
+        return payment_info
+
+    def record_refund(self, payment_id, refunded_amount, full):
+        """Записывает сумму возвратов по платежу (refunded_amount из ЮKassa).
+
+        Выручка уменьшается на возвращенную сумму (см. _NET_REVENUE_DELTA).
+        Только полный возврат (full) переводит платеж в 'refunded', частично
+        возвращенный остается 'succeeded'. Возвращает PaymentRecord, если
+        статус сменился, иначе None.
+        """
+        cursor = self.conn.cursor()
+        # Сумма возвратов в ЮKassa только растет: запоздавшее значение не пишем
+        cursor.execute('''
+            UPDATE payments SET refunded_amount = ? WHERE payment_id = ? AND refunded_amount < ?
+        ''', (refunded_amount, payment_id, refunded_amount))
+        if full:
+            return self.update_payment_status(payment_id, 'refunded')
+        self._commit()
+        return None
+
+    def apply_payment_statuses(self, updates, reschedule, refunds=()):
+        """Применяет результаты опроса ЮKassa одной транзакцией.
+
+        updates: (payment_id, status) - платежи с окончательным статусом,
+        reschedule: (payment_id, next_check_at) - платежи, которые еще ждут оплаты,
+        refunds: (payment_id, refunded_amount, full) - суммы возвратов (см. record_refund).
+        Возвращает PaymentRecord платежей, статус которых действительно сменился.
+        """
+        autocommit, self.autocommit = self.autocommit, False
+        try:
+            changed = [record for record in (self.update_payment_status(payment_id, status)
+                                             for payment_id, status in updates) if record]
+            changed += [record for record in (self.record_refund(*refund) for refund in refunds) if record]
+            self.conn.executemany('''
+                UPDATE payments SET next_check_at = ? WHERE payment_id = ? AND status = 'pending'
+            ''', [(next_check_at, payment_id) for payment_id, next_check_at in reschedule])
+        finally:
+            self.autocommit = autocommit
+        self._commit()
+        return changed
+
+    def get_due_payments(self, limit):
+        """Получает ожидающие платежи, которые пора проверить, самые просроченные первыми"""
+        cursor = self._cursor(PaymentRecord)
+        cursor.execute('''
+            SELECT * FROM payments
+            WHERE status = 'pending' AND next_check_at <= datetime('now')
+            ORDER BY next_check_at LIMIT ?
+        ''', (limit,))
+        return cursor.fetchall()
 
     def get_payment_info(self, payment_id):
         """Получает информацию о платеже"""
-        cursor = self.conn.cursor()
+        cursor = self._cursor(PaymentRecord)
         cursor.execute('''
-            SELECT user_id, payment_id, amount, payment_type, booking_date 
+            SELECT user_id, payment_id, amount, payment_type, status, booking_date
             FROM payments WHERE payment_id = ?
         ''', (payment_id,))
         return cursor.fetchone()
 
+    def get_payments_by_ids(self, payment_ids):
+        """Получает платежи по списку идентификаторов ЮKassa одним запросом"""
+        if not payment_ids:
+            return []
+        cursor = self._cursor(PaymentRecord)
+        cursor.execute(f'''
+            SELECT * FROM payments WHERE payment_id IN ({', '.join('?' * len(payment_ids))})
+        ''', list(payment_ids))
+        return cursor.fetchall()
+
+    def get_latest_payment(self, user_id, payment_type):
+        """Получает последний платеж пользователя данного типа"""
+        cursor = self._cursor(PaymentRecord)
+        cursor.execute('''
+            SELECT * FROM payments WHERE user_id = ? AND payment_type = ?
+            ORDER BY id DESC LIMIT 1
+        ''', (user_id, payment_type))
+        return cursor.fetchone()
+
+    def get_reusable_payment(self, user_id, booking_date, payment_type):
+        """Получает неоплаченный платеж, ссылку на который еще можно отдать клиенту"""
+        cursor = self._cursor(PaymentRecord)
+        cursor.execute('''
+            SELECT * FROM payments
+            WHERE user_id = ? AND payment_type = ? AND booking_date = ? AND status = 'pending'
+                AND confirmation_url IS NOT NULL AND expires_at > datetime('now')
+            ORDER BY id DESC LIMIT 1
+        ''', (user_id, payment_type, booking_date))
+        return cursor.fetchone()
+
+    def get_payment_attempt(self, user_id, booking_date, payment_type):
+        """Номер следующей попытки создать платеж (для ключа идемпотентности)"""
+        cursor = self.conn.cursor()
+        cursor.execute('''
+            SELECT attempt FROM payment_attempts WHERE user_id = ? AND booking_date = ? AND payment_type = ?
+        ''', (user_id, str(booking_date or ''), payment_type))
+        result = cursor.fetchone()
+        return result[0] if result else 0
+
+    def get_booking(self, user_id, booking_date):
+        """Получает бронь пользователя на дату (последнюю, если их несколько)"""
+        cursor = self._cursor(Booking)
+        cursor.execute('''
+            SELECT * FROM bookings WHERE user_id = ? AND booking_date = ? ORDER BY id DESC LIMIT 1
+        ''', (user_id, booking_date))
+        return cursor.fetchone()
+
     def get_user_bookings(self, user_id):
         """Получает бронирования пользователя"""
-        cursor = self.conn.cursor()
+        cursor = self._cursor(Booking)
         cursor.execute('''
             SELECT * FROM bookings WHERE user_id = ? ORDER BY booking_date DESC
         ''', (user_id,))
@@ -139,6 +341,344 @@ class Database:
         logger.info(f"Проверка даты {booking_date}: найдено {count} оплаченных бронирований")
         return count == 0
 
+    def get_booked_ordinals(self, date_from, date_to):
+        """Занятые даты интервала (YYYY-MM-DD, включительно) одним запросом.
+
+        Возвращает отсортированные порядковые номера дней (date.toordinal()),
+        чтобы вызывающему не нужно было разбирать строки дат. Читает сводную
+        таблицу day_occupancy, а не bookings.
+        """
+        cursor = self.conn.cursor()
+        cursor.execute(f'''
+            SELECT CAST(julianday(booking_date) - {JULIAN_ORDINAL_OFFSET} AS INTEGER) FROM day_occupancy 
+            WHERE booking_date BETWEEN ? AND ? AND paid_count > 0
+            ORDER BY booking_date
+        ''', (str(date_from), str(date_to)))
+        return [row[0] for row in cursor.fetchall()]
+
+    def get_horizon_booked_ordinals(self, months=config.BOOKING_HORIZON_MONTHS):
+        """Занятые даты всех месяцев календаря бронирования (см. booking_horizon)"""
+        return self.get_booked_ordinals(*booking_horizon(months))
+
+    def mark_deposit_paid(self, booking_id, user_id):
+        """Отмечает предоплату по бронированию"""
+        cursor = self.conn.cursor()
+        cursor.execute('''
+            UPDATE bookings SET deposit_paid = TRUE 
+            WHERE id = ? AND user_id = ?
+        ''', (booking_id, user_id))
+        self._commit()
+
+    def mark_final_paid(self, booking_id, user_id):
+        """Отмечает финальную оплату по бронированию"""
+        cursor = self.conn.cursor()
+        cursor.execute('''
+            UPDATE bookings SET final_paid = TRUE 
+            WHERE id = ? AND user_id = ?
+        ''', (booking_id, user_id))
+        self._commit()
+
+    def delete_booking(self, user_id, booking_date):
+        """Удаляет бронирование пользователя на дату"""
+        cursor = self.conn.cursor()
+        cursor.execute('DELETE FROM bookings WHERE user_id = ? AND booking_date = ?',
+                       (user_id, booking_date))
+        self._commit()
+
+    def is_final_paid(self, user_id, booking_date):
+        """Проверяет, оплачена ли финальная часть"""
+        cursor = self.conn.cursor()
+        cursor.execute('''
+            SELECT final_paid FROM bookings 
+            WHERE user_id = ? AND booking_date = ?
+        ''', (user_id, booking_date))
+        result = cursor.fetchone()
+        return bool(result and result[0])
+
+    def has_completed_project(self, user_id):
+        """Проверяет, есть ли у пользователя завершенный проект"""
+        cursor = self.conn.cursor()
+        cursor.execute('''
+            SELECT status FROM bookings 
+            WHERE user_id = ? AND status = 'completed'
+            ORDER BY created_at DESC LIMIT 1
+        ''', (user_id,))
+        return cursor.fetchone() is not None
+
+    def get_user_latest_booking(self, user_id):
+        """Получает последнее бронирование пользователя (любой статус)"""
+        cursor = self._cursor(Booking)
+        cursor.execute('''
+            SELECT * FROM bookings WHERE user_id = ? ORDER BY created_at DESC LIMIT 1
+        ''', (user_id,))
+        return cursor.fetchone()
+
+    def get_status_counts(self):
+        """Количество броней по статусам (из сводной таблицы)"""
+        cursor = self.conn.cursor()
+        cursor.execute('SELECT status, count FROM status_counts WHERE count > 0')
+        return dict(cursor.fetchall())
+
+    def get_monthly_revenue(self, month_from=None, month_to=None):
+        """Полученные деньги по месяцам брони (успешные платежи за вычетом возвратов):
+        [(YYYY-MM, предоплат, финальных оплат, сумма предоплат, сумма финальных оплат)]
+        """
+        cursor = self.conn.cursor()
+        cursor.execute('''
+            SELECT month, deposits, finals, deposit_amount, final_amount FROM monthly_revenue
+            WHERE month BETWEEN ? AND ? AND (deposits > 0 OR finals > 0) ORDER BY month
+        ''', (month_from or '0000-00', month_to or '9999-99'))
+        return cursor.fetchall()
+
+    def get_weekly_load(self, date_from, date_to):
+        """Занятые дни по неделям интервала: [(понедельник YYYY-MM-DD, занято дней)]"""
+        cursor = self.conn.cursor()
+        cursor.execute('''
+            SELECT date(booking_date, '-6 days', 'weekday 1') AS week, COUNT(*) FROM day_occupancy
+            WHERE booking_date BETWEEN ? AND ? AND paid_count > 0
+            GROUP BY week ORDER BY week
+        ''', (str(date_from), str(date_to)))
+        return cursor.fetchall()
+
+    def get_bookings_page(self, cursor_key=None, backward=False, limit=10):
+        """Страница броней по убыванию (booking_date, id) без OFFSET.
+
+        cursor_key - (booking_date, id) крайней брони соседней страницы:
+        вперед берутся брони после нее, назад (backward) - перед ней.
+        Возвращает (брони по убыванию, есть ли еще брони в этом направлении).
+        """
+        cursor = self._cursor(Booking)
+        if cursor_key is None:
+            cursor.execute('''
+                SELECT * FROM bookings ORDER BY booking_date DESC, id DESC LIMIT ?
+            ''', (limit + 1,))
+        elif backward:
+            cursor.execute('''
+                SELECT * FROM bookings WHERE (booking_date, id) > (?, ?)
+                ORDER BY booking_date, id LIMIT ?
+            ''', (*cursor_key, limit + 1))
+        else:
+            cursor.execute('''
+                SELECT * FROM bookings WHERE (booking_date, id) < (?, ?)
+                ORDER BY booking_date DESC, id DESC LIMIT ?
+            ''', (*cursor_key, limit + 1))
+
+        rows = cursor.fetchall()
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        if backward:
+            rows.reverse()
+        return rows, has_more
+
+    def get_booking_events(self, booking_id):
+        """История переходов брони: [(событие, было, стало, время)]"""
+        cursor = self.conn.cursor()
+        cursor.execute('''
+            SELECT event, old_value, new_value, created_at FROM booking_events
+            WHERE booking_id = ? ORDER BY id
+        ''', (booking_id,))
+        return cursor.fetchall()
+
+    def get_fsm_record(self, key):
+        """Получает (state, data, updated_at) состояния FSM или None"""
+        cursor = self.conn.cursor()
+        cursor.execute('SELECT state, data, updated_at FROM fsm_states WHERE key = ?', (key,))
+        return cursor.fetchone()
+
+    def save_fsm_record(self, key, state, data, updated_at):
+        """Сохраняет состояние FSM; пустое состояние удаляется"""
+        cursor = self.conn.cursor()
+        if state is None and data in (None, '{}'):
+            cursor.execute('DELETE FROM fsm_states WHERE key = ?', (key,))
+        else:
+            cursor.execute('''
+                INSERT OR REPLACE INTO fsm_states (key, state, data, updated_at) VALUES (?, ?, ?, ?)
+            ''', (key, state, data, updated_at))
+        self._commit()
+
+    def delete_expired_fsm_records(self, before):
+        """Удаляет состояния FSM, которые не менялись с момента before; возвращает их ключи"""
+        cursor = self.conn.cursor()
+        cursor.execute('SELECT key FROM fsm_states WHERE updated_at < ?', (before,))
+        keys = [row[0] for row in cursor.fetchall()]
+        cursor.execute('DELETE FROM fsm_states WHERE updated_at < ?', (before,))
+        self._commit()
+        return keys
+
+    def purge_abandoned(self, cutoff, batch=config.RETENTION_BATCH):
+        """Удаляет неоплаченные брони и зависшие платежи, созданные до cutoff.
+
+        Удаляет пачками по batch строк, каждая пачка - короткая транзакция.
+        История удаленных броней остается в booking_events.
+        Возвращает (удалено броней, удалено платежей, время в транзакциях).
+        """
+        cursor = self.conn.cursor()
+        deleted = {'bookings': 0, 'payments': 0}
+        lock_time = 0.0
+        queries = {
+            'bookings': '''
+                DELETE FROM bookings WHERE id IN (
+                    SELECT id FROM bookings
+                    WHERE status IN ('active', 'expired') AND NOT deposit_paid AND created_at < ? LIMIT ?)
+            ''',
+            'payments': '''
+                DELETE FROM payments WHERE id IN (
+                    SELECT id FROM payments WHERE status = 'pending' AND created_at < ? LIMIT ?)
+            ''',
+        }
+        for table, query in queries.items():
+            while True:
+                started = time.perf_counter()
+                cursor.execute(query, (cutoff, batch))
+                count = cursor.rowcount
+                self.conn.commit()
+                lock_time += time.perf_counter() - started
+                deleted[table] += count
+                if count < batch:
+                    break
+                time.sleep(0)  # даем писателю других потоков взять блокировку
+        return deleted['bookings'], deleted['payments'], lock_time
+
+    def expire_bookings(self, batch=config.RETENTION_BATCH):
+        """Переводит неоплаченные брони с истекшим expires_at в статус 'expired'.
+
+        Обрабатывает не больше batch броней одной транзакцией и удаляет их
+        ожидающие платежи. Возвращает [(user_id, booking_date)] истекших броней.
+        """
+        cursor = self.conn.cursor()
+        cursor.execute('''
+            SELECT id, user_id, booking_date FROM bookings
+            WHERE expires_at <= datetime('now') AND status = 'active' AND NOT deposit_paid
+            ORDER BY expires_at LIMIT ?
+        ''', (batch,))
+        rows = cursor.fetchall()
+        if not rows:
+            return []
+
+        cursor.executemany('''
+            UPDATE bookings SET status = 'expired', expires_at = NULL WHERE id = ?
+        ''', [(booking_id,) for booking_id, _, _ in rows])
+        cursor.executemany('''
+            DELETE FROM payments WHERE user_id = ? AND booking_date = ? AND status = 'pending'
+        ''', [(user_id, booking_date) for _, user_id, booking_date in rows])
+        self._commit()
+        return [(user_id, booking_date) for _, user_id, booking_date in rows]
+
+    def incremental_vacuum_enabled(self):
+        """Включен ли в базе auto_vacuum=INCREMENTAL"""
+        return self.conn.execute('PRAGMA auto_vacuum').fetchone()[0] == 2
+
+    def enable_incremental_vacuum(self):
+        """Переводит существующую базу в auto_vacuum=INCREMENTAL одним полным VACUUM.
+
+        VACUUM переписывает весь файл и держит базу все это время, поэтому
+        вызывается только при остановленном боте (python maintenance.py
+        convert). Возвращает время блокировки или None, если база уже переведена.
+        """
+        if self.incremental_vacuum_enabled():
+            return None
+        cursor = self.conn.cursor()
+        started = time.perf_counter()
+        cursor.execute('PRAGMA auto_vacuum = INCREMENTAL')
+        cursor.execute('VACUUM')
+        return time.perf_counter() - started
+
+    def incremental_vacuum(self, pages=config.VACUUM_PAGES):
+        """Возвращает системе до pages свободных страниц.
+
+        Возвращает (освобождено, осталось свободных, время блокировки).
+        """
+        cursor = self.conn.cursor()
+        before = cursor.execute('PRAGMA freelist_count').fetchone()[0]
+        started = time.perf_counter()
+        # executescript выполняет PRAGMA до конца (execute освобождает одну страницу за шаг)
+        self.conn.executescript(f'PRAGMA incremental_vacuum({int(pages)})')
+        lock_time = time.perf_counter() - started
+        after = cursor.execute('PRAGMA freelist_count').fetchone()[0]
+        return before - after, after, lock_time
+
+    def analyze(self):
+        """Обновляет статистику планировщика запросов; возвращает время блокировки"""
+        started = time.perf_counter()
+        self.conn.execute('ANALYZE')
+        self.conn.commit()
+        return time.perf_counter() - started
+
+    def get_db_time(self):
+        """Текущее время базы с миллисекундами (метка для синхронизации)"""
+        cursor = self.conn.cursor()
+        cursor.execute("SELECT strftime('%Y-%m-%d %H:%M:%f', 'now')")
+        return cursor.fetchone()[0]
+
+    def get_changed_booking_keys(self, since=None):
+        """Получает пары (user_id, booking_date), измененные после метки since"""
+        cursor = self.conn.cursor()
+        if since is None:
+            cursor.execute('SELECT DISTINCT user_id, booking_date FROM bookings')
+        else:
+            # Без DISTINCT, чтобы планировщик шел по индексу updated_at
+            cursor.execute('''
+                SELECT user_id, booking_date FROM bookings WHERE updated_at > ?
+            ''', (since,))
+        return list(dict.fromkeys((str(user_id), booking_date) for user_id, booking_date in cursor.fetchall()))
+
+    def get_booking_state(self, user_id, booking_date):
+        """Сводное состояние брони по всем ее строкам (для синхронизации)"""
+        cursor = self.conn.cursor()
+        cursor.execute('''
+            SELECT MAX(deposit_paid), MAX(final_paid), MAX(status = 'completed'), MAX(brief_completed), COUNT(*)
+            FROM bookings WHERE user_id = ? AND booking_date = ?
+        ''', (user_id, booking_date))
+        result = cursor.fetchone()
+        if not result or not result[4]:
+            return None
+        return tuple(bool(value) for value in result[:4])
+
+    def apply_synced_bookings(self, updates, inserts):
+        """Применяет изменения из Google Sheets одной транзакцией.
+
+        updates: (user_id, booking_date, deposit_paid, final_paid, completed, brief_completed)
+        inserts: (user_id, username, full_name, booking_date, deposit_paid, final_paid, completed, brief_completed)
+        """
+        cursor = self.conn.cursor()
+        cursor.executemany('''
+            UPDATE bookings SET deposit_paid = ?, final_paid = ?, brief_completed = ?,
+                status = CASE WHEN ? THEN 'completed' WHEN status = 'completed' THEN 'active' ELSE status END
+            WHERE user_id = ? AND booking_date = ?
+        ''', [(deposit, final, brief, completed, user_id, booking_date)
+              for user_id, booking_date, deposit, final, completed, brief in updates])
+        cursor.executemany('''
+            INSERT INTO bookings (user_id, username, full_name, booking_date, status,
+                                  deposit_paid, final_paid, brief_completed)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ''', [(user_id, username, full_name, booking_date, 'completed' if completed else 'active',
+               deposit, final, brief)
+              for user_id, username, full_name, booking_date, deposit, final, completed, brief in inserts])
+        self._commit()
+
+    def get_sync_state(self):
+        """Получает сохраненные метки синхронизации и отметку времени прошлого прогона"""
+        cursor = self.conn.cursor()
+        cursor.execute('SELECT user_id, booking_date, db_state, sheet_hash FROM sheet_sync_state')
+        state = {(user_id, booking_date): (db_state, sheet_hash)
+                 for user_id, booking_date, db_state, sheet_hash in cursor.fetchall()}
+        cursor.execute("SELECT value FROM sync_meta WHERE key = 'bookings_watermark'")
+        result = cursor.fetchone()
+        return state, result[0] if result else None
+
+    def save_sync_state(self, entries, watermark):
+        """Сохраняет метки синхронизации: {(user_id, booking_date): (db_state, sheet_hash)}"""
+        cursor = self.conn.cursor()
+        cursor.executemany('''
+            INSERT OR REPLACE INTO sheet_sync_state (user_id, booking_date, db_state, sheet_hash)
+            VALUES (?, ?, ?, ?)
+        ''', [(user_id, booking_date, db_state, sheet_hash)
+              for (user_id, booking_date), (db_state, sheet_hash) in entries.items()])
+        cursor.execute('''
+            INSERT OR REPLACE INTO sync_meta (key, value) VALUES ('bookings_watermark', ?)
+        ''', (watermark,))
+        self._commit()
+
     def mark_project_completed(self, user_id, booking_date):
         """Отмечает проект как завершенный"""
         cursor = self.conn.cursor()
@@ -146,7 +686,7 @@ class Database:
             UPDATE bookings SET status = 'completed' 
             WHERE user_id = ? AND booking_date = ?
         ''', (user_id, booking_date))
-        self.conn.commit()
+        self._commit()
         logger.info(f"Проект отмечен завершенным: user_id={user_id}, date={booking_date}")
 
     def mark_brief_completed(self, user_id):
@@ -155,11 +695,11 @@ class Database:
         cursor.execute('''
             UPDATE bookings SET brief_completed = TRUE WHERE user_id = ?
         ''', (user_id,))
-        self.conn.commit()
+        self._commit()
 
     def get_today_bookings(self):
         """Получает бронирования на сегодня с предоплатой но без финальной оплаты"""
-        cursor = self.conn.cursor()
+        cursor = self._cursor(Booking)
         today = datetime.now().strftime("%Y-%m-%d")
         cursor.execute('''
             SELECT * FROM bookings 
@@ -169,19 +709,14 @@ class Database:
 
     def get_upcoming_bookings(self, days=7):
         """Получает предстоящие бронирования"""
-        cursor = self.conn.cursor()
-        from datetime import datetime, timedelta
-
-        upcoming_bookings = []
-        for i in range(days + 1):
-            target_date = (datetime.now() + timedelta(days=i)).strftime("%Y-%m-%d")
-            cursor.execute('''
-                SELECT * FROM bookings 
-                WHERE booking_date = ? AND deposit_paid = TRUE AND brief_completed = FALSE
-            ''', (target_date,))
-            upcoming_bookings.extend(cursor.fetchall())
-
-        return upcoming_bookings
+        cursor = self._cursor(Booking)
+        today = date.today()
+        cursor.execute('''
+            SELECT * FROM bookings 
+            WHERE booking_date BETWEEN ? AND ? AND deposit_paid = TRUE AND brief_completed = FALSE
+            ORDER BY booking_date
+        ''', (today.isoformat(), (today + timedelta(days=days)).isoformat()))
+        return cursor.fetchall()
 
     def mark_date_as_booked(self, booking_date):
         """Отмечает дату как забронированную в базе данных"""
@@ -190,7 +725,7 @@ class Database:
             UPDATE bookings SET status = 'booked' 
             WHERE booking_date = ? AND deposit_paid = TRUE
         ''', (booking_date,))
-        self.conn.commit()
+        self._commit()
 
     def get_user_booking_date(self, user_id):
         """Получает дату бронирования пользователя"""
@@ -205,7 +740,7 @@ class Database:
 
     def get_user_active_booking(self, user_id):
         """Получает активное бронирование пользователя (без проверки оплаты)"""
-        cursor = self.conn.cursor()
+        cursor = self._cursor(Booking)
         cursor.execute('''
             SELECT * FROM bookings 
             WHERE user_id = ? AND status = 'active'
@@ -215,7 +750,7 @@ class Database:
 
     def get_all_user_bookings(self, user_id):
         """Получает все бронирования пользователя (для отладки)"""
-        cursor = self.conn.cursor()
+        cursor = self._cursor(Booking)
         cursor.execute('''
             SELECT * FROM bookings WHERE user_id = ? ORDER BY created_at DESC
         ''', (user_id,))
@@ -242,3 +777,758 @@ class Database:
         ''', (user_id,))
         result = cursor.fetchone()
         return result[0] if result else None
+
+# julianday('0001-01-01') - 1: переводит дату SQLite в date.toordinal()
+JULIAN_ORDINAL_OFFSET = 1721424.5
+
+
+def booking_horizon(months=config.BOOKING_HORIZON_MONTHS, today=None):
+    """Первый и последний день, доступные для бронирования (как в get_months_keyboard)"""
+    today = today or date.today()
+    last_month = today.replace(day=1) + timedelta(days=32 * (months - 1))
+    last_day = calendar.monthrange(last_month.year, last_month.month)[1]
+    return today, last_month.replace(day=last_day)
+
+
+def _create_base_tables(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS bookings (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            username TEXT,
+            full_name TEXT,
+            booking_date TEXT,
+            status TEXT DEFAULT 'active',
+            deposit_paid BOOLEAN DEFAULT FALSE,
+            final_paid BOOLEAN DEFAULT FALSE,
+            brief_completed BOOLEAN DEFAULT FALSE,
+            payment_id TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS payments (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            payment_id TEXT UNIQUE,
+            amount REAL,
+            payment_type TEXT,
+            status TEXT DEFAULT 'pending',
+            booking_date TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS support_chats (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            username TEXT,
+            full_name TEXT,
+            active BOOLEAN DEFAULT TRUE,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+
+def _add_sync_tracking(cursor):
+    # Метки изменений для синхронизации с Google Sheets
+    columns = [row[1] for row in cursor.execute('PRAGMA table_info(bookings)')]
+    if 'updated_at' not in columns:
+        cursor.execute('ALTER TABLE bookings ADD COLUMN updated_at TIMESTAMP')
+        cursor.execute('UPDATE bookings SET updated_at = created_at')
+
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS bookings_touch_insert AFTER INSERT ON bookings
+        WHEN NEW.updated_at IS NULL
+        BEGIN
+            UPDATE bookings SET updated_at = strftime('%Y-%m-%d %H:%M:%f', 'now') WHERE id = NEW.id;
+        END
+    ''')
+
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS bookings_touch_update AFTER UPDATE ON bookings
+        WHEN NEW.updated_at IS OLD.updated_at
+        BEGIN
+            UPDATE bookings SET updated_at = strftime('%Y-%m-%d %H:%M:%f', 'now') WHERE id = NEW.id;
+        END
+    ''')
+
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS sheet_sync_state (
+            user_id TEXT,
+            booking_date TEXT,
+            db_state TEXT,
+            sheet_hash TEXT,
+            PRIMARY KEY (user_id, booking_date)
+        )
+    ''')
+
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS sync_meta (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        )
+    ''')
+
+
+def _add_booking_indexes(cursor):
+    # Активная/последняя бронь пользователя: WHERE user_id, status ORDER BY created_at
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_bookings_user_status
+        ON bookings (user_id, status, created_at)
+    ''')
+    # Бронь пользователя на дату, список броней пользователя по дате
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_bookings_user_date
+        ON bookings (user_id, booking_date)
+    ''')
+    # Занятость и напоминания: WHERE booking_date [BETWEEN] AND deposit_paid
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_bookings_date_paid
+        ON bookings (booking_date, deposit_paid)
+    ''')
+    # Изменения для синхронизации с Google Sheets
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_bookings_updated
+        ON bookings (updated_at)
+    ''')
+    cursor.execute('ANALYZE')
+
+
+def _cover_booked_dates_index(cursor):
+    # Занятые даты берутся только из индекса, без чтения строк таблицы
+    cursor.execute('DROP INDEX IF EXISTS idx_bookings_date_paid')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_bookings_date_paid_status
+        ON bookings (booking_date, deposit_paid, status)
+    ''')
+    cursor.execute('ANALYZE')
+
+
+
+def _create_fsm_states(cursor):
+    # Состояния диалогов aiogram (см. fsm_storage.SQLiteStorage)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS fsm_states (
+            key TEXT PRIMARY KEY,
+            state TEXT,
+            data TEXT,
+            updated_at REAL
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_fsm_states_updated ON fsm_states (updated_at)')
+
+
+
+# Вклад строки bookings в сводные таблицы. {row} - OLD или NEW, {sign} - +1 или -1
+_BOOKING_SUMMARY_DELTA = '''
+    INSERT INTO day_occupancy (booking_date, paid_count)
+    SELECT {row}.booking_date, {sign} WHERE {row}.deposit_paid AND {row}.status != 'cancelled'
+    ON CONFLICT (booking_date) DO UPDATE SET paid_count = paid_count + excluded.paid_count;
+
+    INSERT INTO status_counts (status, count) SELECT {row}.status, {sign} WHERE TRUE
+    ON CONFLICT (status) DO UPDATE SET count = count + excluded.count;
+'''
+
+# До миграции 13 выручка считалась по флагам броней (см. _derive_revenue_from_payments)
+_SUMMARY_DELTA = _BOOKING_SUMMARY_DELTA + '''
+    INSERT INTO monthly_revenue (month, deposits, finals)
+    SELECT substr({row}.booking_date, 1, 7), {sign} * ({row}.deposit_paid != 0), {sign} * ({row}.final_paid != 0)
+    WHERE {row}.deposit_paid OR {row}.final_paid
+    ON CONFLICT (month) DO UPDATE SET deposits = deposits + excluded.deposits, finals = finals + excluded.finals;
+'''
+
+# Вклад платежа в выручку: только деньги, которые реально получены и не возвращены
+_REVENUE_DELTA = '''
+    INSERT INTO monthly_revenue (month, deposits, finals, deposit_amount, final_amount)
+    SELECT COALESCE(substr({row}.booking_date, 1, 7), substr({row}.created_at, 1, 7)),
+        {sign} * ({row}.payment_type = 'deposit'), {sign} * ({row}.payment_type = 'final'),
+        {sign} * {row}.amount * ({row}.payment_type = 'deposit'), {sign} * {row}.amount * ({row}.payment_type = 'final')
+    WHERE {row}.status = 'succeeded'
+    ON CONFLICT (month) DO UPDATE SET deposits = deposits + excluded.deposits, finals = finals + excluded.finals,
+        deposit_amount = deposit_amount + excluded.deposit_amount, final_amount = final_amount + excluded.final_amount;
+'''
+
+# С миграции 14 частичный возврат вычитает из выручки только возвращенную сумму
+_NET_REVENUE_DELTA = _REVENUE_DELTA.replace('{row}.amount', '({row}.amount - {row}.refunded_amount)')
+
+
+def _create_booking_summary_triggers(cursor, delta):
+    # Журнал создания/удаления брони и сводные таблицы по ее вставке, удалению и изменению
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS bookings_ledger_insert AFTER INSERT ON bookings
+        BEGIN
+            INSERT INTO booking_events (booking_id, user_id, booking_date, event, new_value)
+            VALUES (NEW.id, NEW.user_id, NEW.booking_date, 'created', NEW.status);
+            {delta.format(row='NEW', sign='1')}
+        END
+    ''')
+
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS bookings_ledger_delete AFTER DELETE ON bookings
+        BEGIN
+            INSERT INTO booking_events (booking_id, user_id, booking_date, event, old_value)
+            VALUES (OLD.id, OLD.user_id, OLD.booking_date, 'deleted', OLD.status);
+            {delta.format(row='OLD', sign='-1')}
+        END
+    ''')
+
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS bookings_summary_update
+        AFTER UPDATE OF status, deposit_paid, final_paid, booking_date ON bookings
+        WHEN OLD.status IS NOT NEW.status OR OLD.deposit_paid IS NOT NEW.deposit_paid
+            OR OLD.final_paid IS NOT NEW.final_paid OR OLD.booking_date IS NOT NEW.booking_date
+        BEGIN
+            {delta.format(row='OLD', sign='-1')}
+            {delta.format(row='NEW', sign='1')}
+        END
+    ''')
+
+
+def _create_booking_ledger(cursor):
+    # Журнал переходов брони: только INSERT, строки не меняются и не удаляются
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS booking_events (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            booking_id INTEGER,
+            user_id INTEGER,
+            booking_date TEXT,
+            event TEXT,
+            old_value TEXT,
+            new_value TEXT,
+            created_at TIMESTAMP DEFAULT (strftime('%Y-%m-%d %H:%M:%f', 'now'))
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_booking_events_booking ON booking_events (booking_id, id)')
+
+    # Сводные таблицы, которые поддерживаются триггерами в той же транзакции
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS day_occupancy (
+            booking_date TEXT PRIMARY KEY,
+            paid_count INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS status_counts (
+            status TEXT PRIMARY KEY,
+            count INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS monthly_revenue (
+            month TEXT PRIMARY KEY,
+            deposits INTEGER NOT NULL DEFAULT 0,
+            finals INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+
+    _create_booking_summary_triggers(cursor, _SUMMARY_DELTA)
+
+    for column in ('status', 'deposit_paid', 'final_paid', 'brief_completed', 'booking_date'):
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS bookings_ledger_{column} AFTER UPDATE OF {column} ON bookings
+            WHEN OLD.{column} IS NOT NEW.{column}
+            BEGIN
+                INSERT INTO booking_events (booking_id, user_id, booking_date, event, old_value, new_value)
+                VALUES (NEW.id, NEW.user_id, NEW.booking_date, '{column}', OLD.{column}, NEW.{column});
+            END
+        ''')
+
+    # Заполняем сводные таблицы по уже существующим броням
+    cursor.execute('''
+        INSERT OR REPLACE INTO day_occupancy (booking_date, paid_count)
+        SELECT booking_date, COUNT(*) FROM bookings
+        WHERE deposit_paid AND status != 'cancelled' GROUP BY booking_date
+    ''')
+    cursor.execute('''
+        INSERT OR REPLACE INTO status_counts (status, count)
+        SELECT status, COUNT(*) FROM bookings GROUP BY status
+    ''')
+    cursor.execute('''
+        INSERT OR REPLACE INTO monthly_revenue (month, deposits, finals)
+        SELECT substr(booking_date, 1, 7), SUM(deposit_paid != 0), SUM(final_paid != 0) FROM bookings
+        WHERE deposit_paid OR final_paid GROUP BY substr(booking_date, 1, 7)
+    ''')
+
+
+
+def _add_booking_date_index(cursor):
+    # Постраничный список броней по (booking_date, id): rowid хранится в индексе последним
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_bookings_date ON bookings (booking_date)')
+
+
+
+def _add_booking_expiry(cursor):
+    # Срок оплаты неоплаченной брони; оплаченные и старые брони не истекают
+    cursor.execute('ALTER TABLE bookings ADD COLUMN expires_at TIMESTAMP')
+    cursor.execute(f'''
+        UPDATE bookings SET expires_at = datetime(created_at, '+{config.BOOKING_PAYMENT_TTL} seconds')
+        WHERE status = 'active' AND NOT deposit_paid
+    ''')
+    # В индексе только брони, которые еще могут истечь
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_bookings_expires ON bookings (expires_at)
+        WHERE expires_at IS NOT NULL
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS bookings_clear_expiry AFTER UPDATE OF deposit_paid ON bookings
+        WHEN NEW.deposit_paid AND NEW.expires_at IS NOT NULL
+        BEGIN
+            UPDATE bookings SET expires_at = NULL WHERE id = NEW.id;
+        END
+    ''')
+
+
+def _add_payment_user_index(cursor):
+    # Последний платеж пользователя (проверка по кнопке «Я оплатил»)
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_payments_user ON payments (user_id, payment_type)
+    ''')
+
+
+def _add_payment_polling(cursor):
+    # Время следующей фоновой проверки ожидающего платежа
+    cursor.execute('ALTER TABLE payments ADD COLUMN next_check_at TIMESTAMP')
+    cursor.execute('''
+        UPDATE payments SET next_check_at = created_at WHERE status = 'pending'
+    ''')
+    # В индексе только платежи, которые еще ждут оплаты
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_payments_pending ON payments (next_check_at)
+        WHERE status = 'pending'
+    ''')
+
+
+def _add_payment_reuse(cursor):
+    # Ссылка на оплату и срок, пока неоплаченный платеж можно отдать повторно
+    cursor.execute('ALTER TABLE payments ADD COLUMN confirmation_url TEXT')
+    cursor.execute('ALTER TABLE payments ADD COLUMN expires_at TIMESTAMP')
+
+
+def _create_payment_attempts(cursor):
+    # Номер попытки для ключа идемпотентности живет отдельно от payments,
+    # откуда очистка удаляет старые платежи
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS payment_attempts (
+            user_id INTEGER NOT NULL,
+            booking_date TEXT NOT NULL,
+            payment_type TEXT NOT NULL,
+            attempt INTEGER NOT NULL,
+            PRIMARY KEY (user_id, booking_date, payment_type)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('''
+        INSERT INTO payment_attempts (user_id, booking_date, payment_type, attempt)
+        SELECT user_id, COALESCE(booking_date, ''), payment_type, COUNT(*) FROM payments
+        WHERE user_id IS NOT NULL AND payment_type IS NOT NULL
+        GROUP BY user_id, COALESCE(booking_date, ''), payment_type
+    ''')
+
+
+def _create_payment_revenue_triggers(cursor, delta, columns):
+    # Выручка по вставке платежа и изменению columns: вклад старой строки вычитается, новой - добавляется
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS payments_revenue_insert AFTER INSERT ON payments
+        WHEN NEW.status = 'succeeded'
+        BEGIN
+            {delta.format(row='NEW', sign='1')}
+        END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS payments_revenue_update AFTER UPDATE OF {', '.join(columns)} ON payments
+        WHEN {' OR '.join(f'OLD.{column} IS NOT NEW.{column}' for column in columns)}
+        BEGIN
+            {delta.format(row='OLD', sign='-1')}
+            {delta.format(row='NEW', sign='1')}
+        END
+    ''')
+
+
+def _derive_revenue_from_payments(cursor):
+    # Выручка по флагам броней уменьшалась при удалении оплаченной брони,
+    # хотя деньги получены. Теперь monthly_revenue ведут триггеры payments:
+    # учитываются успешные платежи, возврат вычитает платеж, а удаление строк
+    # payments (очистка трогает только pending) выручку не меняет
+    for trigger in ('bookings_ledger_insert', 'bookings_ledger_delete', 'bookings_summary_update'):
+        cursor.execute(f'DROP TRIGGER IF EXISTS {trigger}')
+    _create_booking_summary_triggers(cursor, _BOOKING_SUMMARY_DELTA)
+
+    cursor.execute('DROP TABLE IF EXISTS monthly_revenue')
+    cursor.execute('''
+        CREATE TABLE monthly_revenue (
+            month TEXT PRIMARY KEY,
+            deposits INTEGER NOT NULL DEFAULT 0,
+            finals INTEGER NOT NULL DEFAULT 0,
+            deposit_amount REAL NOT NULL DEFAULT 0,
+            final_amount REAL NOT NULL DEFAULT 0
+        )
+    ''')
+    _create_payment_revenue_triggers(cursor, _REVENUE_DELTA, ('status',))
+    cursor.execute('''
+        INSERT INTO monthly_revenue (month, deposits, finals, deposit_amount, final_amount)
+        SELECT COALESCE(substr(booking_date, 1, 7), substr(created_at, 1, 7)),
+            SUM(payment_type = 'deposit'), SUM(payment_type = 'final'),
+            SUM(amount * (payment_type = 'deposit')), SUM(amount * (payment_type = 'final'))
+        FROM payments WHERE status = 'succeeded'
+        GROUP BY COALESCE(substr(booking_date, 1, 7), substr(created_at, 1, 7))
+    ''')
+
+
+def _add_refunded_amount(cursor):
+    # Сумма возвратов по платежу: частичный возврат оставляет платеж
+    # оплаченным и вычитает из выручки только возвращенные деньги
+    cursor.execute('ALTER TABLE payments ADD COLUMN refunded_amount REAL NOT NULL DEFAULT 0')
+    cursor.execute('''
+        UPDATE payments SET refunded_amount = COALESCE(amount, 0) WHERE status = 'refunded'
+    ''')
+    for trigger in ('payments_revenue_insert', 'payments_revenue_update'):
+        cursor.execute(f'DROP TRIGGER IF EXISTS {trigger}')
+    _create_payment_revenue_triggers(cursor, _NET_REVENUE_DELTA, ('status', 'refunded_amount'))
+
+
+# Миграции схемы по порядку; номер миграции = PRAGMA user_version после нее.
+# Новые изменения схемы добавляются только в конец списка.
+MIGRATIONS = [
+    ("Базовые таблицы", _create_base_tables),
+    ("Метки изменений для синхронизации с Google Sheets", _add_sync_tracking),
+    ("Индексы для частых запросов к bookings", _add_booking_indexes),
+    ("Покрывающий индекс для занятых дат", _cover_booked_dates_index),
+    ("Хранилище состояний FSM", _create_fsm_states),
+    ("Журнал событий броней и сводные таблицы", _create_booking_ledger),
+    ("Индекс для постраничного списка броней", _add_booking_date_index),
+    ("Срок оплаты неоплаченных броней", _add_booking_expiry),
+    ("Индекс платежей пользователя", _add_payment_user_index),
+    ("Фоновая проверка ожидающих платежей", _add_payment_polling),
+    ("Повторное использование неоплаченных платежей", _add_payment_reuse),
+    ("Счетчик попыток создания платежа", _create_payment_attempts),
+    ("Выручка по успешным платежам", _derive_revenue_from_payments),
+    ("Сумма возвратов по платежу", _add_refunded_amount),
+]
+
+# Частые запросы для check_query_plans: (метод Database, аргументы)
+HOT_QUERIES = [
+    ('get_user_active_booking', (1,)),
+    ('get_user_booking_date', (1,)),
+    ('get_user_bookings', (1,)),
+    ('has_completed_project', (1,)),
+    ('is_final_paid', (1, '2030-01-01')),
+    ('get_booking_state', (1, '2030-01-01')),
+    ('is_date_available', ('2030-01-01',)),
+    ('get_booked_ordinals', ('2030-01-01', '2030-06-30')),
+    ('get_today_bookings', ()),
+    ('get_upcoming_bookings', (7,)),
+    ('get_changed_booking_keys', ('2030-01-01 00:00:00.000',)),
+    ('get_payment_info', ('payment-id',)),
+    ('get_payments_by_ids', (['payment-1', 'payment-2'],)),
+    ('get_latest_payment', (1, 'deposit')),
+    ('get_due_payments', (100,)),
+    ('get_reusable_payment', (1, '2030-01-01', 'deposit')),
+    ('get_payment_attempt', (1, '2030-01-01', 'deposit')),
+    ('get_booking', (1, '2030-01-01')),
+    ('get_weekly_load', ('2030-01-01', '2030-02-01')),
+    ('get_bookings_page', (('2030-01-01', 100),)),
+    ('get_bookings_page', (('2030-01-01', 100), True)),
+]
+
+
+class AsyncDatabase:
+    """Общий для всех модулей асинхронный слой доступа к базе.
+
+    Запись идет через одно соединение в отдельном потоке, чтение - через
+    небольшой пул соединений. Event loop никогда не ждет SQLite, а соединения
+    открываются один раз на поток.
+
+    При group_commit записи, пришедшие в течение group_window секунд,
+    выполняются одной транзакцией (каждая в своем SAVEPOINT) и ждут одного
+    fsync на всех. Вызывающий получает результат только после коммита.
+
+    Файл базы открывается и мигрируется при open() или первом запросе, а не
+    при создании объекта: импорт модуля не трогает bookings.db.
+    """
+
+    def __init__(self, path=config.DB_PATH, readers=config.DB_READERS, group_commit=config.DB_GROUP_COMMIT,
+                 group_window=config.DB_GROUP_COMMIT_WINDOW, group_max=config.DB_GROUP_COMMIT_MAX, **options):
+        self.path = path
+        self.options = options
+        self.group_commit = group_commit
+        self.group_window = group_window
+        self.group_max = group_max
+        self._pending = []
+        self._pending_lock = threading.Lock()
+        self._local = threading.local()
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db-writer",
+                                          initializer=self._open, initargs=(True,))
+        self._readers = ThreadPoolExecutor(max_workers=readers, thread_name_prefix="db-reader",
+                                           initializer=self._open, initargs=(False,))
+        self._opened = False
+        self._open_lock = threading.Lock()
+
+    def _open(self, create):
+        self._local.db = Database(self.path, create=create, **self.options)
+
+    def open(self):
+        """Открывает базу и применяет миграции (повторный вызов ничего не делает)"""
+        if self._opened:
+            return
+        with self._open_lock:
+            if not self._opened:
+                # Таблицы создает писатель, до первого чтения
+                self._writer.submit(lambda: None).result()
+                self._opened = True
+
+    def _run(self, method, args):
+        return method(self._local.db, *args)
+
+    async def _write(self, method, *args):
+        self.open()
+        loop = asyncio.get_running_loop()
+        if not self.group_commit:
+            return await loop.run_in_executor(self._writer, self._run, method, args)
+
+        future = loop.create_future()
+        with self._pending_lock:
+            self._pending.append((method, args, future, loop))
+            first = len(self._pending) == 1
+        if first:
+            self._writer.submit(self._commit_group)
+        return await future
+
+    def _commit_group(self):
+        """Выполняет накопленные записи одной транзакцией (поток писателя)"""
+        if self.group_window:
+            time.sleep(self.group_window)
+        with self._pending_lock:
+            batch, self._pending = self._pending[:self.group_max], self._pending[self.group_max:]
+            if self._pending:
+                self._writer.submit(self._commit_group)
+        if not batch:
+            return
+
+        database = self._local.db
+        cursor = database.conn.cursor()
+        results = []
+        database.autocommit = False
+        try:
+            cursor.execute('BEGIN')
+            for method, args, future, loop in batch:
+                # Ошибка одной записи откатывает только ее
+                cursor.execute('SAVEPOINT job')
+                try:
+                    results.append((True, method(database, *args)))
+                    cursor.execute('RELEASE job')
+                except Exception as e:
+                    cursor.execute('ROLLBACK TO job')
+                    cursor.execute('RELEASE job')
+                    results.append((False, e))
+            database.conn.commit()
+        except Exception as e:
+            if database.conn.in_transaction:
+                database.conn.rollback()
+            logger.error(f"Ошибка группового коммита ({len(batch)} записей): {e}")
+            results = [(False, e)] * len(batch)
+        finally:
+            database.autocommit = True
+
+        for (method, args, future, loop), (ok, value) in zip(batch, results):
+            loop.call_soon_threadsafe(self._resolve, future, ok, value)
+
+    @staticmethod
+    def _resolve(future, ok, value):
+        if future.cancelled():
+            return
+        if ok:
+            future.set_result(value)
+        else:
+            future.set_exception(value)
+
+    async def _read(self, method, *args):
+        self.open()
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._readers, self._run, method, args)
+
+    def read_blocking(self, method, *args):
+        """Чтение из кода, который уже работает в отдельном потоке (не из event loop)"""
+        self.open()
+        return self._readers.submit(self._run, method, args).result()
+
+    async def run_on_writer(self, method, *args):
+        """Выполняет метод Database в потоке писателя вне группового коммита.
+
+        Для обслуживания (VACUUM, пакетное удаление), которое само управляет
+        транзакциями и не может выполняться внутри чужой транзакции.
+        """
+        self.open()
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._writer, self._run, method, args)
+
+    def close(self):
+        """Дожидается незавершенных запросов и останавливает потоки"""
+        self._writer.shutdown(wait=True)
+        self._readers.shutdown(wait=True)
+
+    # Запись
+
+    async def add_booking(self, user_id, username, full_name, booking_date):
+        return await self._write(Database.add_booking, user_id, username, full_name, booking_date)
+
+    async def add_booking_once(self, user_id, username, full_name, booking_date):
+        return await self._write(Database.add_booking_once, user_id, username, full_name, booking_date)
+
+    async def save_payment_info(self, user_id, payment_id, amount, booking_date, payment_type, confirmation_url=None,
+                                attempt=None):
+        return await self._write(Database.save_payment_info, user_id, payment_id, amount, booking_date, payment_type,
+                                 confirmation_url, attempt)
+
+    async def skip_payment_attempt(self, user_id, booking_date, payment_type, attempt):
+        return await self._write(Database.skip_payment_attempt, user_id, booking_date, payment_type, attempt)
+
+    async def update_payment_status(self, payment_id, status):
+        return await self._write(Database.update_payment_status, payment_id, status)
+
+    async def record_refund(self, payment_id, refunded_amount, full):
+        return await self._write(Database.record_refund, payment_id, refunded_amount, full)
+
+    async def apply_payment_statuses(self, updates, reschedule, refunds=()):
+        return await self._write(Database.apply_payment_statuses, updates, reschedule, refunds)
+
+    async def mark_deposit_paid(self, booking_id, user_id):
+        return await self._write(Database.mark_deposit_paid, booking_id, user_id)
+
+    async def mark_final_paid(self, booking_id, user_id):
+        return await self._write(Database.mark_final_paid, booking_id, user_id)
+
+    async def delete_booking(self, user_id, booking_date):
+        return await self._write(Database.delete_booking, user_id, booking_date)
+
+    async def mark_project_completed(self, user_id, booking_date):
+        return await self._write(Database.mark_project_completed, user_id, booking_date)
+
+    async def mark_brief_completed(self, user_id):
+        return await self._write(Database.mark_brief_completed, user_id)
+
+    async def mark_date_as_booked(self, booking_date):
+        return await self._write(Database.mark_date_as_booked, booking_date)
+
+    async def expire_bookings(self, batch=config.RETENTION_BATCH):
+        return await self._write(Database.expire_bookings, batch)
+
+    async def save_fsm_record(self, key, state, data, updated_at):
+        return await self._write(Database.save_fsm_record, key, state, data, updated_at)
+
+    async def delete_expired_fsm_records(self, before):
+        return await self._write(Database.delete_expired_fsm_records, before)
+
+    async def apply_synced_bookings(self, updates, inserts):
+        return await self._write(Database.apply_synced_bookings, updates, inserts)
+
+    async def save_sync_state(self, entries, watermark):
+        return await self._write(Database.save_sync_state, entries, watermark)
+
+    # Чтение
+
+    async def get_payment_info(self, payment_id):
+        return await self._read(Database.get_payment_info, payment_id)
+
+    async def get_payments_by_ids(self, payment_ids):
+        return await self._read(Database.get_payments_by_ids, payment_ids)
+
+    async def get_latest_payment(self, user_id, payment_type):
+        return await self._read(Database.get_latest_payment, user_id, payment_type)
+
+    async def get_due_payments(self, limit):
+        return await self._read(Database.get_due_payments, limit)
+
+    async def get_reusable_payment(self, user_id, booking_date, payment_type):
+        return await self._read(Database.get_reusable_payment, user_id, booking_date, payment_type)
+
+    async def get_payment_attempt(self, user_id, booking_date, payment_type):
+        return await self._read(Database.get_payment_attempt, user_id, booking_date, payment_type)
+
+    async def get_booking(self, user_id, booking_date):
+        return await self._read(Database.get_booking, user_id, booking_date)
+
+    async def get_user_bookings(self, user_id):
+        return await self._read(Database.get_user_bookings, user_id)
+
+    async def get_all_user_bookings(self, user_id):
+        return await self._read(Database.get_all_user_bookings, user_id)
+
+    async def get_user_active_booking(self, user_id):
+        return await self._read(Database.get_user_active_booking, user_id)
+
+    async def get_user_latest_booking(self, user_id):
+        return await self._read(Database.get_user_latest_booking, user_id)
+
+    async def get_user_booking_date(self, user_id):
+        return await self._read(Database.get_user_booking_date, user_id)
+
+    async def has_completed_project(self, user_id):
+        return await self._read(Database.has_completed_project, user_id)
+
+    async def is_final_paid(self, user_id, booking_date):
+        return await self._read(Database.is_final_paid, user_id, booking_date)
+
+    async def is_date_available(self, booking_date):
+        return await self._read(Database.is_date_available, booking_date)
+
+    async def get_booked_ordinals(self, date_from, date_to):
+        return await self._read(Database.get_booked_ordinals, date_from, date_to)
+
+    async def get_horizon_booked_ordinals(self, months=config.BOOKING_HORIZON_MONTHS):
+        return await self._read(Database.get_horizon_booked_ordinals, months)
+
+    async def get_today_bookings(self):
+        return await self._read(Database.get_today_bookings)
+
+    async def get_upcoming_bookings(self, days=7):
+        return await self._read(Database.get_upcoming_bookings, days)
+
+    async def get_db_time(self):
+        return await self._read(Database.get_db_time)
+
+    async def get_changed_booking_keys(self, since=None):
+        return await self._read(Database.get_changed_booking_keys, since)
+
+    async def get_booking_state(self, user_id, booking_date):
+        return await self._read(Database.get_booking_state, user_id, booking_date)
+
+    async def get_status_counts(self):
+        return await self._read(Database.get_status_counts)
+
+    async def get_monthly_revenue(self, month_from=None, month_to=None):
+        return await self._read(Database.get_monthly_revenue, month_from, month_to)
+
+    async def get_weekly_load(self, date_from, date_to):
+        return await self._read(Database.get_weekly_load, date_from, date_to)
+
+    async def get_bookings_page(self, cursor_key=None, backward=False, limit=10):
+        return await self._read(Database.get_bookings_page, cursor_key, backward, limit)
+
+    async def get_booking_events(self, booking_id):
+        return await self._read(Database.get_booking_events, booking_id)
+
+    async def get_fsm_record(self, key):
+        return await self._read(Database.get_fsm_record, key)
+
+    async def get_sync_state(self):
+        return await self._read(Database.get_sync_state)
+
+
+# Общий слой доступа к базе для всех модулей (база открывается в main(), см. open)
+db = AsyncDatabase()
+
+
+if __name__ == "__main__":
+    # python database.py - проверка планов частых запросов на пустой базе
+    import sys
+
+    logging.basicConfig(level=logging.WARNING)
+    scans = 0
+    for name, sql, plan, full_scan in Database(':memory:').check_query_plans():
+        scans += full_scan
+        print(f"{'SCAN ' if full_scan else 'ok   '}{name}: {sql}")
+        for step in plan:
+            print(f"        {step}")
+    sys.exit(1 if scans else 0)
\ No newline at end of file
@@ -0,0 +1,28 @@
+import inspect
+import logging
+
+logger = logging.getLogger(__name__)
+
+# События жизненного цикла бронирования
+BOOKING_PAID = "booking_paid"  # получена предоплата
+BOOKING_CANCELLED = "booking_cancelled"  # пользователь отменил бронь
+PROJECT_COMPLETED = "project_completed"  # проект доставлен клиенту
+BOOKINGS_SYNCED = "bookings_synced"  # в базу применены правки из Google Sheets
+
+_handlers = {}
+
+
+def subscribe(event, handler):
+    """Подписывает обработчик (обычную или async функцию) на событие"""
+    _handlers.setdefault(event, []).append(handler)
+
+
+async def emit(event, **data):
+    """Вызывает всех подписчиков события, ошибки подписчиков только логируются"""
+    for handler in _handlers.get(event, []):
+        try:
+            result = handler(**data)
+            if inspect.isawaitable(result):
+                await result
+        except Exception as e:
+            logger.error(f"Ошибка обработчика события {event}: {e}")
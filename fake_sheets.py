@@ -0,0 +1,222 @@
+import json
+import random
+import re
+import threading
+import time
+from collections import Counter
+import requests
+from gspread.exceptions import APIError, WorksheetNotFound
+from gspread.utils import a1_to_rowcol, numericise_all
+
+
+def _quota_error():
+    """Ответ Google Sheets при превышении квоты"""
+    response = requests.models.Response()
+    response.status_code = 429
+    response._content = json.dumps({
+        "error": {"code": 429, "message": "Quota exceeded (fake)", "status": "RESOURCE_EXHAUSTED"}
+    }).encode("utf-8")
+    return APIError(response)
+
+
+class InMemoryWorksheet:
+    """Лист Google Sheets в памяти для тестов и бенчмарков.
+
+    Повторяет те методы gspread.Worksheet, которыми пользуется GoogleSheets.
+    Каждый метод считается одним запросом к API: можно задать задержку
+    latency (секунд) и долю ответов 429 error_rate. Счетчики api_calls,
+    bytes_sent и bytes_received показывают нагрузку на API.
+    """
+
+    def __init__(self, rows=None, title="Sheet1", latency=0.0, error_rate=0.0, seed=None, spreadsheet=None):
+        self.title = title
+        self.latency = latency
+        self.error_rate = error_rate
+        self._rows = [[self._cell(value) for value in row] for row in rows or []]
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.reset_stats()
+        self.spreadsheet = spreadsheet or InMemorySpreadsheet()
+        self.id = self.spreadsheet._register(self)
+
+    def reset_stats(self):
+        """Обнуляет счетчики запросов"""
+        self.api_calls = 0
+        self.errors = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.calls = Counter()
+
+    @staticmethod
+    def _cell(value):
+        if value is None:
+            return ""
+        if isinstance(value, float) and value.is_integer():
+            return str(int(value))
+        return str(value)
+
+    @staticmethod
+    def _size(payload):
+        return len(json.dumps(payload, ensure_ascii=False).encode("utf-8"))
+
+    def _request(self, method, payload=None):
+        """Имитирует запрос к API: задержка, 429 и учет трафика"""
+        with self._lock:
+            self.api_calls += 1
+            self.calls[method] += 1
+            if payload is not None:
+                self.bytes_sent += self._size(payload)
+            fail = self.error_rate and self._random.random() < self.error_rate
+            if fail:
+                self.errors += 1
+
+        if self.latency:
+            time.sleep(self.latency)
+        if fail:
+            raise _quota_error()
+
+    def _response(self, data):
+        with self._lock:
+            self.bytes_received += self._size(data)
+        return data
+
+    def _set(self, row, col, value):
+        while len(self._rows) < row:
+            self._rows.append([])
+        cells = self._rows[row - 1]
+        while len(cells) < col:
+            cells.append("")
+        cells[col - 1] = self._cell(value)
+
+    def _append(self, values):
+        self._rows.append([self._cell(value) for value in values])
+        row = len(self._rows)
+        return f"{self.title}!A{row}:{chr(ord('A') + max(len(values), 1) - 1)}{row}"
+
+    # Чтение
+
+    def get_all_values(self, **kwargs):
+        self._request("get_all_values")
+        return self._response([list(row) for row in self._rows])
+
+    def get_all_records(self, **kwargs):
+        self._request("get_all_records")
+        if not self._rows:
+            return self._response([])
+        headers = self._rows[0]
+        records = []
+        for row in self._rows[1:]:
+            row = numericise_all(row + [""] * (len(headers) - len(row)))
+            records.append(dict(zip(headers, row)))
+        return self._response(records)
+
+    def row_values(self, row, **kwargs):
+        self._request("row_values")
+        values = list(self._rows[row - 1]) if row <= len(self._rows) else []
+        while values and values[-1] == "":
+            values.pop()
+        return self._response(values)
+
+    def col_values(self, col, **kwargs):
+        self._request("col_values")
+        values = [row[col - 1] if len(row) >= col else "" for row in self._rows]
+        while values and values[-1] == "":
+            values.pop()
+        return self._response(values)
+
+    def batch_get(self, ranges, **kwargs):
+        self._request("batch_get", ranges)
+        result = []
+        for name in ranges:
+            start, _, end = name.split("!")[-1].partition(":")
+            first_row, first_col = a1_to_rowcol(start if start[-1].isdigit() else start + "1")
+            last_col = a1_to_rowcol((end or start).rstrip("0123456789") + "1")[1]
+
+            values = []
+            for row in self._rows[first_row - 1:]:
+                cells = row[first_col - 1:last_col]
+                while cells and cells[-1] == "":
+                    cells.pop()
+                values.append(cells)
+            while values and not values[-1]:
+                values.pop()
+            result.append(values)
+        return self._response(result)
+
+    # Запись
+
+    def append_row(self, values, **kwargs):
+        self._request("append_row", values)
+        with self._lock:
+            updated_range = self._append(values)
+        return self._response({"updates": {"updatedRange": updated_range, "updatedRows": 1}})
+
+    def append_rows(self, values, **kwargs):
+        self._request("append_rows", values)
+        with self._lock:
+            ranges = [self._append(row) for row in values]
+        first = re.search(r"(\d+)", ranges[0]).group(1) if ranges else "0"
+        return self._response({"updates": {"updatedRange": f"{self.title}!A{first}", "updatedRows": len(ranges)}})
+
+    def update_cell(self, row, col, value):
+        self._request("update_cell", [row, col, value])
+        with self._lock:
+            self._set(row, col, value)
+        return self._response({"updatedCells": 1})
+
+    def batch_update(self, data, **kwargs):
+        self._request("batch_update", data)
+        updated = 0
+        with self._lock:
+            for item in data:
+                start = item["range"].split(":")[0].split("!")[-1]
+                row, col = a1_to_rowcol(start)
+                for r, values in enumerate(item["values"]):
+                    for c, value in enumerate(values):
+                        self._set(row + r, col + c, value)
+                        updated += 1
+        return self._response({"totalUpdatedCells": updated})
+
+
+class InMemorySpreadsheet:
+    """Таблица в памяти: набор InMemoryWorksheet.
+
+    Запросы уровня таблицы учитываются в счетчиках первого листа.
+    """
+
+    def __init__(self):
+        self._worksheets = []
+
+    def _register(self, worksheet):
+        self._worksheets.append(worksheet)
+        return len(self._worksheets) - 1
+
+    @property
+    def sheet1(self):
+        return self._worksheets[0]
+
+    def worksheets(self):
+        return list(self._worksheets)
+
+    def worksheet(self, title):
+        self.sheet1._request("worksheet")
+        for worksheet in self._worksheets:
+            if worksheet.title == title:
+                return worksheet
+        raise WorksheetNotFound(title)
+
+    def add_worksheet(self, title, rows=1, cols=26, **kwargs):
+        self.sheet1._request("add_worksheet", {"title": title, "rows": rows, "cols": cols})
+        return InMemoryWorksheet(title=title, latency=self.sheet1.latency, spreadsheet=self)
+
+    def batch_update(self, body):
+        self.sheet1._request("spreadsheet_batch_update", body)
+        for request in body.get("requests", []):
+            delete = request.get("deleteDimension")
+            if not delete or delete["range"].get("dimension") != "ROWS":
+                raise NotImplementedError(f"Неподдерживаемый запрос: {request}")
+            target = delete["range"]
+            worksheet = self._worksheets[target["sheetId"]]
+            with worksheet._lock:
+                del worksheet._rows[target["startIndex"]:target["endIndex"]]
+        return self.sheet1._response({"replies": [{} for _ in body.get("requests", [])]})
@@ -0,0 +1,205 @@
+import asyncio
+import uuid
+from datetime import datetime, timezone
+import aiohttp
+from aiohttp import web
+
+
+def _now():
+    return datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "Z"
+
+
+class FakeYooKassa:
+    """API ЮKassa в памяти для тестов и локального запуска.
+
+    Поднимает aiohttp-сервер с теми эндпоинтами v3, которыми пользуется
+    YooKassaClient, и умеет отправлять уведомления на вебхук бота так же,
+    как это делает ЮKassa (см. notify). Повтор запроса с тем же
+    Idempotence-Key возвращает прежний объект.
+    """
+
+    def __init__(self, webhook_url=None, host="127.0.0.1", port=0):
+        self.webhook_url = webhook_url
+        self.host = host
+        self.port = port
+        self.payments = {}
+        self.refunds = {}
+        self.requests = 0
+        self.refund_status = "succeeded"  # статус новых возвратов
+        self._idempotent = {}
+        self._runner = None
+        self._session = None
+
+        self.app = web.Application()
+        self.app.router.add_post("/v3/payments", self._create_payment)
+        self.app.router.add_get("/v3/payments", self._list_payments)
+        self.app.router.add_get("/v3/payments/{id}", self._get_payment)
+        self.app.router.add_post("/v3/refunds", self._create_refund)
+        self.app.router.add_get("/v3/refunds", self._list_refunds)
+        self.app.router.add_get("/v3/refunds/{id}", self._get_refund)
+
+    @property
+    def base_url(self):
+        return f"http://{self.host}:{self.port}/v3"
+
+    async def start(self):
+        self._runner = web.AppRunner(self.app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+        return self
+
+    async def stop(self):
+        if self._session:
+            await self._session.close()
+        if self._runner:
+            await self._runner.cleanup()
+
+    # API
+
+    def _replay(self, request):
+        key = request.headers.get("Idempotence-Key")
+        return key, self._idempotent.get((request.path, key)) if key else None
+
+    async def _create_payment(self, request):
+        self.requests += 1
+        key, previous = self._replay(request)
+        if previous:
+            return web.json_response(previous)
+
+        body = await request.json()
+        payment_id = str(uuid.uuid4())
+        payment = {
+            "id": payment_id,
+            "status": "pending",
+            "paid": False,
+            "amount": body["amount"],
+            "description": body.get("description", ""),
+            "metadata": body.get("metadata", {}),
+            "created_at": _now(),
+            "confirmation": {"type": "redirect", "confirmation_url": f"https://yookassa.test/pay/{payment_id}"},
+            "test": True,
+        }
+        self.payments[payment_id] = payment
+        if key:
+            self._idempotent[(request.path, key)] = payment
+        return web.json_response(payment)
+
+    async def _get_payment(self, request):
+        self.requests += 1
+        payment = self.payments.get(request.match_info["id"])
+        if payment is None:
+            return web.json_response({"type": "error", "code": "not_found", "description": "Payment not found"},
+                                     status=404)
+        return web.json_response(payment)
+
+    def _list(self, request, objects):
+        # Как в ЮKassa: новые объекты первыми, фильтры created_at.* и status,
+        # limit до 100, непрозрачный курсор на следующую страницу
+        self.requests += 1
+        query = request.query
+        try:
+            limit = int(query.get("limit", 10))
+            offset = int(query.get("cursor", 0))
+        except ValueError:
+            return web.json_response({"type": "error", "code": "invalid_request"}, status=400)
+        if not 1 <= limit <= 100:
+            return web.json_response({"type": "error", "code": "invalid_request"}, status=400)
+
+        bounds = {"gte": str.__ge__, "gt": str.__gt__, "lte": str.__le__, "lt": str.__lt__}
+        items = [obj for obj in objects.values()
+                 if all(compare(obj["created_at"], query[f"created_at.{name}"])
+                        for name, compare in bounds.items() if f"created_at.{name}" in query)
+                 and ("status" not in query or obj["status"] == query["status"])]
+        items.sort(key=lambda obj: (obj["created_at"], obj["id"]), reverse=True)
+
+        page = {"type": "list", "items": items[offset:offset + limit]}
+        if offset + limit < len(items):
+            page["next_cursor"] = str(offset + limit)
+        return web.json_response(page)
+
+    async def _list_payments(self, request):
+        return self._list(request, self.payments)
+
+    async def _list_refunds(self, request):
+        return self._list(request, self.refunds)
+
+    async def _create_refund(self, request):
+        self.requests += 1
+        key, previous = self._replay(request)
+        if previous:
+            return web.json_response(previous)
+
+        body = await request.json()
+        if body.get("payment_id") not in self.payments:
+            return web.json_response({"type": "error", "code": "invalid_request", "description": "Unknown payment"},
+                                     status=400)
+        refund = {
+            "id": str(uuid.uuid4()),
+            "payment_id": body["payment_id"],
+            "status": self.refund_status,
+            "amount": body["amount"],
+            "created_at": _now(),
+        }
+        self.refunds[refund["id"]] = refund
+        self._apply_refund(refund)
+        if key:
+            self._idempotent[(request.path, key)] = refund
+        return web.json_response(refund)
+
+    async def _get_refund(self, request):
+        self.requests += 1
+        refund = self.refunds.get(request.match_info["id"])
+        if refund is None:
+            return web.json_response({"type": "error", "code": "not_found"}, status=404)
+        return web.json_response(refund)
+
+    # Действия пользователя и уведомления
+
+    def set_status(self, payment_id, status):
+        """Меняет статус платежа, как будто клиент оплатил или отменил его"""
+        payment = self.payments[payment_id]
+        payment["status"] = status
+        payment["paid"] = status == "succeeded"
+        if status == "succeeded":
+            payment["captured_at"] = _now()
+        return payment
+
+    def _apply_refund(self, refund):
+        # Как в ЮKassa: успешный возврат увеличивает refunded_amount платежа
+        if refund["status"] != "succeeded":
+            return
+        payment = self.payments[refund["payment_id"]]
+        refunded = float((payment.get("refunded_amount") or {}).get("value", 0)) + float(refund["amount"]["value"])
+        payment["refunded_amount"] = {"value": f"{refunded:.2f}", "currency": refund["amount"].get("currency", "RUB")}
+
+    def set_refund_status(self, refund_id, status):
+        """Меняет статус возврата (например, pending -> succeeded)"""
+        refund = self.refunds[refund_id]
+        was_succeeded = refund["status"] == "succeeded"
+        refund["status"] = status
+        if not was_succeeded:
+            self._apply_refund(refund)
+        return refund
+
+    async def notify(self, event, obj, url=None):
+        """Отправляет уведомление в формате ЮKassa на вебхук; возвращает HTTP-код"""
+        if self._session is None:
+            self._session = aiohttp.ClientSession()
+        body = {"type": "notification", "event": event, "object": obj}
+        async with self._session.post(url or self.webhook_url, json=body) as response:
+            return response.status
+
+    async def pay(self, payment_id, notify=True):
+        """Платеж успешно оплачен (и уведомление payment.succeeded)"""
+        payment = self.set_status(payment_id, "succeeded")
+        if notify and self.webhook_url:
+            return await self.notify("payment.succeeded", payment)
+
+    async def burst(self, payment_ids, copies=1):
+        """Одновременные уведомления об оплате, каждое copies раз (как повторы ЮKassa)"""
+        for payment_id in payment_ids:
+            self.set_status(payment_id, "succeeded")
+        return await asyncio.gather(*(self.notify("payment.succeeded", self.payments[payment_id])
+                                      for payment_id in payment_ids for _ in range(copies)))
@@ -0,0 +1,108 @@
+import asyncio
+import json
+import logging
+import time
+from collections import OrderedDict
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage
+import config
+
+logger = logging.getLogger(__name__)
+
+
+class SQLiteStorage(BaseStorage):
+    """Хранилище состояний FSM в SQLite (таблица fsm_states).
+
+    Состояния переживают перезапуск бота, поэтому начатая отправка проекта
+    или ответ в поддержку не теряются. Недавние ключи держатся в LRU-кэше на
+    cache_size записей: чтение из кэша не обращается к базе, запись идет
+    сразу и в кэш, и в базу. Состояния, которые не менялись дольше ttl
+    секунд, считаются брошенными и удаляются фоновой задачей start_sweeper.
+
+    Хранилище рассчитано на один процесс бота: кэш не сверяется с таблицей,
+    и запись другого процесса в тот же ключ этот процесс не увидит, пока
+    ключ не вытеснен из кэша. Telegram и так отдает обновления только
+    одному getUpdates на токен; при перезапуске старый процесс нужно
+    остановить до запуска нового. Для нескольких процессов cache_size=0
+    отключает кэш.
+    """
+
+    def __init__(self, db, cache_size=config.FSM_CACHE_SIZE, ttl=config.FSM_STATE_TTL):
+        self.db = db
+        self.cache_size = cache_size
+        self.ttl = ttl
+        self._cache = OrderedDict()  # ключ -> (state, data, updated_at)
+
+    @staticmethod
+    def _key(key):
+        return ":".join(str(part) for part in (key.bot_id, key.chat_id, key.user_id, key.thread_id,
+                                                key.business_connection_id, key.destiny))
+
+    def _remember(self, key, record):
+        self._cache[key] = record
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    async def _load(self, key):
+        record = self._cache.get(key)
+        if record is not None:
+            self._cache.move_to_end(key)
+        else:
+            row = await self.db.get_fsm_record(key)
+            if row:
+                state, data, updated_at = row
+                record = (state, json.loads(data) if data else {}, updated_at)
+            else:
+                record = (None, {}, 0.0)
+            self._remember(key, record)
+
+        state, data, updated_at = record
+        if state is not None or data:
+            if time.time() - updated_at > self.ttl:
+                return None, {}
+        return state, data
+
+    async def _save(self, key, state, data):
+        updated_at = time.time()
+        self._remember(key, (state, data, updated_at))
+        await self.db.save_fsm_record(key, state, json.dumps(data, ensure_ascii=False), updated_at)
+
+    async def set_state(self, key, state=None):
+        key = self._key(key)
+        _, data = await self._load(key)
+        await self._save(key, state.state if isinstance(state, State) else state, data)
+
+    async def get_state(self, key):
+        state, _ = await self._load(self._key(key))
+        return state
+
+    async def set_data(self, key, data):
+        key = self._key(key)
+        state, _ = await self._load(key)
+        await self._save(key, state, data.copy())
+
+    async def get_data(self, key):
+        _, data = await self._load(self._key(key))
+        return data.copy()
+
+    async def sweep(self):
+        """Удаляет брошенные состояния из базы и кэша"""
+        keys = await self.db.delete_expired_fsm_records(time.time() - self.ttl)
+        for key in keys:
+            self._cache.pop(key, None)
+        if keys:
+            logger.info(f"Удалено брошенных состояний FSM: {len(keys)}")
+        return len(keys)
+
+    async def start_sweeper(self, interval=config.FSM_SWEEP_INTERVAL):
+        """Периодически удаляет брошенные состояния"""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.sweep()
+            except Exception as e:
+                logger.error(f"Ошибка очистки состояний FSM: {e}")
+
+    async def close(self):
+        self._cache.clear()
@@ -1,51 +1,183 @@
+import asyncio
+import functools
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 import gspread
+from gspread.utils import rowcol_to_a1
 from google.oauth2.service_account import Credentials
-from datetime import datetime
+from datetime import datetime, date, timedelta
 import config
 import logging
 
 logger = logging.getLogger(__name__)
 
 # Импортируем db здесь чтобы избежать циклического импорта
-from database import Database
+from database import Database, db
+
+HEADERS = [
+    'Дата создания', 'ID пользователя', 'Username', 'Имя',
+    'Дата брони', 'Статус брифа', 'Статус оплаты', 'ID платежа',
+    'Сумма предоплаты', 'Сумма финальная', 'Заполнен бриф', 'Телефон', 'Email'
+]
+
+
+class SheetsWriteBuffer:
+    """Копит изменения ячеек и отправляет их одним batch_update.
+
+    Для одной ячейки побеждает последняя запись. Изменения отправляются
+    через delay секунд после первой записи в пустой буфер или по flush().
+    """
+
+    def __init__(self, sheet, delay=config.SHEETS_WRITE_FLUSH_DELAY):
+        self.sheet = sheet
+        self.delay = delay
+        self._pending = {}  # (строка, колонка) -> значение
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()  # чтобы пачки не обгоняли друг друга
+        self._timer = None
+
+        # Счетчики для оценки экономии запросов
+        self.cells_queued = 0
+        self.cells_written = 0
+        self.flushes = 0
+        self.flush_errors = 0
+
+    def queue(self, row, col, value):
+        """Ставит изменение ячейки в очередь"""
+        with self._lock:
+            self._pending[(row, col)] = value
+            self.cells_queued += 1
+            self._schedule()
+
+    def _schedule(self):
+        if self._timer is None:
+            self._timer = threading.Timer(self.delay, self.flush)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def flush(self):
+        """Отправляет накопленные изменения одним запросом"""
+        with self._flush_lock:
+            with self._lock:
+                if self._timer is not None:
+                    self._timer.cancel()
+                    self._timer = None
+                pending, self._pending = self._pending, {}
+
+            if not pending:
+                return True
+
+            data = [
+                {'range': rowcol_to_a1(row, col), 'values': [[value]]}
+                for (row, col), value in sorted(pending.items())
+            ]
+            try:
+                self.sheet.batch_update(data, value_input_option='USER_ENTERED')
+            except Exception as e:
+                logger.error(f"Ошибка пакетной записи в Google Sheets ({len(data)} ячеек): {e}")
+                with self._lock:
+                    self.flush_errors += 1
+                    # Более новые значения, пришедшие во время запроса, важнее
+                    for cell, value in pending.items():
+                        self._pending.setdefault(cell, value)
+                    self._schedule()
+                return False
+
+            with self._lock:
+                self.flushes += 1
+                self.cells_written += len(pending)
+            logger.info(f"Записано {len(pending)} ячеек одним запросом, "
+                        f"сэкономлено запросов: {self.api_calls_saved}")
+            return True
 
-db = Database()
+    def _api_calls_saved(self):
+        # Вызывается под self._lock
+        return self.cells_queued - len(self._pending) - self.flushes
+
+    @property
+    def api_calls_saved(self):
+        """Сколько вызовов update_cell заменено пакетными запросами"""
+        with self._lock:
+            return self._api_calls_saved()
+
+    def stats(self):
+        """Счетчики буфера записи"""
+        with self._lock:
+            return {
+                'cells_queued': self.cells_queued,
+                'cells_pending': len(self._pending),
+                'cells_written': self.cells_written,
+                'flushes': self.flushes,
+                'flush_errors': self.flush_errors,
+                'api_calls_saved': self._api_calls_saved(),
+            }
 
 
 class GoogleSheets:
-    def __init__(self):
+    def __init__(self, worksheet=None):
+        """worksheet - готовый лист (например, fake_sheets.InMemoryWorksheet), по умолчанию gspread"""
+        # Индекс строк: (ID пользователя, дата брони) -> номер строки
+        self._row_index = None
+        self._user_rows = {}
+        self._date_rows = {}
+        # Методы вызываются из пула потоков AsyncGoogleSheets
+        self._lock = threading.RLock()
+        self.sheet = None
+        self.writes = None
+        # Меняется при удалении строк (архивация): старые номера строк недействительны
+        self._layout_version = 0
+        self._snapshot_layout = None
+        self._archive_sheets = {}
+
+        self._worksheet = worksheet
+        if worksheet is not None:
+            self.connect()
+
+    def connect(self):
+        """Подключается к Google Sheets.
+
+        Вызывается при прогреве после запуска бота, а не при импорте модулей.
+        """
+        if self.sheet is not None:
+            return True
+
         try:
-            scope = ['https://spreadsheets.google.com/feeds',
-                     'https://www.googleapis.com/auth/drive']
+            if self._worksheet is not None:
+                sheet = self._worksheet
+            else:
+                scope = ['https://spreadsheets.google.com/feeds',
+                         'https://www.googleapis.com/auth/drive']
 
-            creds = Credentials.from_service_account_info(config.GOOGLE_SHEETS_CREDENTIALS, scopes=scope)
-            self.client = gspread.authorize(creds)
+                creds = Credentials.from_service_account_info(config.GOOGLE_SHEETS_CREDENTIALS, scopes=scope)
+                self.client = gspread.authorize(creds)
 
-            # Открываем таблицу
-            self.sheet = self.client.open_by_key(config.SPREADSHEET_ID).sheet1
+                # Открываем таблицу
+                sheet = self.client.open_by_key(config.SPREADSHEET_ID).sheet1
+
+            self.writes = SheetsWriteBuffer(sheet)
+            self.sheet = sheet
 
             # Инициализируем заголовки если таблица пустая
             self._initialize_headers()
+            return True
 
         except Exception as e:
             logger.error(f"Ошибка инициализации Google Sheets: {e}")
-            # Создаем заглушку чтобы бот мог работать
+            # Бот продолжает работать без таблицы
             self.sheet = None
+            return False
 
     def _initialize_headers(self):
         """Инициализирует заголовки если таблица пустая"""
         try:
-            # Пробуем прочитать данные
-            data = self.sheet.get_all_values()
+            # Достаточно прочитать первую строку, а не всю таблицу
+            data = self.sheet.row_values(1)
 
             # Если таблица пустая или нет данных
             if not data or len(data) == 0:
-                headers = [
-                    'Дата создания', 'ID пользователя', 'Username', 'Имя',
-                    'Дата брони', 'Статус брифа', 'Статус оплаты', 'ID платежа',
-                    'Сумма предоплаты', 'Сумма финальная', 'Заполнен бриф', 'Телефон', 'Email'
-                ]
-                self.sheet.append_row(headers)
+                self.sheet.append_row(HEADERS)
                 logger.info("Заголовки таблицы инициализированы")
             else:
                 logger.info("Таблица уже содержит данные")
@@ -54,12 +186,7 @@ class GoogleSheets:
             logger.error(f"Ошибка инициализации заголовков: {e}")
             # Создаем заголовки в любом случае
             try:
-                headers = [
-                    'Дата создания', 'ID пользователя', 'Username', 'Имя',
-                    'Дата брони', 'Статус брифа', 'Статус оплаты', 'ID платежа',
-                    'Сумма предоплаты', 'Сумма финальная', 'Заполнен бриф', 'Телефон', 'Email'
-                ]
-                self.sheet.append_row(headers)
+                self.sheet.append_row(HEADERS)
             except:
                 pass
 
@@ -67,21 +194,128 @@ class GoogleSheets:
         """Проверяет подключение к Google Sheets"""
         return self.sheet is not None
 
+    @staticmethod
+    def _col_letter(col):
+        return rowcol_to_a1(1, col)[:-1]
+
+    def _read_ranges(self, *ranges):
+        """Читает диапазоны колонок (со второй строки) одним batch_get.
+
+        ranges - пары (первая колонка, последняя колонка). Для каждого диапазона
+        возвращает строки одинаковой ширины и одинаковой для всех диапазонов длины.
+        """
+        names = [f"{self._col_letter(first)}2:{self._col_letter(last)}" for first, last in ranges]
+        value_ranges = self.sheet.batch_get(names)
+        height = max((len(values) for values in value_ranges), default=0)
+
+        result = []
+        for (first, last), values in zip(ranges, value_ranges):
+            width = last - first + 1
+            rows = [list(row) + [''] * (width - len(row)) for row in values]
+            rows.extend([[''] * width for _ in range(height - len(rows))])
+            result.append(rows)
+        return result
+
+    def _read_columns(self, *columns):
+        """Читает только нужные колонки; возвращает по кортежу значений на колонку"""
+        ranges = self._read_ranges(*[(col, col) for col in columns])
+        return [tuple(str(row[0]).strip() for row in rows) for rows in ranges]
+
+    def _build_row_index(self, user_ids=None, booking_dates=None):
+        """Строит индекс строк по колонкам ID пользователя и даты брони"""
+        if user_ids is None:
+            user_ids, booking_dates = self._read_columns(2, 5)
+        self._row_index = {}
+        self._user_rows = {}
+        self._date_rows = {}
+        # start=2 потому что первая строка - заголовки
+        for i, (user_id, booking_date) in enumerate(zip(user_ids, booking_dates), start=2):
+            self._index_row(i, user_id, booking_date)
+        logger.info(f"Индекс строк Google Sheets построен: {len(self._row_index)} записей")
+
+    def _index_row(self, row_index, user_id, booking_date):
+        """Добавляет строку в индекс (первая встреченная строка имеет приоритет)"""
+        user_id = str(user_id).strip()
+        booking_date = str(booking_date).strip()
+        if user_id:
+            self._row_index.setdefault((user_id, booking_date), row_index)
+            self._user_rows.setdefault(user_id, row_index)
+        if booking_date:
+            self._date_rows.setdefault(booking_date, row_index)
+
+    def _invalidate_row_index(self):
+        """Сбрасывает индекс, следующий поиск перестроит его"""
+        self._row_index = None
+
+    def _row_matches(self, row_index, user_id=None, booking_date=None):
+        """Дешевая проверка строки из индекса: читаем только одну строку"""
+        row = self.sheet.row_values(row_index)
+        if user_id is not None and (len(row) < 2 or row[1] != str(user_id)):
+            return False
+        if booking_date is not None and (len(row) < 5 or row[4] != booking_date):
+            return False
+        return True
+
+    def _lookup_row(self, user_id=None, booking_date=None):
+        """Ищет строку через индекс, при расхождении перестраивает индекс"""
+        if user_id is not None and booking_date is not None:
+            get_row = lambda: self._row_index.get((str(user_id), booking_date))
+        elif user_id is not None:
+            get_row = lambda: self._user_rows.get(str(user_id))
+        else:
+            get_row = lambda: self._date_rows.get(booking_date)
+
+        with self._lock:
+            if self._row_index is None:
+                self._build_row_index()
+                return get_row()
+
+            row_index = get_row()
+            if row_index and self._row_matches(row_index, user_id, booking_date):
+                return row_index
+
+            # Таблицу могли изменить вручную - перечитываем один раз
+            self._build_row_index()
+            return get_row()
+
+    @staticmethod
+    def _row_from_append_response(response):
+        """Достает номер добавленной строки из ответа append_row"""
+        try:
+            updated_range = response['updates']['updatedRange']
+            return int(re.search(r'![A-Z]+(\d+)', updated_range).group(1))
+        except (KeyError, TypeError, AttributeError):
+            return None
+
+    @staticmethod
+    def _booking_row(user_data, booking_date_str, payment_id=None,
+                     brief_status="Ожидает заполнения брифа",
+                     payment_status="Предоплата ожидается", brief_filled="Нет"):
+        """Формирует строку таблицы для бронирования"""
+        return [
+            datetime.now().strftime("%d.%m.%Y %H:%M"),
+            user_data['user_id'],
+            user_data.get('username', ''),
+            user_data.get('full_name', ''),
+            booking_date_str,  # Используем отформатированную дату
+            brief_status,
+            payment_status,
+            payment_id or "",
+            config.DEPOSIT_AMOUNT,
+            config.FINAL_AMOUNT,
+            brief_filled,  # Заполнен бриф
+            "", "",  # Телефон, Email
+        ]
+
     def find_booking_row(self, booking_date, user_id=None):
         """Находит строку с бронированием по дате или пользователю"""
         if not self.is_connected():
             return None
 
         try:
-            records = self.sheet.get_all_records()
-            for i, record in enumerate(records, start=2):
-                if user_id and str(record.get('ID пользователя', '')) == str(user_id):
-                    return i
-                # Преобразуем дату к формату таблицы (dd.mm.yyyy)
-                record_date = record.get('Дата брони', '')
-                if record_date == booking_date:
-                    return i
-            return None
+            if user_id:
+                return self._lookup_row(user_id=user_id)
+            return self._lookup_row(booking_date=booking_date)
         except Exception as e:
             logger.error(f"Ошибка поиска бронирования: {e}")
             return None
@@ -96,21 +330,17 @@ class GoogleSheets:
             # Преобразуем дату к формату dd.mm.yyyy для Google Sheets
             booking_date_str = booking_date.strftime("%d.%m.%Y")
 
-            row = [
-                datetime.now().strftime("%d.%m.%Y %H:%M"),
-                user_data['user_id'],
-                user_data.get('username', ''),
-                user_data.get('full_name', ''),
-                booking_date_str,  # Используем отформатированную дату
-                "Ожидает заполнения брифа",
-                "Предоплата ожидается",
-                payment_id or "",
-                config.DEPOSIT_AMOUNT,
-                config.FINAL_AMOUNT,
-                "Нет",  # Заполнен бриф
-                "", "",  # Телефон, Email
-            ]
-            self.sheet.append_row(row)
+            row = self._booking_row(user_data, booking_date_str, payment_id)
+            response = self.sheet.append_row(row)
+
+            # Поддерживаем индекс без повторного чтения таблицы
+            row_index = self._row_from_append_response(response)
+            with self._lock:
+                if row_index is None:
+                    self._invalidate_row_index()
+                elif self._row_index is not None:
+                    self._index_row(row_index, user_data['user_id'], booking_date_str)
+
             logger.info(f"Бронирование добавлено: {booking_date_str} для пользователя {user_data['user_id']}")
             return True
         except Exception as e:
@@ -118,30 +348,20 @@ class GoogleSheets:
             return False
 
     def get_booked_dates(self):
-        """Получает все забронированные даты"""
+        """Получает все забронированные даты; None, если таблицу прочитать не удалось"""
         if not self.is_connected():
-            return []
+            return None
 
         try:
-            records = self.sheet.get_all_records()
-            booked_dates = []
+            dates, statuses = self._read_columns(5, 7)
+            booked_dates = [date_str for date_str, status in zip(dates, statuses)
+                            if date_str and status in ('Предоплата получена', 'Полная оплата')]
 
-            # Пропускаем первую строку (заголовки)
-            for i, record in enumerate(records):
-                # Проверяем что запись не пустая и содержит нужные поля
-                if record and isinstance(record, dict):
-                    date_str = record.get('Дата брони', '')
-                    status = record.get('Статус оплаты', '')
-
-                    # Проверяем что date_str не пустой и статус подходящий
-                    if date_str and date_str.strip() and status in ['Предоплата получена', 'Полная оплата']:
-                        booked_dates.append(date_str.strip())
-
-            logger.info(f"Забронированные даты из Google Sheets: {booked_dates}")
+            logger.info(f"Забронированных дат в Google Sheets: {len(booked_dates)}")
             return booked_dates
         except Exception as e:
             logger.error(f"Ошибка получения забронированных дат: {e}")
-            return []
+            return None
 
     def update_booking_status(self, user_id, booking_date, status="Предоплата получена"):
         """Обновляет статус бронирования в Google Sheets"""
@@ -151,53 +371,37 @@ class GoogleSheets:
 
         try:
             # Преобразуем дату к формату dd.mm.yyyy для поиска
-            if isinstance(booking_date, str) and '-' in booking_date:
+            if isinstance(booking_date, date):
+                booking_date_search = booking_date.strftime("%d.%m.%Y")
+            elif isinstance(booking_date, str) and '-' in booking_date:
                 # Если дата в формате YYYY-MM-DD, преобразуем в DD.MM.YYYY
                 date_obj = datetime.strptime(booking_date, "%Y-%m-%d")
                 booking_date_search = date_obj.strftime("%d.%m.%Y")
             else:
                 booking_date_search = booking_date
 
-            # Ищем строку по user_id и booking_date
-            records = self.sheet.get_all_records()
-            logger.info(f"Всего записей в таблице: {len(records)}")
-
-            for i, record in enumerate(records, start=2):  # start=2 потому что первая строка - заголовки
-                record_user_id = str(record.get('ID пользователя', ''))
-                record_booking_date = record.get('Дата брони', '')
-
-                logger.info(f"Запись {i}: user_id={record_user_id}, date={record_booking_date}")
-
-                if (record_user_id == str(user_id) and
-                        record_booking_date == booking_date_search):
-
-                    # Обновляем статус в зависимости от типа статуса
-                    if status == "Проект завершен":
-                        # При завершении проекта обновляем несколько полей
-                        self.sheet.update_cell(i, 7, "Проект завершен")  # Колонка 7 - Статус оплаты
-                        self.sheet.update_cell(i, 6, "Проект завершен")  # Колонка 6 - Статус брифа
-                        self.sheet.update_cell(i, 11, "Да")  # Колонка 11 - Заполнен бриф
-                        logger.info(f"Проект отмечен завершенным для строки {i}")
-
-                    elif status == "Предоплата получена":
-                        # Обновляем только статус оплаты для предоплаты
-                        self.sheet.update_cell(i, 7, status)  # Колонка 7 - Статус оплаты
-                        logger.info(f"Статус обновлен для строки {i}: {status}")
+            # Колонки для обновления в зависимости от типа статуса
+            if status == "Проект завершен":
+                # При завершении проекта обновляем несколько полей
+                cells = [(7, "Проект завершен"),  # Колонка 7 - Статус оплаты
+                         (6, "Проект завершен"),  # Колонка 6 - Статус брифа
+                         (11, "Да")]  # Колонка 11 - Заполнен бриф
+            else:
+                # Для оплат и других статусов обновляем только статус оплаты
+                cells = [(7, status)]  # Колонка 7 - Статус оплаты
 
-                    elif status == "Полная оплата":
-                        # Обновляем статус для финальной оплаты
-                        self.sheet.update_cell(i, 7, status)  # Колонка 7 - Статус оплаты
-                        logger.info(f"Статус обновлен для строки {i}: {status}")
+            # Под блокировкой номер строки не сдвинется архивацией до постановки записи в очередь
+            with self._lock:
+                i = self._lookup_row(user_id=user_id, booking_date=booking_date_search)
+                if not i:
+                    logger.warning(f"Не найдена запись для user_id={user_id}, date={booking_date_search}")
+                    return False
 
-                    else:
-                        # Для других статусов обновляем только статус оплаты
-                        self.sheet.update_cell(i, 7, status)
-                        logger.info(f"Статус обновлен для строки {i}: {status}")
+                for col, value in cells:
+                    self.writes.queue(i, col, value)
 
-                    return True
-
-            logger.warning(f"Не найдена запись для user_id={user_id}, date={booking_date_search}")
-            return False
+            logger.info(f"Статус обновлен для строки {i}: {status}")
+            return True
 
         except Exception as e:
             logger.error(f"Ошибка обновления статуса бронирования: {e}")
@@ -211,12 +415,13 @@ class GoogleSheets:
 
         try:
             # Получаем booking_date из базы данных
-            booking = db.get_user_active_booking(user_id)
+            # (метод выполняется в потоке пула Sheets, поэтому чтение блокирующее)
+            booking = db.read_blocking(Database.get_user_active_booking, user_id)
             if not booking:
                 logger.warning(f"Не найдено активных бронирований для пользователя {user_id}")
                 return False
 
-            booking_date = booking[4]  # booking_date field
+            booking_date = booking.booking_date
             logger.info(f"Обновление статуса для пользователя {user_id}, дата {booking_date}")
 
             return self.update_booking_status(user_id, booking_date, status)
@@ -231,32 +436,336 @@ class GoogleSheets:
             return False
 
         try:
-            row_index = self.find_booking_row(None, user_id)
-            if row_index:
-                self.sheet.update_cell(row_index, 6, "Бриф заполнен")
-                self.sheet.update_cell(row_index, 11, "Да")
-                logger.info(f"Бриф отмечен заполненным для пользователя {user_id}")
-                return True
+            with self._lock:
+                row_index = self.find_booking_row(None, user_id)
+                if row_index:
+                    self.writes.queue(row_index, 6, "Бриф заполнен")
+                    self.writes.queue(row_index, 11, "Да")
+                    logger.info(f"Бриф отмечен заполненным для пользователя {user_id}")
+                    return True
             return False
         except Exception as e:
             logger.error(f"Ошибка отметки брифа: {e}")
             return False
 
+    def get_sync_snapshot(self):
+        """Читает таблицу для синхронизации.
+
+        Возвращает кортежи (номер строки, ID пользователя, дата брони, username,
+        имя, статус брифа, статус оплаты, заполнен бриф).
+        """
+        if not self.is_connected():
+            return None
+
+        try:
+            layout = self._layout_version
+            # Колонки B-G (ID пользователя ... статус оплаты) и K (заполнен бриф)
+            main_columns, brief_column = self._read_ranges((2, 7), (11, 11))
+            user_ids = [row[0].strip() for row in main_columns]
+            booking_dates = [row[3].strip() for row in main_columns]
+            with self._lock:
+                # Заодно обновляем индекс строк - колонки уже прочитаны
+                self._build_row_index(user_ids, booking_dates)
+                self._snapshot_layout = layout
+
+            return [
+                (i, user_id, booking_date, row[1], row[2], row[4], row[5], brief[0])
+                for i, (user_id, booking_date, row, brief)
+                in enumerate(zip(user_ids, booking_dates, main_columns, brief_column), start=2)
+            ]
+        except Exception as e:
+            logger.error(f"Ошибка чтения таблицы для синхронизации: {e}")
+            return None
+
+    def apply_sync(self, cells, new_rows):
+        """Записывает результат синхронизации: ячейки одним batch_update, новые строки одним append_rows"""
+        if not self.is_connected():
+            return False
+
+        try:
+            with self._lock:
+                if cells and self._snapshot_layout != self._layout_version:
+                    logger.warning("Строки таблицы сдвинулись после чтения, синхронизация будет повторена")
+                    return False
+                for row, col, value in cells:
+                    self.writes.queue(row, col, value)
+            if cells and not self.writes.flush():
+                return False
+
+            if new_rows:
+                rows = [self._booking_row(user_data, booking_date_str, None, *statuses)
+                        for user_data, booking_date_str, statuses in new_rows]
+                self.sheet.append_rows(rows)
+                with self._lock:
+                    self._invalidate_row_index()
+            return True
+        except Exception as e:
+            logger.error(f"Ошибка записи синхронизации в Google Sheets: {e}")
+            return False
+
+    def _archive_worksheet(self, title):
+        """Возвращает архивный лист, создает его при необходимости"""
+        archive = self._archive_sheets.get(title)
+        if archive is None:
+            spreadsheet = self.sheet.spreadsheet
+            try:
+                archive = spreadsheet.worksheet(title)
+            except gspread.exceptions.WorksheetNotFound:
+                archive = spreadsheet.add_worksheet(title=title, rows=1, cols=len(HEADERS))
+                archive.append_row(HEADERS)
+                logger.info(f"Создан архивный лист {title}")
+            self._archive_sheets[title] = archive
+        return archive
+
+    @staticmethod
+    def _row_ranges(row_numbers):
+        """Группирует номера строк в непрерывные диапазоны [начало, конец]"""
+        ranges = []
+        for row in sorted(row_numbers):
+            if ranges and ranges[-1][1] == row - 1:
+                ranges[-1][1] = row
+            else:
+                ranges.append([row, row])
+        return ranges
+
+    def archive_completed(self, older_than_days=config.ARCHIVE_AFTER_DAYS, per_year=config.ARCHIVE_PER_YEAR):
+        """Переносит завершенные проекты старше older_than_days дней в архив.
+
+        Строки копируются одним append_rows на архивный лист и удаляются с
+        основного листа одним batch_update. Возвращает число перенесенных строк.
+        """
+        if not self.is_connected():
+            return None
+
+        try:
+            with self._lock:
+                # Отложенные записи ссылаются на номера строк - отправляем их до удаления
+                if not self.writes.flush():
+                    return None
+
+                values = self.sheet.get_all_values()
+                cutoff = date.today() - timedelta(days=older_than_days)
+                archived = {}
+                row_numbers = []
+                for i, row in enumerate(values[1:], start=2):
+                    if len(row) < 7 or row[6].strip() != "Проект завершен":
+                        continue
+                    try:
+                        booking_date = datetime.strptime(row[4].strip(), "%d.%m.%Y").date()
+                    except ValueError:
+                        continue
+                    if booking_date >= cutoff:
+                        continue
+
+                    title = f"{config.ARCHIVE_SHEET_TITLE} {booking_date.year}" if per_year else config.ARCHIVE_SHEET_TITLE
+                    archived.setdefault(title, []).append(row)
+                    row_numbers.append(i)
+
+                if not row_numbers:
+                    return 0
+
+                # Сначала копируем, потом удаляем - при ошибке данные не теряются
+                for title, rows in archived.items():
+                    self._archive_worksheet(title).append_rows(rows)
+
+                # Удаляем снизу вверх, чтобы номера строк не сдвигались
+                requests = [
+                    {"deleteDimension": {"range": {"sheetId": self.sheet.id, "dimension": "ROWS",
+                                                   "startIndex": start - 1, "endIndex": end}}}
+                    for start, end in reversed(self._row_ranges(row_numbers))
+                ]
+                self.sheet.spreadsheet.batch_update({"requests": requests})
+
+                self._layout_version += 1
+                self._invalidate_row_index()
+
+            logger.info(f"В архив перенесено {len(row_numbers)} завершенных проектов: "
+                        f"{', '.join(f'{title} ({len(rows)})' for title, rows in archived.items())}")
+            return len(row_numbers)
+        except Exception as e:
+            logger.error(f"Ошибка архивации завершенных проектов: {e}")
+            with self._lock:
+                self._layout_version += 1
+                self._invalidate_row_index()
+            return None
+
+    def warm_up(self):
+        """Заранее строит индекс строк, чтобы первое обновление статуса было быстрым"""
+        if not self.is_connected():
+            return False
+
+        try:
+            with self._lock:
+                if self._row_index is None:
+                    self._build_row_index()
+            return True
+        except Exception as e:
+            logger.error(f"Ошибка построения индекса строк: {e}")
+            return False
+
+    def flush_writes(self):
+        """Немедленно отправляет отложенные изменения ячеек"""
+        if not self.is_connected():
+            return True
+        return self.writes.flush()
+
     def get_today_bookings(self):
-        """Получает бронирования на сегодня"""
+        """Получает бронирования на сегодня: кортежи (ID пользователя, дата брони, статус оплаты)"""
         if not self.is_connected():
             return []
 
         try:
             today = datetime.now().strftime("%d.%m.%Y")
-            records = self.sheet.get_all_records()
-            today_bookings = []
-
-            for record in records:
-                if record.get('Дата брони') == today and record.get('Статус оплаты') == 'Предоплата получена':
-                    today_bookings.append(record)
-
-            return today_bookings
+            user_ids, dates, statuses = self._read_columns(2, 5, 7)
+            return [(user_id, date_str, status) for user_id, date_str, status in zip(user_ids, dates, statuses)
+                    if date_str == today and status == 'Предоплата получена']
         except Exception as e:
             logger.error(f"Ошибка получения сегодняшних бронирований: {e}")
-            return []
\ No newline at end of file
+            return []
+
+
+class AsyncGoogleSheets:
+    """Асинхронная обертка над GoogleSheets.
+
+    Каждый вызов выполняется в отдельном ограниченном пуле потоков с таймаутом,
+    поэтому медленный ответ Google не останавливает обработку апдейтов.
+    """
+
+    def __init__(self, sheets, max_workers=config.SHEETS_MAX_WORKERS, timeout=config.SHEETS_CALL_TIMEOUT):
+        self.sheets = sheets
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="gsheets")
+
+    async def _call(self, method, *args, default=None, timeout=None, **kwargs):
+        """Выполняет синхронный метод GoogleSheets в пуле потоков"""
+        loop = asyncio.get_running_loop()
+        func = functools.partial(method, *args, **kwargs)
+        timeout = timeout or self.timeout
+        try:
+            return await asyncio.wait_for(loop.run_in_executor(self._executor, func), timeout)
+        except asyncio.TimeoutError:
+            # Поток доработает сам, но обработчик больше его не ждет
+            logger.error(f"Таймаут Google Sheets ({timeout} с) в {method.__name__}")
+            return default
+
+    def is_connected(self):
+        """Проверяет подключение к Google Sheets"""
+        return self.sheets.is_connected()
+
+    async def connect(self, timeout=config.SHEETS_CONNECT_TIMEOUT):
+        """Подключается к Google Sheets в пуле потоков"""
+        loop = asyncio.get_running_loop()
+        try:
+            return await asyncio.wait_for(loop.run_in_executor(self._executor, self.sheets.connect), timeout)
+        except asyncio.TimeoutError:
+            logger.error(f"Таймаут подключения к Google Sheets ({timeout} с)")
+            return False
+
+    async def find_booking_row(self, booking_date, user_id=None):
+        return await self._call(self.sheets.find_booking_row, booking_date, user_id)
+
+    async def add_booking(self, user_data, booking_date, payment_id=None):
+        return await self._call(self.sheets.add_booking, user_data, booking_date, payment_id, default=False)
+
+    async def get_booked_dates(self):
+        return await self._call(self.sheets.get_booked_dates)
+
+    async def update_booking_status(self, user_id, booking_date, status="Предоплата получена"):
+        return await self._call(self.sheets.update_booking_status, user_id, booking_date, status, default=False)
+
+    async def update_payment_status(self, user_id, status="Предоплата получена", final_payment=False):
+        return await self._call(self.sheets.update_payment_status, user_id, status, final_payment, default=False)
+
+    async def mark_brief_completed(self, user_id):
+        return await self._call(self.sheets.mark_brief_completed, user_id, default=False)
+
+    async def get_today_bookings(self):
+        return await self._call(self.sheets.get_today_bookings, default=[])
+
+    async def get_sync_snapshot(self):
+        return await self._call(self.sheets.get_sync_snapshot)
+
+    async def apply_sync(self, cells, new_rows):
+        return await self._call(self.sheets.apply_sync, cells, new_rows, default=False)
+
+    async def archive_completed(self, older_than_days=config.ARCHIVE_AFTER_DAYS, per_year=config.ARCHIVE_PER_YEAR):
+        return await self._call(self.sheets.archive_completed, older_than_days, per_year,
+                                timeout=config.ARCHIVE_TIMEOUT)
+
+    async def start_archive_scheduler(self, interval=config.ARCHIVE_INTERVAL):
+        """Периодически переносит завершенные проекты в архив"""
+        while True:
+            await asyncio.sleep(interval)
+            if self.is_connected():
+                await self.archive_completed()
+
+    async def warm_up(self):
+        return await self._call(self.sheets.warm_up, default=False)
+
+    async def flush_writes(self):
+        return await self._call(self.sheets.flush_writes, default=False)
+
+    def write_stats(self):
+        """Счетчики пакетной записи"""
+        if not self.is_connected():
+            return {}
+        return self.sheets.writes.stats()
+
+    def shutdown(self):
+        """Останавливает пул потоков"""
+        self._executor.shutdown(wait=False)
+
+
+class BookedDatesCache:
+    """Кэш занятых дат из Google Sheets с TTL.
+
+    version меняется при каждом изменении набора дат, по нему можно
+    кэшировать отрисованные клавиатуры. Ошибка чтения таблицы не кэшируется:
+    get() отдает последний удачно прочитанный набор (или None, если его еще
+    нет), а следующий вызов читает таблицу снова.
+    """
+
+    def __init__(self, gsheets, ttl=config.BOOKED_DATES_TTL):
+        self.gsheets = gsheets
+        self.ttl = ttl
+        self.version = 0
+        self._dates = frozenset()
+        self._loaded = False
+        self._expires_at = 0.0
+        self._refresh_lock = asyncio.Lock()
+
+    def _set(self, dates):
+        if dates != self._dates:
+            self._dates = dates
+            self.version += 1
+
+    async def get(self):
+        """Возвращает занятые даты (DD.MM.YYYY), при необходимости обновляет кэш"""
+        if time.monotonic() < self._expires_at:
+            return self._dates
+
+        async with self._refresh_lock:
+            # Пока ждали блокировку, кэш мог обновить другой обработчик
+            if time.monotonic() < self._expires_at:
+                return self._dates
+
+            dates = await self.gsheets.get_booked_dates() if self.gsheets else []
+            if dates is None:
+                # Сбой таблицы - не повод считать все даты свободными
+                return self._dates if self._loaded else None
+            self._set(frozenset(dates))
+            self._loaded = True
+            self._expires_at = time.monotonic() + self.ttl
+            return self._dates
+
+    def invalidate(self, **_):
+        """Следующий get() перечитает даты из таблицы"""
+        self._expires_at = 0.0
+
+    def on_booking_paid(self, booking_date, **_):
+        """Отмечает дату занятой сразу, не дожидаясь записи в таблицу"""
+        if isinstance(booking_date, str) and '-' in booking_date:
+            booking_date = datetime.strptime(booking_date, "%Y-%m-%d")
+        if isinstance(booking_date, date):
+            booking_date = booking_date.strftime("%d.%m.%Y")
+        self._set(self._dates | {booking_date})
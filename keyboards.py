@@ -23,7 +23,7 @@ def get_months_keyboard():
     today = datetime.now()
 
     # Показываем 6 месяцев вперед
-    for i in range(6):
+    for i in range(config.BOOKING_HORIZON_MONTHS):
         month_date = today.replace(day=1) + timedelta(days=32 * i)
         month_name = month_date.strftime("%B %Y")
         builder.button(
@@ -35,8 +35,32 @@ def get_months_keyboard():
     return builder.as_markup()
 
 
-def get_days_keyboard(year_month, booked_dates):
-    """Клавиатура выбора дней для конкретного месяца"""
+# Отрисованные клавиатуры дней для текущей версии занятых дат
+_days_keyboard_cache = {}
+_days_keyboard_version = None
+
+
+def get_days_keyboard(year_month, booked_dates, version=None):
+    """Клавиатура выбора дней для конкретного месяца.
+
+    Если передана version занятых дат, готовая клавиатура берется из кэша.
+    """
+    global _days_keyboard_version
+
+    if version is None:
+        return _build_days_keyboard(year_month, booked_dates)
+
+    if version != _days_keyboard_version:
+        _days_keyboard_cache.clear()
+        _days_keyboard_version = version
+
+    markup = _days_keyboard_cache.get(year_month)
+    if markup is None:
+        markup = _days_keyboard_cache[year_month] = _build_days_keyboard(year_month, booked_dates)
+    return markup
+
+
+def _build_days_keyboard(year_month, booked_dates):
     builder = InlineKeyboardBuilder()
     year, month = map(int, year_month.split('-'))
 
@@ -119,3 +143,16 @@ def get_admin_delivery_keyboard(user_id, booking_date, is_final_paid=False):
     builder.adjust(1)
 
     return builder.as_markup()
+
+
+def get_bookings_page_keyboard(first, last, has_prev, has_next):
+    """Листание списка броней в админке. first/last - крайние брони страницы"""
+    builder = InlineKeyboardBuilder()
+
+    if has_prev:
+        builder.button(text="⬅️ Назад", callback_data=f"bookings_prev_{first.booking_date}_{first.id}")
+    if has_next:
+        builder.button(text="Вперед ➡️", callback_data=f"bookings_next_{last.booking_date}_{last.id}")
+
+    builder.adjust(2)
+    return builder.as_markup()
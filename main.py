@@ -1,41 +1,59 @@
 import asyncio
 import logging
+import time
 from aiogram import Bot, Dispatcher, types, F, Router
 from aiogram.filters import Command, CommandStart, StateFilter
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.fsm.context import FSMContext
-from aiogram.fsm.storage.memory import MemoryStorage
 from aiogram.types import Message, CallbackQuery, FSInputFile
 from aiogram.client.default import DefaultBotProperties
-from datetime import datetime
+from datetime import datetime, timedelta
 import config
+import events
 from keyboards import *
-from google_sheets import GoogleSheets
-from payments import PaymentManager
-from database import Database
+from google_sheets import GoogleSheets, AsyncGoogleSheets, BookedDatesCache
+from payments import PaymentManager, yookassa
+from database import db
 from reminders import ReminderSystem
+from availability import AvailabilityIndex
+from sync import SheetsSync
+from fsm_storage import SQLiteStorage
+from maintenance import Maintenance
+from webhooks import YooKassaWebhook
+from payment_poller import PaymentPoller
+from reconciliation import Reconciler, format_report
 
 # Настройка логирования
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 # Инициализация
-storage = MemoryStorage()
+storage = SQLiteStorage(db)
 bot = Bot(token=config.BOT_TOKEN, default=DefaultBotProperties(parse_mode='HTML'))
 dp = Dispatcher(storage=storage)
-db = Database()
 
-try:
-    gsheets = GoogleSheets()
-    if not gsheets.is_connected():
-        logger.warning("Google Sheets не подключен, работаем только с локальной БД")
-except Exception as e:
-    logger.error(f"Ошибка инициализации Google Sheets: {e}")
-    gsheets = None
+# Подключение к Google Sheets выполняется при прогреве, см. warm_up()
+gsheets = AsyncGoogleSheets(GoogleSheets())
 
 payment_manager = PaymentManager()
 reminder_system = ReminderSystem(gsheets)
 
+# Кэш занятых дат для календаря
+booked_dates_cache = BookedDatesCache(gsheets)
+events.subscribe(events.BOOKING_PAID, booked_dates_cache.on_booking_paid)
+events.subscribe(events.BOOKING_CANCELLED, booked_dates_cache.invalidate)
+
+# Индекс свободных дат: SQLite + ручные правки из Google Sheets в фоне
+availability = AvailabilityIndex(db, booked_dates_cache)
+events.subscribe(events.BOOKING_PAID, availability.on_booking_paid)
+events.subscribe(events.BOOKING_CANCELLED, availability.on_booking_changed)
+events.subscribe(events.PROJECT_COMPLETED, availability.on_booking_changed)
+events.subscribe(events.BOOKINGS_SYNCED, availability.rebuild)
+
+# Двусторонняя синхронизация bookings <-> Google Sheets
+sheets_sync = SheetsSync(db, gsheets)
+maintenance = Maintenance(db)
+
 
 # Состояния для FSM
 class BookingState(StatesGroup):
@@ -71,26 +89,6 @@ async def book_day(message: Message):
 Выберите месяц для просмотра доступных дат:
     """
 
-    # Получаем забронированные даты из обоих источников
-    booked_dates = []
-    if gsheets:
-        booked_dates = gsheets.get_booked_dates()
-
-    # Также получаем забронированные даты из локальной базы
-    from database import Database
-    db = Database()
-
-    # Получаем все активные бронирования с предоплатой
-    all_bookings = db.conn.cursor().execute('''
-        SELECT booking_date FROM bookings 
-        WHERE deposit_paid = TRUE AND status = 'active'
-    ''').fetchall()
-
-    # Добавляем даты из базы в формате DD.MM.YYYY
-    for booking in all_bookings:
-        date_obj = datetime.strptime(booking[0], "%Y-%m-%d")
-        booked_dates.append(date_obj.strftime("%d.%m.%Y"))
-
     await message.answer(info_text, reply_markup=get_months_keyboard())
 
 
@@ -160,14 +158,7 @@ async def examples(message: Message):
 async def support(message: Message, state: FSMContext):
     # Проверяем, завершен ли проект у пользователя
     user_id = message.from_user.id
-    cursor = db.conn.cursor()
-    cursor.execute('''
-        SELECT status FROM bookings 
-        WHERE user_id = ? AND status = 'completed'
-        ORDER BY created_at DESC LIMIT 1
-    ''', (user_id,))
-
-    completed_project = cursor.fetchone()
+    completed_project = await db.has_completed_project(user_id)
 
     if completed_project:
         text = """
@@ -196,17 +187,15 @@ async def support(message: Message, state: FSMContext):
 async def select_month(callback: CallbackQuery):
     month_key = callback.data.split("_")[1]
 
-    # Получаем забронированные даты только из Google Sheets
-    booked_dates = []
-    if gsheets:
-        booked_dates = gsheets.get_booked_dates()
+    # Занятые даты берем из индекса доступности, без запросов к Google
+    booked_dates = availability.booked_dates()
 
     # Логируем для отладки
-    logger.info(f"Отображение календаря для {month_key}, забронированные даты: {booked_dates}")
+    logger.info(f"Отображение календаря для {month_key}, версия занятых дат: {availability.version}")
 
     await callback.message.edit_text(
         "📅 Выберите доступную дату:",
-        reply_markup=get_days_keyboard(month_key, booked_dates)
+        reply_markup=get_days_keyboard(month_key, booked_dates, availability.version)
     )
     await callback.answer()
 
@@ -229,6 +218,11 @@ async def select_date(callback: CallbackQuery):
     date_str = callback.data.split("_")[1]
     date_obj = datetime.strptime(date_str, "%Y-%m-%d")
 
+    # Календарь мог устареть, пока пользователь выбирал дату
+    if not availability.is_available(date_obj):
+        await callback.answer("❌ Эта дата уже занята. Выберите другую.", show_alert=True)
+        return
+
     text = f"""
 📅 <b>Вы выбрали дату:</b> {date_obj.strftime('%d.%m.%Y')}
 
@@ -262,15 +256,13 @@ async def process_deposit_payment(callback: CallbackQuery):
         booking_date=date_str
     )
 
-    if payment:
-        # Сохраняем в базу
-        db.add_booking(
+    # Сохраняем в базу; при повторном нажатии бронь уже заведена
+    if payment and await db.add_booking_once(
             user_id=callback.from_user.id,
             username=callback.from_user.username,
             full_name=callback.from_user.full_name,
             booking_date=date_str
-        )
-
+    ):
         # Добавляем в Google Sheets
         if gsheets:
             user_data = {
@@ -278,14 +270,15 @@ async def process_deposit_payment(callback: CallbackQuery):
                 'username': callback.from_user.username,
                 'full_name': callback.from_user.full_name
             }
-            gsheets.add_booking(user_data, date_obj, payment.id)
+            await gsheets.add_booking(user_data, date_obj, payment["id"])
 
+    if payment:
         # РЕДАКТИРУЕМ текущее сообщение
         await callback.message.edit_text(
             f"💳 <b>Оплата предоплаты</b>\n\n"
             f"Сумма: {config.DEPOSIT_AMOUNT} ₽\n"
             f"Дата брони: {date_obj.strftime('%d.%m.%Y')}\n\n"
-            f"Для оплаты перейдите по ссылке:\n{payment.confirmation.confirmation_url}\n\n"
+            f"Для оплаты перейдите по ссылке:\n{payment['confirmation']['confirmation_url']}\n\n"
             f"<i>После успешной оплаты нажмите кнопку '✅ Я оплатил'</i>",
             # Теперь показываем кнопку "Я оплатил"
             reply_markup=get_payment_keyboard(config.DEPOSIT_AMOUNT, date_str, show_check_button=True)
@@ -309,13 +302,7 @@ async def check_project_status(message: Message):
 
         user_id = int(parts[1])
 
-        cursor = db.conn.cursor()
-        cursor.execute('''
-            SELECT booking_date, status, deposit_paid, final_paid, brief_completed
-            FROM bookings WHERE user_id = ? ORDER BY created_at DESC LIMIT 1
-        ''', (user_id,))
-
-        project = cursor.fetchone()
+        project = await db.get_user_latest_booking(user_id)
 
         if project:
             status_text = {
@@ -326,11 +313,11 @@ async def check_project_status(message: Message):
 
             await message.answer(
                 f"📊 <b>Статус проекта пользователя {user_id}</b>\n\n"
-                f"📅 Дата брони: {project[0]}\n"
-                f"📋 Статус: {status_text.get(project[1], project[1])}\n"
-                f"💰 Предоплата: {'✅ Оплачена' if project[2] else '❌ Не оплачена'}\n"
-                f"💰 Финальная оплата: {'✅ Оплачена' if project[3] else '❌ Не оплачена'}\n"
-                f"📝 Бриф: {'✅ Заполнен' if project[4] else '❌ Не заполнен'}\n"
+                f"📅 Дата брони: {project.booking_date}\n"
+                f"📋 Статус: {status_text.get(project.status, project.status)}\n"
+                f"💰 Предоплата: {'✅ Оплачена' if project.deposit_paid else '❌ Не оплачена'}\n"
+                f"💰 Финальная оплата: {'✅ Оплачена' if project.final_paid else '❌ Не оплачена'}\n"
+                f"📝 Бриф: {'✅ Заполнен' if project.brief_completed else '❌ Не заполнен'}\n"
             )
         else:
             await message.answer("❌ Проект не найден")
@@ -339,114 +326,109 @@ async def check_project_status(message: Message):
         await message.answer(f"❌ Ошибка: {e}")
 
 
-@dp.callback_query(F.data == "check_payment")
-async def check_payment_status(callback: CallbackQuery):
-    """Проверяет статус платежа вручную"""
-    user_id = callback.from_user.id
-    logger.info(f"Пользователь {user_id} нажал 'Я оплатил'")
-
-    # Получаем активное бронирование
-    booking = db.get_user_active_booking(user_id)
-
-    if booking:
-        booking_date = booking[4]  # booking_date field (формат: YYYY-MM-DD)
-        booking_id = booking[0]  # id field
-        payment_type = "deposit"  # Определяем тип платежа
-
-        # Проверяем, это предоплата или финальная оплата
-        if callback.message.text and "Финальная оплата" in callback.message.text:
-            payment_type = "final"
-            # Обновляем статус финальной оплаты в базе
-            cursor = db.conn.cursor()
-            cursor.execute('''
-                UPDATE bookings SET final_paid = TRUE 
-                WHERE id = ? AND user_id = ?
-            ''', (booking_id, user_id))
-            db.conn.commit()
-            logger.info(f"Финальная оплата подтверждена в локальной БД")
-
-            # Обновляем Google Sheets
-            google_sheets_success = False
-            if gsheets:
-                try:
-                    google_sheets_success = gsheets.update_booking_status(user_id, booking_date, "Полная оплата")
-                    logger.info(f"Статус в Google Sheets обновлен: {google_sheets_success}")
-                except Exception as e:
-                    logger.error(f"Ошибка при работе с Google Sheets: {e}")
-                    google_sheets_success = False
-
-            # Редактируем текущее сообщение
-            await callback.message.edit_text(
-                f"✅ <b>Финальная оплата подтверждена!</b>\n\n"
-                f"Спасибо за оплату! Теперь мы можем отправить вам готовый проект.\n\n"
-                f"<i>Ожидайте материалы в течение дня.</i>"
-            )
+async def confirm_payment(payment, message=None):
+    """Сообщает об оплате клиенту, админу и в Google Sheets.
 
-            # Уведомляем админа о готовности к отправке проекта
-            from keyboards import get_admin_delivery_keyboard
-            await bot.send_message(
-                config.ADMIN_ID,
-                f"🎉 <b>Финальная оплата получена!</b>\n\n"
-                f"👤 Пользователь: {callback.from_user.full_name}\n"
-                f"📱 @{callback.from_user.username}\n"
-                f"📅 Дата: {booking_date}\n"
-                f"💰 Финальная оплата: {config.FINAL_AMOUNT} ₽\n\n"
-                f"<i>Теперь можно отправить клиенту готовый проект.</i>",
-                reply_markup=get_admin_delivery_keyboard(user_id, booking_date, is_final_paid=True)
-            )
+    Вызывается один раз на платеж - после того, как update_payment_status
+    перевел его в succeeded: из вебхука ЮKassa или по кнопке «Я оплатил».
+    Если передано message, подтверждение заменяет его текст.
+    """
+    user_id, booking_date = payment.user_id, payment.booking_date
+    is_final = payment.payment_type == "final"
+    booking = await db.get_booking(user_id, booking_date)
+    full_name = booking.full_name if booking else user_id
+    username = booking.username if booking else None
+
+    # Обновляем Google Sheets
+    google_sheets_success = False
+    if gsheets:
+        try:
+            google_sheets_success = await gsheets.update_booking_status(
+                user_id, booking_date, "Полная оплата" if is_final else "Предоплата получена")
+            logger.info(f"Статус в Google Sheets обновлен: {google_sheets_success}")
+        except Exception as e:
+            logger.error(f"Ошибка при работе с Google Sheets: {e}")
+
+    if is_final:
+        text = (
+            f"✅ <b>Финальная оплата подтверждена!</b>\n\n"
+            f"Спасибо за оплату! Теперь мы можем отправить вам готовый проект.\n\n"
+            f"<i>Ожидайте материалы в течение дня.</i>"
+        )
+        admin_text = (
+            f"🎉 <b>Финальная оплата получена!</b>\n\n"
+            f"👤 Пользователь: {full_name}\n"
+            f"📱 @{username}\n"
+            f"📅 Дата: {booking_date}\n"
+            f"💰 Финальная оплата: {config.FINAL_AMOUNT} ₽\n\n"
+            f"<i>Теперь можно отправить клиенту готовый проект.</i>"
+        )
+    else:
+        await events.emit(events.BOOKING_PAID, user_id=user_id, booking_date=booking_date)
+
+        success_message = "✅ <b>Платеж подтвержден!</b>" if google_sheets_success else "⚠️ <b>Платеж подтвержден локально!</b>"
+        google_warning = "" if google_sheets_success else "\n\n<i>Примечание: возникли проблемы с синхронизацией с Google Таблицей, но ваша бронь сохранена.</i>"
+        text = (
+            f"{success_message}\n\n"
+            f"Дата {booking_date} забронирована за вами.\n\n"
+            f"📝 <b>Теперь заполните бриф:</b>\n{config.BRIEF_FORM_URL}\n\n"
+            f"<i>Важно: бриф нужно заполнить до назначенной даты.</i>"
+            f"{google_warning}"
+        )
+        admin_text = (
+            f"🎉 <b>Новое бронирование!</b>\n\n"
+            f"👤 Пользователь: {full_name}\n"
+            f"📱 @{username}\n"
+            f"📅 Дата: {booking_date}\n"
+            f"💰 Предоплата: {config.DEPOSIT_AMOUNT} ₽"
+        )
 
+    if message:
+        await message.edit_text(text)
+    else:
+        await bot.send_message(user_id, text)
 
-        else:
-            # Это предоплата (старая логика)
-            deposit_paid = booking[6]  # deposit_paid field
-            logger.info(f"Бронирование найдено: ID={booking_id}, дата={booking_date}, deposit_paid={deposit_paid}")
-
-            # Обновляем статус оплаты в базе
-            cursor = db.conn.cursor()
-            cursor.execute('''
-                UPDATE bookings SET deposit_paid = TRUE 
-                WHERE id = ? AND user_id = ?
-            ''', (booking_id, user_id))
-            db.conn.commit()
-            logger.info(f"Статус предоплаты обновлен в локальной БД")
+    # Уведомляем админа
+    await bot.send_message(
+        config.ADMIN_ID, admin_text,
+        reply_markup=get_admin_delivery_keyboard(user_id, booking_date, is_final_paid=is_final)
+    )
 
-            # Обновляем Google Sheets
-            google_sheets_success = False
-            if gsheets:
-                try:
-                    google_sheets_success = gsheets.update_booking_status(user_id, booking_date, "Предоплата получена")
-                    logger.info(f"Статус в Google Sheets обновлен: {google_sheets_success}")
-                except Exception as e:
-                    logger.error(f"Ошибка при работе с Google Sheets: {e}")
-                    google_sheets_success = False
 
-            # Редактируем текущее сообщение
-            success_message = "✅ <b>Платеж подтвержден!</b>" if google_sheets_success else "⚠️ <b>Платеж подтвержден локально!</b>"
-            google_warning = "" if google_sheets_success else "\n\n<i>Примечание: возникли проблемы с синхронизацией с Google Таблицей, но ваша бронь сохранена.</i>"
+@dp.callback_query(F.data == "check_payment")
+async def check_payment_status(callback: CallbackQuery):
+    """Проверяет статус платежа в ЮKassa по кнопке «Я оплатил»"""
+    user_id = callback.from_user.id
+    logger.info(f"Пользователь {user_id} нажал 'Я оплатил'")
 
-            await callback.message.edit_text(
-                f"{success_message}\n\n"
-                f"Дата {booking_date} забронирована за вами.\n\n"
-                f"📝 <b>Теперь заполните бриф:</b>\n{config.BRIEF_FORM_URL}\n\n"
-                f"<i>Важно: бриф нужно заполнить до назначенной даты.</i>"
-                f"{google_warning}"
-            )
+    # Проверяем, это предоплата или финальная оплата
+    payment_type = "deposit"
+    if callback.message.text and "Финальная оплата" in callback.message.text:
+        payment_type = "final"
 
-            # Уведомляем админа
-            from keyboards import get_admin_delivery_keyboard
-            await bot.send_message(
-                config.ADMIN_ID,
-                f"🎉 <b>Новое бронирование!</b>\n\n"
-                f"👤 Пользователь: {callback.from_user.full_name}\n"
-                f"📱 @{callback.from_user.username}\n"
-                f"📅 Дата: {booking_date}\n"
-                f"💰 Предоплата: {config.DEPOSIT_AMOUNT} ₽",
-                reply_markup=get_admin_delivery_keyboard(user_id, booking_date, is_final_paid=False)
-            )
+    payment = await db.get_latest_payment(user_id, payment_type)
+    if not payment:
+        logger.warning(f"Не найдено платежей пользователя {user_id} ({payment_type})")
+        await callback.message.edit_text("❌ Не найдено активных бронирований.")
+        await callback.answer()
+        return
 
+    # Статус подтверждает только ЮKassa; вебхук мог успеть раньше кнопки
+    status = await payment_manager.check_payment_status(payment.payment_id)
+    if status == "succeeded":
+        confirmed = await db.update_payment_status(payment.payment_id, status)
+        if confirmed:
+            await confirm_payment(confirmed, callback.message)
+        else:
+            await callback.message.edit_text("✅ <b>Оплата уже подтверждена.</b>")
+    elif status == "canceled":
+        await db.update_payment_status(payment.payment_id, status)
+        await callback.answer("❌ Платеж отменен. Попробуйте оплатить еще раз.", show_alert=True)
+        return
     else:
-        logger.warning(f"Не найдено активных бронирований для пользователя {user_id}")
-        await callback.message.edit_text("❌ Не найдено активных бронирований.")
+        await callback.answer("⏳ Платеж еще не поступил. Если вы уже оплатили, подождите минуту и нажмите снова.",
+                              show_alert=True)
+        return
 
     await callback.answer()
 
@@ -464,18 +446,16 @@ async def cancel_booking(callback: CallbackQuery):
     logger.info(f"Пользователь {user_id} отменил бронирование")
 
     # Удаляем последнее бронирование пользователя
-    bookings = db.get_user_bookings(user_id)
+    bookings = await db.get_user_bookings(user_id)
     if bookings:
         latest_booking = bookings[0]
-        booking_date = latest_booking[4]
+        booking_date = latest_booking.booking_date
 
         # Удаляем бронирование из базы
-        cursor = db.conn.cursor()
-        cursor.execute('DELETE FROM bookings WHERE user_id = ? AND booking_date = ?',
-                       (user_id, booking_date))
-        db.conn.commit()
+        await db.delete_booking(user_id, booking_date)
 
         logger.info(f"Бронирование {booking_date} удалено для пользователя {user_id}")
+        await events.emit(events.BOOKING_CANCELLED, user_id=user_id, booking_date=booking_date)
 
     # Редактируем сообщение
     await callback.message.edit_text(
@@ -489,11 +469,11 @@ async def cancel_booking(callback: CallbackQuery):
 async def process_final_payment(callback: CallbackQuery):
     """Обработка финальной оплаты"""
     user_id = callback.from_user.id
-    bookings = db.get_user_bookings(user_id)
+    bookings = await db.get_user_bookings(user_id)
 
     if bookings:
         latest_booking = bookings[0]
-        booking_date = latest_booking[4]
+        booking_date = latest_booking.booking_date
 
         payment = await payment_manager.create_payment(
             amount=config.FINAL_AMOUNT,
@@ -508,7 +488,7 @@ async def process_final_payment(callback: CallbackQuery):
             await callback.message.edit_text(
                 f"💳 <b>Финальная оплата</b>\n\n"
                 f"Сумма: {config.FINAL_AMOUNT} ₽\n\n"
-                f"Для оплаты перейдите по ссылке:\n{payment.confirmation.confirmation_url}\n\n"
+                f"Для оплаты перейдите по ссылке:\n{payment['confirmation']['confirmation_url']}\n\n"
                 f"<i>После успешной оплаты нажмите кнопку '✅ Я оплатил'</i>",
                 # Теперь показываем кнопку "Я оплатил" только после нажатия оплаты
                 reply_markup=get_payment_keyboard(config.FINAL_AMOUNT, is_final=True, show_check_button=False)
@@ -555,18 +535,16 @@ async def cancel_booking(callback: CallbackQuery):
     logger.info(f"Пользователь {user_id} отменил бронирование")
 
     # Удаляем последнее бронирование пользователя
-    bookings = db.get_user_bookings(user_id)
+    bookings = await db.get_user_bookings(user_id)
     if bookings:
         latest_booking = bookings[0]
-        booking_date = latest_booking[4]
+        booking_date = latest_booking.booking_date
 
         # Удаляем бронирование из базы
-        cursor = db.conn.cursor()
-        cursor.execute('DELETE FROM bookings WHERE user_id = ? AND booking_date = ?',
-                       (user_id, booking_date))
-        db.conn.commit()
+        await db.delete_booking(user_id, booking_date)
 
         logger.info(f"Бронирование {booking_date} удалено для пользователя {user_id}")
+        await events.emit(events.BOOKING_CANCELLED, user_id=user_id, booking_date=booking_date)
 
     # Редактируем сообщение
     await callback.message.edit_text(
@@ -585,15 +563,7 @@ async def deliver_project(callback: CallbackQuery, state: FSMContext):
     booking_date = parts[2]
 
     # Проверяем, оплачена ли финальная часть
-    cursor = db.conn.cursor()
-    cursor.execute('''
-        SELECT final_paid FROM bookings 
-        WHERE user_id = ? AND booking_date = ?
-    ''', (user_id, booking_date))
-
-    result = cursor.fetchone()
-
-    if not result or not result[0]:
+    if not await db.is_final_paid(user_id, booking_date):
         await callback.answer("❌ Финальная оплата еще не получена!", show_alert=True)
         return
 
@@ -766,16 +736,13 @@ async def handle_project_delivery(message: Message, state: FSMContext):
             )
 
             # Обновляем статус в базе данных
-            cursor = db.conn.cursor()
-            cursor.execute('''
-                UPDATE bookings SET status = 'completed' 
-                WHERE user_id = ? AND booking_date = ?
-            ''', (target_user_id, booking_date))
-            db.conn.commit()
+            await db.mark_project_completed(target_user_id, booking_date)
 
             # Обновляем Google Sheets
             if gsheets:
-                gsheets.update_booking_status(target_user_id, booking_date, "Проект завершен")
+                await gsheets.update_booking_status(target_user_id, booking_date, "Проект завершен")
+
+            await events.emit(events.PROJECT_COMPLETED, user_id=target_user_id, booking_date=booking_date)
 
             await state.clear()
         else:
@@ -808,6 +775,7 @@ async def admin_panel(message: Message):
 /bookings - Посмотреть бронирования
 /stats - Статистика
 /remind - Отправить напоминания
+/sync - Синхронизировать с Google Таблицей
 /project_status user_id - Статус проекта
 
 Также используйте кнопки доставки проекта из уведомлений о бронированиях.
@@ -824,6 +792,134 @@ async def send_manual_reminders(message: Message):
     await message.answer("✅ Напоминания отправлены")
 
 
+@dp.message(Command("sync"))
+async def sync_with_sheets(message: Message):
+    """Запускает синхронизацию с Google Sheets вручную"""
+    if message.from_user.id != config.ADMIN_ID:
+        return
+
+    report = await sheets_sync.run()
+    if report is None:
+        await message.answer("❌ Синхронизация не выполнена, подробности в логах")
+        return
+
+    await message.answer(
+        f"🔄 <b>Синхронизация с Google Таблицей</b>\n\n"
+        f"Проверено броней: {report['checked']}\n"
+        f"Расхождений: {report['drifted']}\n"
+        f"• база → таблица: {report['db_to_sheet']}\n"
+        f"• таблица → база: {report['sheet_to_db']}\n"
+        f"• добавлено в таблицу: {report['appended']}\n"
+        f"• добавлено в базу: {report['inserted']}\n"
+        f"Конфликтов (победила база): {report['conflicts']}"
+    )
+
+
+STATUS_NAMES = {
+    'active': 'Активные',
+    'booked': 'Забронированы',
+    'completed': 'Завершены',
+    'cancelled': 'Отменены',
+    'expired': 'Не оплачены вовремя',
+}
+
+
+def format_rub(amount):
+    return f"{amount:,.0f} ₽".replace(",", " ")
+
+
+@dp.message(Command("stats"))
+async def show_stats(message: Message):
+    """Статистика по сводным таблицам (без просмотра bookings)"""
+    if message.from_user.id != config.ADMIN_ID:
+        return
+
+    status_counts = await db.get_status_counts()
+    revenue = await db.get_monthly_revenue()
+    today = datetime.now().date()
+    weekly_load = await db.get_weekly_load(today, today + timedelta(weeks=config.STATS_WEEKS_AHEAD))
+
+    deposits = sum(row[1] for row in revenue)
+    finals = sum(row[2] for row in revenue)
+    deposit_amount = sum(row[3] for row in revenue)
+    final_amount = sum(row[4] for row in revenue)
+    completed = status_counts.get('completed', 0)
+    conversion = f"{completed / deposits:.0%}" if deposits else "—"
+
+    lines = ["📊 <b>Статистика</b>\n", "<b>Брони по статусам:</b>"]
+    for status, count in sorted(status_counts.items(), key=lambda item: -item[1]):
+        lines.append(f"• {STATUS_NAMES.get(status, status)}: {count}")
+
+    lines += [
+        "",
+        "<b>Оплаты:</b>",
+        f"• Предоплат: {deposits} ({format_rub(deposit_amount)})",
+        f"• Финальных оплат: {finals} ({format_rub(final_amount)})",
+        f"• Всего получено: {format_rub(deposit_amount + final_amount)}",
+        f"• Конверсия предоплата → завершение: {conversion}",
+        "",
+        f"<b>Загрузка на {config.STATS_WEEKS_AHEAD} нед.:</b>",
+    ]
+    load = dict(weekly_load)
+    monday = today - timedelta(days=today.weekday())
+    for week in range(config.STATS_WEEKS_AHEAD):
+        week_start = monday + timedelta(weeks=week)
+        lines.append(f"• с {week_start.strftime('%d.%m')}: {load.get(week_start.isoformat(), 0)}/3")
+
+    await message.answer("\n".join(lines))
+
+
+def format_bookings_page(bookings):
+    lines = ["📋 <b>Бронирования</b>\n"]
+    for booking in bookings:
+        payment = "💰💰" if booking.final_paid else "💰" if booking.deposit_paid else "—"
+        username = f" @{booking.username}" if booking.username else ""
+        lines.append(f"{booking.booking_date.strftime('%d.%m.%Y')} · {booking.full_name or booking.user_id}"
+                     f"{username} · {STATUS_NAMES.get(booking.status, booking.status)} · {payment}")
+    return "\n".join(lines)
+
+
+@dp.message(Command("bookings"))
+async def show_bookings(message: Message):
+    """Список броней по страницам, от поздних дат к ранним"""
+    if message.from_user.id != config.ADMIN_ID:
+        return
+
+    bookings, has_next = await db.get_bookings_page(limit=config.ADMIN_BOOKINGS_PAGE_SIZE)
+    if not bookings:
+        await message.answer("📋 Бронирований пока нет")
+        return
+
+    await message.answer(
+        format_bookings_page(bookings),
+        reply_markup=get_bookings_page_keyboard(bookings[0], bookings[-1], False, has_next)
+    )
+
+
+@dp.callback_query(F.data.startswith("bookings_"))
+async def page_bookings(callback: CallbackQuery):
+    """Листание списка броней по ключу крайней брони (без OFFSET)"""
+    if callback.from_user.id != config.ADMIN_ID:
+        await callback.answer()
+        return
+
+    _, direction, booking_date, booking_id = callback.data.split("_")
+    backward = direction == "prev"
+    bookings, has_more = await db.get_bookings_page((booking_date, int(booking_id)), backward,
+                                                    limit=config.ADMIN_BOOKINGS_PAGE_SIZE)
+    if not bookings:
+        await callback.answer("Больше бронирований нет")
+        return
+
+    # С соседней страницы пришли, значит в обратную сторону страницы есть
+    has_prev, has_next = (has_more, True) if backward else (True, has_more)
+    await callback.message.edit_text(
+        format_bookings_page(bookings),
+        reply_markup=get_bookings_page_keyboard(bookings[0], bookings[-1], has_prev, has_next)
+    )
+    await callback.answer()
+
+
 @dp.message(Command("refund"))
 async def process_refund(message: Message):
     """Обработка возврата средств (только для админа)"""
@@ -851,15 +947,72 @@ async def process_refund(message: Message):
 
 # 📍 ЗАПУСК БОТА
 
+async def send_reconciliation_report(report):
+    """Отправляет админу отчет ночной сверки, если что-то исправлено, не сходится или возвращено частично"""
+    if report['corrected'] or report['mismatches'] or report['partial_refunds']:
+        await bot.send_message(config.ADMIN_ID, format_report(report))
+
+
 async def start_schedulers():
     """Запускает все планировщики"""
     asyncio.create_task(reminder_system.start_reminder_scheduler(bot))
+    asyncio.create_task(availability.start_reconciler())
+    asyncio.create_task(sheets_sync.start_scheduler())
+    asyncio.create_task(gsheets.start_archive_scheduler())
+    asyncio.create_task(storage.start_sweeper())
+    asyncio.create_task(maintenance.start_scheduler())
+    asyncio.create_task(maintenance.start_expiry_sweeper())
+    # Платежи, о которых не пришло уведомление, подтверждаются опросом ЮKassa
+    asyncio.create_task(PaymentPoller(db, yookassa, confirm_payment).start_scheduler())
+    asyncio.create_task(Reconciler(db, yookassa, confirm_payment).start_scheduler(send_reconciliation_report))
+
+
+async def warm_up():
+    """Подключается к внешним сервисам параллельно с обработкой апдейтов"""
+    started = time.monotonic()
+
+    attempt = 1
+    while not await gsheets.connect():
+        logger.warning(f"Google Sheets не подключен, работаем только с локальной БД "
+                       f"(попытка {attempt}, повтор через {config.SHEETS_RECONNECT_INTERVAL} с)")
+        attempt += 1
+        await asyncio.sleep(config.SHEETS_RECONNECT_INTERVAL)
+
+    # Пока таблица была недоступна, в кэш могли попасть пустые данные
+    booked_dates_cache.invalidate()
+    await asyncio.gather(gsheets.warm_up(), booked_dates_cache.get())
+
+    logger.info(f"Бот готов: Google Sheets подключен, прогрев занял {time.monotonic() - started:.1f} с")
 
 
 async def main():
     logger.info("Бот Айви запущен!")
+    # Миграции до первого апдейта, в потоке писателя
+    await asyncio.get_running_loop().run_in_executor(None, db.open)
+    await availability.rebuild()
     await start_schedulers()
-    await dp.start_polling(bot)
+    asyncio.create_task(warm_up())
+
+    # Уведомления ЮKassa подтверждают оплату без кнопки «Я оплатил»
+    webhook = YooKassaWebhook(db, yookassa, confirm_payment) if config.WEBHOOK_ENABLED else None
+    if webhook:
+        try:
+            await webhook.start()
+        except OSError as e:
+            # Порт занят или недоступен: оплату подтвердит фоновая проверка
+            logger.error(f"Не удалось запустить вебхук ЮKassa: {e}; платежи проверяются опросом")
+            await webhook.stop()
+            webhook = None
+    try:
+        await dp.start_polling(bot)
+    finally:
+        if webhook:
+            await webhook.stop()
+        if gsheets:
+            await gsheets.flush_writes()
+            gsheets.shutdown()
+        await payment_manager.close()
+        db.close()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,166 @@
+import asyncio
+import logging
+import os
+import sqlite3
+import time
+from datetime import datetime, timedelta
+import config
+from database import Database
+
+logger = logging.getLogger(__name__)
+
+
+class Maintenance:
+    """Обслуживание базы без остановки бота.
+
+    Резервная копия снимается через sqlite3.Connection.backup маленькими
+    шагами в отдельном потоке; очистка и VACUUM идут короткими транзакциями
+    в потоке писателя, между шагами event loop и другие записи не ждут.
+    Каждая задача возвращает отчет с длительностью и временем блокировки.
+    """
+
+    def __init__(self, db, backup_dir=config.BACKUP_DIR):
+        self.db = db
+        self.backup_dir = backup_dir
+        self.last_reports = []
+
+    def _backup(self, target_path):
+        # Отдельные соединения: копирование не занимает потоки AsyncDatabase
+        steps = []
+        last = time.perf_counter()
+
+        def progress(status, remaining, total):
+            # Вызывается после каждого шага: шаг держал блокировку чтения
+            # источника, пауза между шагами дает писателю сделать checkpoint
+            nonlocal last
+            steps.append(time.perf_counter() - last)
+            if remaining:
+                time.sleep(config.BACKUP_STEP_PAUSE)
+            last = time.perf_counter()
+
+        source = sqlite3.connect(self.db.path)
+        target = sqlite3.connect(target_path)
+        try:
+            source.backup(target, pages=config.BACKUP_PAGES, progress=progress)
+        finally:
+            target.close()
+            source.close()
+        return len(steps), sum(steps), max(steps, default=0.0)
+
+    async def backup(self):
+        """Снимает онлайн-копию базы и удаляет старые копии сверх BACKUP_KEEP"""
+        os.makedirs(self.backup_dir, exist_ok=True)
+        name = f"bookings-{datetime.now().strftime('%Y%m%d-%H%M%S')}.db"
+        path = os.path.join(self.backup_dir, name)
+
+        started = time.monotonic()
+        loop = asyncio.get_running_loop()
+        steps, lock_time, longest_step = await loop.run_in_executor(None, self._backup, path)
+
+        backups = sorted(f for f in os.listdir(self.backup_dir) if f.startswith("bookings-") and f.endswith(".db"))
+        for old in backups[:-config.BACKUP_KEEP]:
+            os.remove(os.path.join(self.backup_dir, old))
+
+        return {'job': 'backup', 'duration': time.monotonic() - started, 'lock_time': lock_time,
+                'longest_lock': longest_step, 'steps': steps, 'path': path,
+                'size': os.path.getsize(path)}
+
+    async def retention(self, days=config.RETENTION_DAYS):
+        """Удаляет брошенные неоплаченные брони и зависшие платежи старше days дней"""
+        cutoff = (datetime.utcnow() - timedelta(days=days)).strftime("%Y-%m-%d %H:%M:%S")
+        started = time.monotonic()
+        bookings, payments, lock_time = await self.db.run_on_writer(Database.purge_abandoned, cutoff)
+        return {'job': 'retention', 'duration': time.monotonic() - started, 'lock_time': lock_time,
+                'bookings_deleted': bookings, 'payments_deleted': payments}
+
+    async def vacuum(self):
+        """Возвращает свободные страницы шагами incremental_vacuum и обновляет статистику"""
+        started = time.monotonic()
+        lock_time = longest = 0.0
+        # Полный VACUUM для перевода базы остановил бы все записи на время
+        # перезаписи файла, поэтому здесь не делается (см. convert)
+        incremental = await self.db.run_on_writer(Database.incremental_vacuum_enabled)
+        if not incremental:
+            logger.warning("База не переведена в auto_vacuum=INCREMENTAL, место не возвращается: "
+                           "остановите бота и выполните python maintenance.py convert")
+
+        freed = 0
+        while incremental:
+            pages, remaining, step = await self.db.run_on_writer(Database.incremental_vacuum)
+            freed += pages
+            lock_time += step
+            longest = max(longest, step)
+            if not pages or not remaining:
+                break
+            await asyncio.sleep(config.BACKUP_STEP_PAUSE)
+
+        step = await self.db.run_on_writer(Database.analyze)
+        return {'job': 'vacuum', 'duration': time.monotonic() - started, 'lock_time': lock_time + step,
+                'longest_lock': max(longest, step), 'pages_freed': freed, 'incremental': incremental}
+
+    async def expire(self):
+        """Истекает неоплаченные брони пачками, пока они есть"""
+        expired = []
+        while True:
+            batch = await self.db.expire_bookings()
+            expired += batch
+            if len(batch) < config.RETENTION_BATCH:
+                break
+        if expired:
+            logger.info(f"Истек срок оплаты броней: {len(expired)}")
+        return expired
+
+    async def start_expiry_sweeper(self, interval=config.EXPIRY_SWEEP_INTERVAL):
+        """Периодически истекает неоплаченные брони"""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.expire()
+            except Exception as e:
+                logger.error(f"Ошибка истечения неоплаченных броней: {e}")
+
+    async def run(self):
+        """Выполняет все задачи обслуживания по очереди и возвращает отчеты"""
+        reports = []
+        for job in (self.retention, self.vacuum, self.backup):
+            try:
+                report = await job()
+            except Exception as e:
+                logger.error(f"Ошибка обслуживания базы ({job.__name__}): {e}")
+                continue
+            logger.info(f"Обслуживание базы: {report}")
+            reports.append(report)
+        self.last_reports = reports
+        return reports
+
+    async def start_scheduler(self, interval=config.MAINTENANCE_INTERVAL):
+        """Периодически запускает обслуживание базы"""
+        while True:
+            await asyncio.sleep(interval)
+            await self.run()
+
+
+def convert(path=config.DB_PATH):
+    """Разово переводит базу в auto_vacuum=INCREMENTAL (только при остановленном боте)"""
+    size = os.path.getsize(path)
+    db = Database(path)
+    try:
+        logger.info(f"Перевод базы {path} ({size / 1024 / 1024:.1f} МБ) в auto_vacuum=INCREMENTAL")
+        lock_time = db.enable_incremental_vacuum()
+    finally:
+        db.conn.close()
+    if lock_time is None:
+        logger.info("База уже переведена")
+    else:
+        logger.info(f"База переведена за {lock_time:.1f} с, размер {os.path.getsize(path) / 1024 / 1024:.1f} МБ")
+
+
+if __name__ == "__main__":
+    # python maintenance.py convert [путь] - перевод существующей базы, пока бот остановлен
+    import sys
+
+    logging.basicConfig(level=logging.INFO)
+    if len(sys.argv) < 2 or sys.argv[1] != "convert":
+        print("Использование: python maintenance.py convert [путь к базе]")
+        sys.exit(2)
+    convert(*sys.argv[2:3])
@@ -0,0 +1,91 @@
+import asyncio
+import logging
+import time
+from datetime import datetime, timedelta
+import config
+from yookassa_client import YooKassaError
+
+logger = logging.getLogger(__name__)
+
+
+def poll_interval(age):
+    """Интервал проверки платежа возрастом age секунд"""
+    for max_age, interval in config.PAYMENT_POLL_INTERVALS:
+        if age < max_age:
+            return interval
+    return config.PAYMENT_POLL_MAX_INTERVAL
+
+
+class PaymentPoller:
+    """Фоновая проверка платежей, которые ждут оплаты.
+
+    Подстраховывает вебхук: раз в tick секунд берет из базы не больше batch
+    платежей, у которых подошел next_check_at, и спрашивает их статус у
+    ЮKassa (не больше concurrency запросов сразу). Свежие платежи
+    проверяются часто, старые - все реже (PAYMENT_POLL_INTERVALS), поэтому
+    число запросов к API ограничено batch за цикл и не растет вместе с
+    очередью. Результаты цикла записываются одной транзакцией; для каждого
+    подтвержденного платежа вызывается on_confirmed(payment).
+    """
+
+    def __init__(self, db, client, on_confirmed, batch=config.PAYMENT_POLL_BATCH,
+                 concurrency=config.PAYMENT_POLL_CONCURRENCY):
+        self.db = db
+        self.client = client
+        self.on_confirmed = on_confirmed
+        self.batch = batch
+        self._semaphore = asyncio.Semaphore(concurrency)
+
+    async def _fetch_status(self, payment_id):
+        async with self._semaphore:
+            try:
+                payment = await self.client.get_payment(payment_id)
+            except YooKassaError as e:
+                logger.warning(f"Не удалось проверить платеж {payment_id}: {e}")
+                return None
+            except Exception as e:
+                logger.error(f"Ошибка запроса статуса платежа {payment_id}: {e!r}")
+                return None
+        return payment["status"]
+
+    async def poll(self):
+        """Один цикл проверки; возвращает отчет"""
+        started = time.monotonic()
+        payments = await self.db.get_due_payments(self.batch)
+        if not payments:
+            return {'checked': 0, 'confirmed': 0, 'canceled': 0, 'duration': 0.0}
+
+        statuses = await asyncio.gather(*(self._fetch_status(payment.payment_id) for payment in payments))
+
+        now = datetime.utcnow()
+        updates, reschedule = [], []
+        for payment, status in zip(payments, statuses):
+            if status in ("succeeded", "canceled"):
+                updates.append((payment.payment_id, status))
+            else:
+                # Ошибка API тоже откладывает проверку, чтобы не долбить ЮKassa
+                age = (now - payment.created_at).total_seconds() if payment.created_at else 0
+                next_check_at = now + timedelta(seconds=poll_interval(age))
+                reschedule.append((payment.payment_id, next_check_at.strftime("%Y-%m-%d %H:%M:%S")))
+
+        changed = await self.db.apply_payment_statuses(updates, reschedule)
+
+        confirmed = [payment for payment in changed if payment.status == "succeeded"]
+        for payment in confirmed:
+            logger.info(f"Платеж {payment.payment_id} подтвержден фоновой проверкой")
+            try:
+                await self.on_confirmed(payment)
+            except Exception as e:
+                logger.error(f"Ошибка подтверждения платежа {payment.payment_id}: {e}")
+
+        return {'checked': len(payments), 'confirmed': len(confirmed),
+                'canceled': len(changed) - len(confirmed), 'duration': time.monotonic() - started}
+
+    async def start_scheduler(self, tick=config.PAYMENT_POLL_TICK):
+        """Периодически проверяет ожидающие платежи"""
+        while True:
+            await asyncio.sleep(tick)
+            try:
+                await self.poll()
+            except Exception as e:
+                logger.error(f"Ошибка фоновой проверки платежей: {e}")
@@ -1,23 +1,48 @@
+import asyncio
 import uuid
-from yookassa import Payment, Configuration
 import config
 import logging
-from database import Database
+from database import db
+from yookassa_client import YooKassaClient, refund_state
 
 logger = logging.getLogger(__name__)
-db = Database()
 
-# Настройка ЮKassa
-Configuration.account_id = config.YKASSA_SHOP_ID
-Configuration.secret_key = config.YKASSA_SECRET_KEY
+# Общий клиент ЮKassa: одна сессия с пулом соединений на весь бот
+yookassa = YooKassaClient(config.YKASSA_SHOP_ID, config.YKASSA_SECRET_KEY)
 
 
 class PaymentManager:
-    @staticmethod
-    async def create_payment(amount, description, user_id, booking_date=None, is_final=False):
-        """Создает платеж в ЮKassa"""
+    """Платежи ЮKassa.
+
+    Повторное нажатие «Оплатить» не создает новый платеж: пока неоплаченный
+    платеж той же брони не истек (PAYMENT_REUSE_TTL), клиенту отдается его
+    ссылка из таблицы payments без запроса к ЮKassa. Одновременные нажатия
+    ждут одно и то же создание платежа, а ключ идемпотентности выводится из
+    брони, поэтому повтор после сбоя сети вернет уже созданный платеж.
+    """
+
+    def __init__(self):
+        self._creating = {}  # (user_id, booking_date, payment_type) -> задача создания платежа
+
+    async def create_payment(self, amount, description, user_id, booking_date=None, is_final=False):
+        """Создает платеж в ЮKassa или возвращает еще не оплаченный"""
+        payment_type = "final" if is_final else "deposit"
+        key = (user_id, str(booking_date or ""), payment_type)
+
+        task = self._creating.get(key)
+        if task is None:
+            task = asyncio.create_task(self._get_or_create(amount, description, user_id, booking_date, payment_type))
+            self._creating[key] = task
+            task.add_done_callback(lambda _: self._creating.pop(key, None))
+        return await asyncio.shield(task)
+
+    async def _get_or_create(self, amount, description, user_id, booking_date, payment_type):
         try:
-            idempotence_key = str(uuid.uuid4())
+            pending = await db.get_reusable_payment(user_id, booking_date, payment_type)
+            if pending:
+                logger.info(f"Повторно выдан платеж {pending.payment_id} для пользователя {user_id}")
+                return {"id": pending.payment_id, "status": pending.status,
+                        "confirmation": {"type": "redirect", "confirmation_url": pending.confirmation_url}}
 
             payment_data = {
                 "amount": {
@@ -32,32 +57,40 @@ class PaymentManager:
                 "description": description,
                 "metadata": {
                     "user_id": user_id,
-                    "booking_date": booking_date or "",
-                    "is_final": str(is_final)
+                    "booking_date": str(booking_date or ""),
+                    "is_final": str(payment_type == "final")
                 }
             }
 
-            payment = Payment.create(payment_data, idempotence_key)
+            # Номер попытки растет с каждым сохраненным платежом брони и не
+            # уменьшается: повтор того же запроса получит тот же ключ, новый
+            # платеж - новый
+            attempt = await db.get_payment_attempt(user_id, booking_date, payment_type)
+            for _ in range(3):
+                idempotence_key = str(uuid.uuid5(uuid.NAMESPACE_URL,
+                                                 f"ivybot:{user_id}:{booking_date}:{payment_type}:{attempt}"))
+                payment = await yookassa.create_payment(payment_data, idempotence_key)
+                if payment["status"] == "pending":
+                    break
+                # Ключ уже использован платежом, который отменен или оплачен
+                await db.skip_payment_attempt(user_id, booking_date, payment_type, attempt)
+                attempt += 1
+            else:
+                logger.error(f"Не удалось получить новый платеж для пользователя {user_id}")
+                return None
 
             # Сохраняем в базу
-            if booking_date and not is_final:
-                db.save_payment_info(
-                    user_id=user_id,
-                    payment_id=payment.id,
-                    amount=amount,
-                    booking_date=booking_date,
-                    payment_type="deposit"
-                )
-            elif is_final:
-                db.save_payment_info(
-                    user_id=user_id,
-                    payment_id=payment.id,
-                    amount=amount,
-                    booking_date=booking_date,
-                    payment_type="final"
-                )
-
-            logger.info(f"Создан платеж {payment.id} для пользователя {user_id}")
+            await db.save_payment_info(
+                user_id=user_id,
+                payment_id=payment["id"],
+                amount=amount,
+                booking_date=booking_date,
+                payment_type=payment_type,
+                confirmation_url=payment["confirmation"]["confirmation_url"],
+                attempt=attempt
+            )
+
+            logger.info(f"Создан платеж {payment['id']} для пользователя {user_id}")
             return payment
 
         except Exception as e:
@@ -68,33 +101,51 @@ class PaymentManager:
     async def check_payment_status(payment_id):
         """Проверяет статус платежа"""
         try:
-            payment = Payment.find_one(payment_id)
-            return payment.status
+            payment = await yookassa.get_payment(payment_id)
+            return payment["status"]
         except Exception as e:
             logger.error(f"Ошибка проверки статуса платежа: {e}")
             return None
 
     @staticmethod
     async def process_refund(payment_id, amount=None):
-        """Обрабатывает возврат средств"""
+        """Обрабатывает возврат средств (без amount - всей еще не возвращенной суммы).
+
+        Статус платежа берется из ЮKassa после возврата: возвращенным он
+        становится, только когда вернули всю сумму, при частичном возврате
+        остается оплаченным с суммой возвратов (см. Database.record_refund).
+        """
         try:
-            from yookassa import Refund
+            if amount is None:
+                payment = await yookassa.get_payment(payment_id)
+                total, refunded, _ = refund_state(payment)
+                amount = total - refunded
 
             refund_data = {
                 "payment_id": payment_id,
                 "amount": {
-                    "value": f"{amount:.2f}" if amount else None,
+                    "value": f"{amount:.2f}",
                     "currency": "RUB"
                 }
             }
 
-            refund = Refund.create(refund_data, str(uuid.uuid4()))
+            refund = await yookassa.create_refund(refund_data, str(uuid.uuid4()))
 
-            if refund.status == 'succeeded':
-                db.update_payment_status(payment_id, 'refunded')
-                logger.info(f"Возврат успешен: {refund.id}")
+            if refund["status"] == 'succeeded':
+                payment = await yookassa.get_payment(payment_id)
+                total, refunded, full = refund_state(payment)
+                await db.record_refund(payment_id, refunded, full)
+                logger.info(f"Возврат успешен: {refund['id']}, возвращено {refunded:.2f} из {total:.2f} ₽")
                 return True
 
+            logger.info(f"Возврат {refund['id']} в статусе {refund['status']}")
+            return False
+
         except Exception as e:
             logger.error(f"Ошибка возврата: {e}")
             return False
+
+    @staticmethod
+    async def close():
+        """Закрывает сессию клиента ЮKassa"""
+        await yookassa.close()
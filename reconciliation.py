@@ -0,0 +1,193 @@
+import asyncio
+import logging
+import time
+from datetime import datetime, timedelta
+import config
+from webhooks import restore_payment
+from yookassa_client import YooKassaError, refund_state
+
+logger = logging.getLogger(__name__)
+
+
+def _api_time(moment):
+    return moment.strftime("%Y-%m-%dT%H:%M:%S.") + f"{moment.microsecond // 1000:03d}Z"
+
+
+class Reconciler:
+    """Сверка таблицы payments со списками платежей и возвратов ЮKassa.
+
+    Платежи и возвраты за окно в days дней обходятся по курсору страницами
+    по page_size объектов; каждая страница сверяется с базой одним запросом
+    и исправляется одной транзакцией, поэтому память не зависит от числа
+    платежей. Исправляется то, что однозначно следует из ЮKassa: оплаченные
+    и отмененные платежи, которые у нас еще ждут оплаты, потерянные записи
+    об оплаченных платежах и суммы возвратов (см. Database.record_refund):
+    полностью возвращенный платеж становится возвращенным, частично
+    возвращенный остается оплаченным и перечисляется в отчете отдельно.
+    Остальные расхождения (сумма, оплаченный у нас, но не в ЮKassa платеж)
+    попадают в отчет админу.
+    """
+
+    def __init__(self, db, client, on_confirmed=None, page_size=config.RECONCILE_PAGE_SIZE,
+                 report_limit=config.RECONCILE_REPORT_LIMIT):
+        self.db = db
+        self.client = client
+        self.on_confirmed = on_confirmed
+        self.page_size = page_size
+        self.report_limit = report_limit
+
+    def _note(self, report, text):
+        report['mismatches'] += 1
+        if len(report['examples']) < self.report_limit:
+            report['examples'].append(text)
+
+    def _note_partial(self, report, payment_id, refunded, amount):
+        # Частичный возврат - не расхождение: платеж остается оплаченным
+        report['partial_refunds'] += 1
+        if len(report['partial_examples']) < self.report_limit:
+            report['partial_examples'].append(f"{payment_id}: возвращено {refunded:.2f} из {amount:.2f} ₽")
+
+    async def _apply(self, report, updates, refunds):
+        changed = await self.db.apply_payment_statuses(updates, [], refunds)
+        report['corrected'] += len(changed)
+        for payment in changed:
+            logger.info(f"Сверка: платеж {payment.payment_id} -> {payment.status}")
+            if payment.status == "succeeded" and self.on_confirmed:
+                try:
+                    await self.on_confirmed(payment)
+                except Exception as e:
+                    logger.error(f"Ошибка подтверждения платежа {payment.payment_id}: {e}")
+
+    async def _reconcile_payments(self, report, items):
+        report['payments_checked'] += len(items)
+        local = {payment.payment_id: payment
+                 for payment in await self.db.get_payments_by_ids([item["id"] for item in items])}
+
+        updates, refunds = [], []
+        for item in items:
+            payment_id, status = item["id"], item["status"]
+            amount, refunded, full_refund = refund_state(item)
+            # Возвращенный платеж ЮKassa отдает как succeeded с refunded_amount
+            target = "refunded" if status == "succeeded" and full_refund else status
+            if status == "succeeded" and refunded and not full_refund:
+                self._note_partial(report, payment_id, refunded, amount)
+
+            payment = local.get(payment_id)
+            if payment is None:
+                # Неоплаченные платежи без записи нам не нужны
+                if status == "succeeded":
+                    if await restore_payment(self.db, item):
+                        report['restored'] += 1
+                        updates.append((payment_id, target))
+                        if refunded:
+                            refunds.append((payment_id, refunded, full_refund))
+                    else:
+                        self._note(report, f"{payment_id}: оплачен в ЮKassa, но не найден в базе")
+                continue
+
+            if payment.amount is not None and abs(payment.amount - amount) >= 0.01:
+                self._note(report, f"{payment_id}: сумма {payment.amount:.2f} ₽ в базе, {amount:.2f} ₽ в ЮKassa")
+            if status == "succeeded" and refunded - (payment.refunded_amount or 0) >= 0.01:
+                refunds.append((payment_id, refunded, full_refund))
+
+            if payment.status == target:
+                continue
+            if payment.status == "refunded":
+                self._note(report, f"{payment_id}: возвращен в базе, в ЮKassa возвращено {refunded:.2f} "
+                                   f"из {amount:.2f} ₽")
+            elif target in ("succeeded", "refunded") or (target == "canceled" and payment.status == "pending"):
+                updates.append((payment_id, target))
+            else:
+                self._note(report, f"{payment_id}: статус {payment.status} в базе, {status} в ЮKassa")
+
+        await self._apply(report, updates, refunds)
+
+    async def _reconcile_refunds(self, report, items, window):
+        report['refunds_checked'] += len(items)
+        refunded = {item["payment_id"] for item in items if item["status"] == "succeeded"}
+        local = {payment.payment_id: payment for payment in await self.db.get_payments_by_ids(list(refunded))}
+
+        refunds = []
+        for payment_id in refunded:
+            payment = local.get(payment_id)
+            if payment is None:
+                self._note(report, f"{payment_id}: возврат в ЮKassa по платежу, которого нет в базе")
+                continue
+            if payment.status == "refunded":
+                continue
+
+            # Полный ли возврат, видно только по платежу (возвратов может быть несколько)
+            try:
+                item = await self.client.get_payment(payment_id)
+            except YooKassaError as e:
+                self._note(report, f"{payment_id}: не удалось проверить возврат ({e})")
+                continue
+            if window[0] <= item.get("created_at", "") < window[1]:
+                continue  # платеж из окна уже сверен по списку платежей
+            amount, refunded_amount, full_refund = refund_state(item)
+            if refunded_amount and not full_refund:
+                self._note_partial(report, payment_id, refunded_amount, amount)
+            if refunded_amount - (payment.refunded_amount or 0) >= 0.01:
+                refunds.append((payment_id, refunded_amount, full_refund))
+
+        await self._apply(report, [], refunds)
+
+    async def run(self, days=config.RECONCILE_WINDOW_DAYS, until=None):
+        """Сверяет платежи и возвраты, созданные за days дней до until (UTC); возвращает отчет"""
+        started = time.monotonic()
+        until = until or datetime.utcnow()
+        since = until - timedelta(days=days)
+        params = {"created_at.gte": _api_time(since), "created_at.lt": _api_time(until)}
+        report = {'since': since, 'until': until, 'payments_checked': 0, 'refunds_checked': 0,
+                  'corrected': 0, 'restored': 0, 'mismatches': 0, 'examples': [],
+                  'partial_refunds': 0, 'partial_examples': []}
+
+        # Сначала платежи: возврат может относиться к платежу, который сверка только что восстановила
+        async for items in self.client.iter_pages("payments", params, self.page_size):
+            await self._reconcile_payments(report, items)
+        async for items in self.client.iter_pages("refunds", params, self.page_size):
+            await self._reconcile_refunds(report, items, (params["created_at.gte"], params["created_at.lt"]))
+
+        report['duration'] = time.monotonic() - started
+        logger.info(f"Сверка платежей: проверено {report['payments_checked']} платежей и "
+                    f"{report['refunds_checked']} возвратов, исправлено {report['corrected']}, "
+                    f"расхождений {report['mismatches']}")
+        return report
+
+    async def start_scheduler(self, on_report=None):
+        """Каждую ночь в RECONCILE_HOUR сверяет платежи и передает отчет в on_report"""
+        while True:
+            now = datetime.now()
+            next_run = now.replace(hour=config.RECONCILE_HOUR, minute=0, second=0, microsecond=0)
+            if next_run <= now:
+                next_run += timedelta(days=1)
+            await asyncio.sleep((next_run - now).total_seconds())
+
+            try:
+                report = await self.run()
+                if on_report:
+                    await on_report(report)
+            except Exception as e:
+                logger.error(f"Ошибка сверки платежей: {e}")
+
+
+def format_report(report):
+    """Текст отчета о сверке для админа"""
+    lines = [
+        f"🧾 <b>Сверка платежей с ЮKassa</b>\n",
+        f"Период: {report['since']:%d.%m %H:%M} – {report['until']:%d.%m %H:%M} (UTC)",
+        f"Платежей проверено: {report['payments_checked']}",
+        f"Возвратов проверено: {report['refunds_checked']}",
+        f"Исправлено статусов: {report['corrected']}",
+        f"Восстановлено записей: {report['restored']}",
+        f"Расхождений для проверки: {report['mismatches']}",
+        f"Частичных возвратов: {report['partial_refunds']}",
+    ]
+    for title, count, examples in (("Расхождения", report['mismatches'], report['examples']),
+                                   ("Частичные возвраты", report['partial_refunds'], report['partial_examples'])):
+        if examples:
+            lines.append(f"\n<b>{title}:</b>")
+            lines += [f"• {text}" for text in examples]
+            if count > len(examples):
+                lines.append(f"… и еще {count - len(examples)}")
+    return "\n".join(lines)
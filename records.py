@@ -0,0 +1,89 @@
+from datetime import date, datetime
+
+
+def _to_bool(value):
+    return None if value is None else bool(value)
+
+
+def _to_date(value):
+    return date.fromisoformat(value) if value else None
+
+
+def _to_datetime(value):
+    return datetime.fromisoformat(value) if value else None
+
+
+class Record:
+    """Строка таблицы с именованными полями.
+
+    Значения приводятся к типам Python один раз при чтении (см. row_factory),
+    поля, которых нет в SELECT, остаются None. Объекты не держат ссылок на
+    соединение, поэтому их можно кэшировать и передавать между потоками.
+    """
+
+    __slots__ = ()
+    _converters = {}
+
+    def __init__(self, **fields):
+        for name in self.__slots__:
+            setattr(self, name, fields.get(name))
+
+    @classmethod
+    def row_factory(cls, cursor, row):
+        """row_factory для sqlite3: колонки сопоставляются по именам"""
+        record = cls.__new__(cls)
+        for name in cls.__slots__:
+            setattr(record, name, None)
+        converters = cls._converters
+        for column, value in zip(cursor.description, row):
+            name = column[0]
+            convert = converters.get(name)
+            setattr(record, name, convert(value) if convert else value)
+        return record
+
+    def __eq__(self, other):
+        return type(self) is type(other) and all(
+            getattr(self, name) == getattr(other, name) for name in self.__slots__)
+
+    def __repr__(self):
+        fields = ", ".join(f"{name}={getattr(self, name)!r}" for name in self.__slots__)
+        return f"{type(self).__name__}({fields})"
+
+
+class Booking(Record):
+    """Строка таблицы bookings"""
+
+    __slots__ = ('id', 'user_id', 'username', 'full_name', 'booking_date', 'status', 'deposit_paid',
+                 'final_paid', 'brief_completed', 'payment_id', 'created_at', 'updated_at', 'expires_at')
+    _converters = {
+        'booking_date': _to_date,
+        'deposit_paid': _to_bool,
+        'final_paid': _to_bool,
+        'brief_completed': _to_bool,
+        'created_at': _to_datetime,
+        'updated_at': _to_datetime,
+        'expires_at': _to_datetime,
+    }
+
+
+class PaymentRecord(Record):
+    """Строка таблицы payments"""
+
+    __slots__ = ('id', 'user_id', 'payment_id', 'amount', 'payment_type', 'status', 'booking_date',
+                 'created_at', 'next_check_at', 'confirmation_url', 'expires_at', 'refunded_amount')
+    _converters = {
+        'booking_date': _to_date,
+        'created_at': _to_datetime,
+        'next_check_at': _to_datetime,
+        'expires_at': _to_datetime,
+    }
+
+
+class SupportChat(Record):
+    """Строка таблицы support_chats"""
+
+    __slots__ = ('id', 'user_id', 'username', 'full_name', 'active', 'created_at')
+    _converters = {
+        'active': _to_bool,
+        'created_at': _to_datetime,
+    }
@@ -1,11 +1,10 @@
 import asyncio
 from datetime import datetime, timedelta
 import logging
-from database import Database
+from database import db
 import config
 
 logger = logging.getLogger(__name__)
-db = Database()
 
 
 class ReminderSystem:
@@ -16,12 +15,12 @@ class ReminderSystem:
         """Отправляет напоминания о бронированиях"""
         try:
             # Используем локальную базу данных вместо Google Sheets для напоминаний
-            today_bookings = db.get_today_bookings()
+            today_bookings = await db.get_today_bookings()
 
             for booking in today_bookings:
-                user_id = booking[1]  # user_id field from database
-                booking_date = booking[4]  # booking_date field
-                final_paid = booking[7]  # final_paid field
+                user_id = booking.user_id
+                booking_date = booking.booking_date
+                final_paid = booking.final_paid
 
                 try:
                     # Если финальная оплата еще не произведена
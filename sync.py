@@ -0,0 +1,195 @@
+import asyncio
+import hashlib
+from datetime import datetime
+import logging
+import config
+import events
+
+logger = logging.getLogger(__name__)
+
+# Колонки таблицы, которые участвуют в синхронизации
+BRIEF_STATUS_COL = 6
+PAYMENT_STATUS_COL = 7
+BRIEF_FILLED_COL = 11
+
+# Статус оплаты в таблице -> (deposit_paid, final_paid, completed)
+PAYMENT_STATUSES = {
+    "Предоплата ожидается": (False, False, False),
+    "Предоплата получена": (True, False, False),
+    "Полная оплата": (True, True, False),
+    "Проект завершен": (True, True, True),
+}
+
+
+def normalize_state(deposit_paid, final_paid, completed, brief_completed):
+    """Приводит состояние брони к каноническому виду"""
+    if completed:
+        # Завершенный проект всегда оплачен и с заполненным брифом
+        return True, True, True, True
+    return bool(deposit_paid), bool(final_paid), False, bool(brief_completed)
+
+
+def state_to_sheet(state):
+    """Состояние брони -> (статус брифа, статус оплаты, заполнен бриф)"""
+    deposit_paid, final_paid, completed, brief_completed = state
+    if completed:
+        return "Проект завершен", "Проект завершен", "Да"
+
+    if final_paid:
+        payment_status = "Полная оплата"
+    elif deposit_paid:
+        payment_status = "Предоплата получена"
+    else:
+        payment_status = "Предоплата ожидается"
+
+    brief_status = "Бриф заполнен" if brief_completed else "Ожидает заполнения брифа"
+    return brief_status, payment_status, "Да" if brief_completed else "Нет"
+
+
+def sheet_to_state(brief_status, payment_status, brief_filled):
+    """Значения таблицы -> состояние брони (None если статус оплаты неизвестен)"""
+    payment = PAYMENT_STATUSES.get(payment_status.strip())
+    if payment is None:
+        return None
+    return normalize_state(*payment, brief_filled.strip() == "Да")
+
+
+def state_marker(state):
+    """Компактная метка состояния на стороне базы"""
+    return "".join("1" if value else "0" for value in state)
+
+
+def row_hash(brief_status, payment_status, brief_filled):
+    """Хэш значимых ячеек строки на стороне таблицы"""
+    raw = "\x1f".join((brief_status, payment_status, brief_filled))
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()[:16]
+
+
+class SheetsSync:
+    """Инкрементальная двусторонняя синхронизация bookings <-> Google Sheets.
+
+    Изменения в базе находятся по колонке updated_at, изменения в таблице - по
+    хэшу строки. Записываются только разошедшиеся брони: в таблицу одним
+    batch_update и одним append_rows, в базу - одной транзакцией. При конфликте
+    побеждает база, так как она источник правды по оплатам.
+    """
+
+    def __init__(self, db, gsheets):
+        self.db = db
+        self.gsheets = gsheets
+        self.last_report = None
+        self._lock = asyncio.Lock()
+
+    async def run(self):
+        """Выполняет один прогон синхронизации и возвращает отчет"""
+        if not self.gsheets or not self.gsheets.is_connected():
+            return None
+
+        async with self._lock:
+            return await self._run()
+
+    async def _run(self):
+        started_at = await self.db.get_db_time()
+        stored, watermark = await self.db.get_sync_state()
+        db_changed = set(await self.db.get_changed_booking_keys(watermark))
+
+        snapshot = await self.gsheets.get_sync_snapshot()
+        if snapshot is None:
+            logger.warning("Синхронизация пропущена: не удалось прочитать Google Sheets")
+            return None
+
+        sheet_rows = {}
+        sheet_changed = set()
+        for row_index, user_id, date_str, username, full_name, *cells in snapshot:
+            try:
+                booking_date = datetime.strptime(date_str, "%d.%m.%Y").strftime("%Y-%m-%d")
+            except ValueError:
+                continue
+            key = (user_id, booking_date)
+            if not user_id or key in sheet_rows:
+                continue  # как и индекс строк, учитываем первую строку брони
+
+            sheet_rows[key] = (row_index, username, full_name, cells)
+            if stored.get(key, (None, None))[1] != row_hash(*cells):
+                sheet_changed.add(key)
+
+        report = {'checked': len(db_changed | sheet_changed), 'db_to_sheet': 0, 'sheet_to_db': 0,
+                  'appended': 0, 'inserted': 0, 'conflicts': 0}
+        cells_to_write, rows_to_append = [], []
+        updates, inserts = [], []
+        new_state = {}
+
+        for key in db_changed | sheet_changed:
+            user_id, booking_date = key
+            db_state = await self.db.get_booking_state(int(user_id) if user_id.isdigit() else user_id, booking_date)
+            if db_state is not None:
+                db_state = normalize_state(*db_state)
+            sheet = sheet_rows.get(key)
+
+            if sheet is None:
+                # Бронь есть только в базе - добавляем в таблицу оплаченные
+                # (завершенные проекты могли быть перенесены в архив)
+                if db_state is not None and db_state[0] and not db_state[2]:
+                    target = state_to_sheet(db_state)
+                    user_data = {'user_id': user_id}
+                    date_str = datetime.strptime(booking_date, "%Y-%m-%d").strftime("%d.%m.%Y")
+                    rows_to_append.append((user_data, date_str, target))
+                    report['appended'] += 1
+                    new_state[key] = (state_marker(db_state), row_hash(*target))
+                continue
+
+            row_index, username, full_name, cells = sheet
+            sheet_state = sheet_to_state(*cells)
+
+            if db_state is None:
+                # Бронь добавлена в таблицу вручную
+                if sheet_state is not None and sheet_state[0]:
+                    inserts.append((user_id, username, full_name, booking_date, *sheet_state))
+                    report['inserted'] += 1
+                new_state[key] = (state_marker(sheet_state or ()), row_hash(*cells))
+                continue
+
+            if sheet_state is None or sheet_state == db_state:
+                new_state[key] = (state_marker(db_state), row_hash(*cells))
+                continue
+
+            if key in db_changed:
+                if key in sheet_changed:
+                    report['conflicts'] += 1
+                target = state_to_sheet(db_state)
+                for col, old_value, value in zip((BRIEF_STATUS_COL, PAYMENT_STATUS_COL, BRIEF_FILLED_COL),
+                                                 cells, target):
+                    if old_value != value:
+                        cells_to_write.append((row_index, col, value))
+                report['db_to_sheet'] += 1
+                new_state[key] = (state_marker(db_state), row_hash(*target))
+            else:
+                updates.append((user_id, booking_date, *sheet_state))
+                report['sheet_to_db'] += 1
+                new_state[key] = (state_marker(sheet_state), row_hash(*cells))
+
+        if cells_to_write or rows_to_append:
+            if not await self.gsheets.apply_sync(cells_to_write, rows_to_append):
+                logger.error("Синхронизация прервана: не удалось записать изменения в Google Sheets")
+                return None
+
+        if updates or inserts:
+            await self.db.apply_synced_bookings(updates, inserts)
+            await events.emit(events.BOOKINGS_SYNCED, updated=len(updates), inserted=len(inserts))
+
+        await self.db.save_sync_state(new_state, started_at)
+
+        report['drifted'] = (report['db_to_sheet'] + report['sheet_to_db'] +
+                             report['appended'] + report['inserted'])
+        self.last_report = report
+        logger.info(f"Синхронизация с Google Sheets: {report}")
+        return report
+
+    async def start_scheduler(self, interval=config.SHEETS_SYNC_INTERVAL):
+        """Периодически запускает синхронизацию"""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.run()
+            except Exception as e:
+                logger.error(f"Ошибка синхронизации с Google Sheets: {e}")
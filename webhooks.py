@@ -0,0 +1,157 @@
+import asyncio
+import ipaddress
+import logging
+from aiohttp import web
+import config
+from yookassa_client import YooKassaError, refund_state
+
+logger = logging.getLogger(__name__)
+
+
+async def restore_payment(db, payment):
+    """Сохраняет платеж из ответа API по его metadata; возвращает False, если metadata нет.
+
+    Запись о платеже могла быть удалена очисткой, пока клиент платил.
+    """
+    metadata = payment.get("metadata") or {}
+    if not metadata.get("user_id"):
+        logger.warning(f"Платеж {payment['id']} без metadata.user_id, пропускаем")
+        return False
+    payment_type = "final" if metadata.get("is_final") == "True" else "deposit"
+    await db.save_payment_info(int(metadata["user_id"]), payment["id"], float(payment["amount"]["value"]),
+                               metadata.get("booking_date") or None, payment_type)
+    return True
+
+
+class YooKassaWebhook:
+    """Прием HTTP-уведомлений ЮKassa о платежах и возвратах.
+
+    Тело уведомления считается только подсказкой: запрос принимается лишь с
+    адресов ЮKassa, а статус платежа всегда перечитывается из API. Статус в
+    базе меняет update_payment_status, который срабатывает один раз на
+    переход, поэтому повторные уведомления ничего не пишут. При переходе в
+    succeeded вызывается on_confirmed(payment) - то же подтверждение, что и
+    по кнопке «Я оплатил». Одновременные уведомления об одном платеже
+    обрабатываются одной задачей, обращения к API ограничены семафором.
+    """
+
+    def __init__(self, db, client, on_confirmed, trusted_networks=config.WEBHOOK_TRUSTED_NETWORKS,
+                 trusted_proxies=config.WEBHOOK_TRUSTED_PROXIES, concurrency=config.WEBHOOK_CONCURRENCY):
+        self.db = db
+        self.client = client
+        self.on_confirmed = on_confirmed
+        self.trusted_networks = [ipaddress.ip_network(network) for network in trusted_networks]
+        self.trusted_proxies = [ipaddress.ip_network(network) for network in trusted_proxies]
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._in_flight = {}
+        self._runner = None
+
+        self.app = web.Application()
+        self.app.router.add_post(config.WEBHOOK_PATH, self.handle)
+
+    @staticmethod
+    def _in(remote, networks):
+        try:
+            address = ipaddress.ip_address(remote.strip())
+        except (AttributeError, ValueError):
+            return False
+        return any(address in network for network in networks)
+
+    def _client_address(self, request):
+        # За обратным прокси request.remote - адрес прокси; настоящий адрес
+        # отправителя - последний в X-Forwarded-For, добавленный не нашим прокси
+        remote = request.remote
+        if not self._in(remote, self.trusted_proxies):
+            return remote
+        for forwarded in reversed(request.headers.getall("X-Forwarded-For", [])):
+            for address in reversed(forwarded.split(",")):
+                if not self._in(address, self.trusted_proxies):
+                    return address.strip()
+        return remote
+
+    async def handle(self, request):
+        remote = self._client_address(request)
+        if not self._in(remote, self.trusted_networks):
+            logger.warning(f"Уведомление ЮKassa с недоверенного адреса {remote} отклонено")
+            return web.Response(status=403)
+
+        try:
+            body = await request.json()
+            event, obj = body["event"], body["object"]
+            object_id = obj["id"]
+        except (ValueError, KeyError, TypeError):
+            return web.Response(status=400)
+
+        if event.startswith("payment."):
+            key, process = ("payment", object_id), self.process_payment
+        elif event == "refund.succeeded":
+            key, process = ("refund", object_id), self.process_refund
+        else:
+            return web.Response(status=200)
+
+        # Повторы одного уведомления ждут уже идущую обработку
+        task = self._in_flight.get(key)
+        if task is None:
+            task = asyncio.create_task(process(object_id))
+            self._in_flight[key] = task
+            task.add_done_callback(lambda _: self._in_flight.pop(key, None))
+
+        try:
+            await asyncio.shield(task)
+        except Exception as e:
+            logger.error(f"Ошибка обработки уведомления ЮKassa {event} {object_id}: {e}")
+            # Не 200: ЮKassa повторит уведомление позже
+            return web.Response(status=500)
+        return web.Response(status=200)
+
+    async def process_payment(self, payment_id):
+        """Сверяет платеж с API и применяет его статус; возвращает True при подтверждении"""
+        async with self._semaphore:
+            try:
+                payment = await self.client.get_payment(payment_id)
+            except YooKassaError as e:
+                if e.status == 404:
+                    logger.warning(f"Уведомление о неизвестном ЮKassa платеже {payment_id}")
+                    return False
+                raise
+
+        status = payment["status"]
+        if status not in ("succeeded", "canceled"):
+            return False
+
+        confirmed = await self.db.update_payment_status(payment_id, status)
+        if confirmed is None and not await self.db.get_payment_info(payment_id):
+            if await restore_payment(self.db, payment):
+                confirmed = await self.db.update_payment_status(payment_id, status)
+
+        if confirmed is not None and status == "succeeded":
+            logger.info(f"Платеж {payment_id} подтвержден уведомлением ЮKassa")
+            await self.on_confirmed(confirmed)
+            return True
+        return False
+
+    async def process_refund(self, refund_id):
+        """Записывает сумму возвратов по платежу после проверки возврата в API.
+
+        Возвращенным платеж становится, только когда refunded_amount платежа
+        в ЮKassa дошел до его суммы; частичный возврат оставляет его оплаченным.
+        """
+        async with self._semaphore:
+            refund = await self.client.get_refund(refund_id)
+            if refund["status"] != "succeeded":
+                return
+            payment = await self.client.get_payment(refund["payment_id"])
+
+        amount, refunded, full = refund_state(payment)
+        await self.db.record_refund(payment["id"], refunded, full)
+        logger.info(f"Возврат {refund_id} по платежу {payment['id']}: возвращено {refunded:.2f} из {amount:.2f} ₽")
+
+    async def start(self, host=config.WEBHOOK_HOST, port=config.WEBHOOK_PORT):
+        self._runner = web.AppRunner(self.app)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+        logger.info(f"Вебхук ЮKassa слушает {host}:{port}{config.WEBHOOK_PATH}")
+
+    async def stop(self):
+        if self._runner:
+            await self._runner.cleanup()
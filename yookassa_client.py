@@ -0,0 +1,123 @@
+import asyncio
+import json
+import logging
+import aiohttp
+import config
+
+logger = logging.getLogger(__name__)
+
+
+class YooKassaError(Exception):
+    """Ошибка API ЮKassa (status - HTTP-код, data - тело ответа)"""
+
+    def __init__(self, status, data):
+        self.status = status
+        self.data = data if isinstance(data, dict) else {}
+        super().__init__(f"HTTP {status}: {self.data.get('description') or data}")
+
+
+def refund_state(payment):
+    """Сумма платежа из ответа API, сумма возвратов по нему и возвращен ли он полностью.
+
+    Возвращенный платеж ЮKassa отдает как succeeded с refunded_amount;
+    полный возврат - только когда refunded_amount дошел до суммы платежа.
+    """
+    amount = float(payment["amount"]["value"])
+    refunded = float((payment.get("refunded_amount") or {}).get("value", 0))
+    return amount, refunded, refunded > 0 and refunded >= amount - 0.005
+
+
+class YooKassaClient:
+    """Асинхронный клиент API ЮKassa v3 на одной aiohttp-сессии.
+
+    Сессия создается при первом запросе и живет до close(): соединения
+    переиспользуются (keep-alive), поэтому TLS-рукопожатие не повторяется на
+    каждом платеже. У каждого запроса свой таймаут; сетевые ошибки и ответы
+    5xx повторяются с тем же Idempotence-Key, так что платеж не задвоится.
+    """
+
+    def __init__(self, shop_id, secret_key, base_url=config.YKASSA_API_URL, timeout=config.YKASSA_TIMEOUT,
+                 pool_size=config.YKASSA_POOL_SIZE, retries=config.YKASSA_RETRIES):
+        self.auth = aiohttp.BasicAuth(str(shop_id), secret_key)
+        self.base_url = base_url.rstrip("/")
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self.pool_size = pool_size
+        self.retries = retries
+        self._session = None
+
+    def _get_session(self):
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self.pool_size, keepalive_timeout=60, ttl_dns_cache=300)
+            self._session = aiohttp.ClientSession(auth=self.auth, timeout=self.timeout, connector=connector,
+                                                  raise_for_status=False)
+        return self._session
+
+    @staticmethod
+    async def _parse(response):
+        # Тело ошибки может быть не JSON (страница прокси, обрыв соединения)
+        text = await response.text()
+        try:
+            return json.loads(text)
+        except ValueError:
+            return text[:200] or None
+
+    async def _request(self, method, path, payload=None, params=None, idempotence_key=None, timeout=None):
+        headers = {"Idempotence-Key": idempotence_key} if idempotence_key else None
+        request_timeout = aiohttp.ClientTimeout(total=timeout) if timeout else None
+
+        for attempt in range(self.retries + 1):
+            try:
+                async with self._get_session().request(method, f"{self.base_url}/{path}", json=payload,
+                                                       params=params, headers=headers,
+                                                       timeout=request_timeout) as response:
+                    # 5xx повторяем не разбирая тело: прокси отдает на 502 HTML
+                    if response.status < 500 or attempt == self.retries:
+                        data = await self._parse(response)
+                        if response.status >= 400:
+                            raise YooKassaError(response.status, data)
+                        if not isinstance(data, dict):
+                            raise YooKassaError(response.status, "Ответ не в формате JSON")
+                        return data
+                    logger.warning(f"ЮKassa ответила {response.status} на {method} {path}, повтор")
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                if attempt == self.retries:
+                    raise
+                logger.warning(f"Ошибка соединения с ЮKassa ({method} {path}): {e!r}, повтор")
+            await asyncio.sleep(0.5 * 2 ** attempt)
+
+    async def create_payment(self, payload, idempotence_key):
+        return await self._request("POST", "payments", payload, idempotence_key=idempotence_key)
+
+    async def get_payment(self, payment_id):
+        return await self._request("GET", f"payments/{payment_id}")
+
+    async def create_refund(self, payload, idempotence_key):
+        return await self._request("POST", "refunds", payload, idempotence_key=idempotence_key)
+
+    async def get_refund(self, refund_id):
+        return await self._request("GET", f"refunds/{refund_id}")
+
+    async def list_payments(self, params=None):
+        return await self._request("GET", "payments", params=params)
+
+    async def list_refunds(self, params=None):
+        return await self._request("GET", "refunds", params=params)
+
+    async def iter_pages(self, path, params=None, limit=100):
+        """Обходит список payments или refunds по курсору, отдавая страницу за страницей.
+
+        params - фильтры API (например, created_at.gte); в памяти держится
+        только текущая страница.
+        """
+        params = dict(params or {}, limit=limit)
+        while True:
+            page = await self._request("GET", path, params=params)
+            yield page.get("items", [])
+            cursor = page.get("next_cursor")
+            if not cursor:
+                break
+            params["cursor"] = cursor
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()